@@ -5,6 +5,10 @@ import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import make_response, session
+from flask.globals import request_ctx
+from functools import wraps
+import click
 import shutil
 import zipfile
 import tempfile
@@ -12,7 +16,6 @@ from datetime import datetime, timedelta
 import json
 import re
 import hashlib
-import time
 import io
 import matplotlib
 matplotlib.use('Agg')
@@ -21,18 +24,125 @@ from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 import base64
 from io import BytesIO
 
+try:
+    from .services.storage import get_store, field_value, RECORD_ID, PAYMENT_LINES
+    from .services.atomic import atomic_path, write_excel, save_workbook
+    from .services.payments import page_transactions, page_pending_payments
+    from .services.records import RECORD_LEDGERS, page_size, ledger_filters, page_records, json_rows
+    from .services.balances import party_balance, party_balances
+    from .services.aging import aging_report, parse_buckets
+    from .services.totals import ledger_totals, verify_ledger_totals
+    from .services.rollups import rollup, monthly_pnl
+    from .services.reports import REPORTS, run_report, get_profit_loss_report
+    from .services.costing import realized_pnl
+    from .services.dashboard import DashboardSnapshot, inventory_stats, rough_inventory_stats, recent_trade
+    from .services.kapans import kapan_report
+    from .services.refresher import PayloadRefresher
+    from .services.remittances import apply_remittance, set_payment_status, apply_payment_statuses, record_rate
+except ImportError:
+    # Running as a script (python app.py) rather than as part of the package
+    from services.storage import get_store, field_value, RECORD_ID, PAYMENT_LINES
+    from services.atomic import atomic_path, write_excel, save_workbook
+    from services.payments import page_transactions, page_pending_payments
+    from services.records import RECORD_LEDGERS, page_size, ledger_filters, page_records, json_rows
+    from services.balances import party_balance, party_balances
+    from services.aging import aging_report, parse_buckets
+    from services.totals import ledger_totals, verify_ledger_totals
+    from services.rollups import rollup, monthly_pnl
+    from services.reports import REPORTS, run_report, get_profit_loss_report
+    from services.costing import realized_pnl
+    from services.dashboard import DashboardSnapshot, inventory_stats, rough_inventory_stats, recent_trade
+    from services.kapans import kapan_report
+    from services.refresher import PayloadRefresher
+    from services.remittances import apply_remittance, set_payment_status, apply_payment_statuses, record_rate
+
 app = Flask(__name__)
 app.secret_key = 'diamond_business_secret_key'
 
 # Ensure data directory exists
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DATA_DIR = os.environ.get('DIAMOND_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # Define file paths
 PURCHASES_FILE = os.path.join(DATA_DIR, 'purchases.xlsx')
 SALES_FILE = os.path.join(DATA_DIR, 'sales.xlsx')
 PAYMENTS_FILE = os.path.join(DATA_DIR, 'payments.xlsx')
-INVENTORY_FILE = 'data/inventory.xlsx'
+INVENTORY_FILE = os.path.join(DATA_DIR, 'inventory.xlsx')
+
+# Upper bound on memory used to cache ledger DataFrames between requests
+LEDGER_CACHE_MAX_BYTES = int(os.environ.get('LEDGER_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Seconds between folding the ledger's write-ahead journal into the database
+LEDGER_CHECKPOINT_INTERVAL = int(os.environ.get('LEDGER_CHECKPOINT_INTERVAL', 30))
+
+# The ledger store is the system of record; the .xlsx files above are only
+# used to seed a new store and as names for exported workbooks.
+store = get_store(DATA_DIR, cache_max_bytes=LEDGER_CACHE_MAX_BYTES,
+                  checkpoint_interval=LEDGER_CHECKPOINT_INTERVAL)
+
+# Seconds of quiet after a write before the dashboard and reports are recomputed
+PAYLOAD_REFRESH_DELAY = float(os.environ.get('PAYLOAD_REFRESH_DELAY', 2))
+
+# Seconds between checks for writes made outside this process (other
+# workers, the CLI, a reloaded app)
+PAYLOAD_POLL_INTERVAL = float(os.environ.get('PAYLOAD_POLL_INTERVAL', 5))
+
+# Recomputes the dashboard and report pages in the background after writes
+refresher = PayloadRefresher(store, delay=PAYLOAD_REFRESH_DELAY, poll=PAYLOAD_POLL_INTERVAL)
+
+def _shows_flashes():
+    """
+    Whether flash messages are pending or were shown by this response. Only
+    peeks: get_flashed_messages() would take them from the session and lose
+    them for pages that never display them.
+    """
+    return bool(session.get('_flashes') or request_ctx.flashes)
+
+def versioned(*names, vary=None):
+    """
+    Serve a GET view conditionally. The response carries an ETag derived
+    from the versions of the named ledgers and views, plus vary() if given
+    for anything else the page depends on, and without vary a Last-Modified.
+    A request that already holds the current version gets a 304 without the
+    view running. Pages showing flash messages are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            token, last_modified = store.data_version(names)
+            if vary is not None:
+                try:
+                    varies = vary()
+                except Exception as e:
+                    # Serve the page unconditionally rather than fail it
+                    app.logger.error(f"Error computing the version of {request.path}: {str(e)}")
+                    return view(*args, **kwargs)
+                token = hashlib.sha1(f'{token}|{varies}'.encode()).hexdigest()[:20]
+                # The ledgers' modification time no longer covers everything
+                last_modified = None
+            if request.if_none_match:
+                current = token in request.if_none_match
+            else:
+                since = request.if_modified_since
+                current = bool(last_modified and since and
+                               last_modified.replace(microsecond=0) <= since.replace(tzinfo=None))
+            # Pending flash messages would be missing from the cached page
+            if current and '_flashes' not in session:
+                response = make_response('', 304)
+                response.set_etag(token)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not _shows_flashes():
+                response.set_etag(token)
+                if last_modified:
+                    response.last_modified = last_modified
+                # Let clients keep the page but check back every time
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
 
 # Function to enhance Excel file formatting
 def enhance_excel_formatting(file_path, sheet_name='Sheet1'):
@@ -46,7 +156,7 @@ def enhance_excel_formatting(file_path, sheet_name='Sheet1'):
             wb = Workbook()
             sheet = wb.active
             sheet.title = sheet_name
-            wb.save(file_path)
+            save_workbook(wb, file_path)
             print(f"Created new Excel file at {file_path}")
         
         # Load the workbook directly with openpyxl
@@ -177,7 +287,7 @@ def enhance_excel_formatting(file_path, sheet_name='Sheet1'):
                 dv.add(f'{status_column}2:{status_column}{sheet.max_row}')
         
         # Save the workbook
-        wb.save(file_path)
+        save_workbook(wb, file_path)
         print(f"Successfully enhanced Excel formatting for {file_path}")
         
         # Create summary sheet if there's enough data
@@ -469,7 +579,7 @@ def create_summary_sheet(file_path):
                     cell.font = Font(name='Arial')
         
         # Save the workbook
-        wb.save(file_path)
+        save_workbook(wb, file_path)
     except Exception as e:
         print(f"Error in create_summary_sheet: {str(e)}")
         # Don't re-raise the exception, just log it and continue
@@ -875,7 +985,7 @@ def create_dashboard(file_path):
         dashboard[f'A{footer_row}'].alignment = Alignment(horizontal='center')
         
         # Save the workbook
-        wb.save(file_path)
+        save_workbook(wb, file_path)
     except Exception as e:
         print(f"Error in create_dashboard: {str(e)}")
         # Don't re-raise the exception, just log it and continue
@@ -889,27 +999,27 @@ def initialize_excel_files():
     if not os.path.exists(PURCHASES_FILE):
         df = pd.DataFrame(columns=['Date', 'Party', 'Diamond Type', 'Carats', 'Rate per Carat', 
                                   'Total Amount USD', 'Exchange Rate', 'Total Amount INR', 'Payment Status', 'Notes'])
-        df.to_excel(PURCHASES_FILE, index=False)
+        write_excel(df, PURCHASES_FILE)
         enhance_excel_formatting(PURCHASES_FILE)
     
     # Initialize sales file
     if not os.path.exists(SALES_FILE):
         df = pd.DataFrame(columns=['Date', 'Party', 'Diamond Type', 'Carats', 'Rate per Carat', 
                                   'Total Amount USD', 'Exchange Rate', 'Total Amount INR', 'Payment Status', 'Notes'])
-        df.to_excel(SALES_FILE, index=False)
+        write_excel(df, SALES_FILE)
         enhance_excel_formatting(SALES_FILE)
     
     # Initialize payments file
     if not os.path.exists(PAYMENTS_FILE):
         df = pd.DataFrame(columns=['id', 'type', 'name', 'total_amount', 'paid_amount', 'pending_amount', 
                                  'status', 'payment_date', 'payment_method', 'notes'])
-        df.to_excel(PAYMENTS_FILE, index=False)
+        write_excel(df, PAYMENTS_FILE)
     
     # Initialize inventory file
     if not os.path.exists(INVENTORY_FILE):
         df = pd.DataFrame(columns=['id', 'description', 'shape', 'carats', 'color', 'clarity', 'cut', 
                                   'purchase_price', 'market_value', 'status', 'location', 'purchase_date', 'notes'])
-        df.to_excel(INVENTORY_FILE, index=False)
+        write_excel(df, INVENTORY_FILE)
 
 @app.route('/')
 def index():
@@ -976,9 +1086,6 @@ def buy():
             payment_due_date = request.form.get('payment_due_date') or None
             payment_notes = request.form.get('payment_notes') or None
             
-            # Initialize partial_payments as None
-            partial_payments = None
-            
             # Create a new purchase record
             new_purchase = {
                 'date': date,
@@ -998,59 +1105,47 @@ def buy():
                 'payment_date': payment_date,
                 'payment_reference': payment_reference,
                 'payment_due_date': payment_due_date,
-                'payment_notes': payment_notes,
-                'partial_payments': partial_payments
+                'payment_notes': payment_notes
             }
             
-            # Load existing purchases or create a new DataFrame
-            if os.path.exists(PURCHASES_FILE):
-                purchases_df = pd.read_excel(PURCHASES_FILE)
-            else:
-                purchases_df = pd.DataFrame(columns=list(new_purchase.keys()))
-            
-            # Append the new purchase
-            purchases_df = pd.concat([purchases_df, pd.DataFrame([new_purchase])], ignore_index=True)
+            def record_purchase(tx):
+                # Append the new purchase to the ledger
+                purchase_id = tx.insert('purchases', new_purchase)
             
-            # Save the updated DataFrame
-            purchases_df.to_excel(PURCHASES_FILE, index=False)
-            
-            # Create payment record for purchase
-            if payment_status != 'Completed':
-                try:
-                    # Load existing payments or create new DataFrame
-                    if os.path.exists(PAYMENTS_FILE):
-                        payments_df = pd.read_excel(PAYMENTS_FILE)
-                    else:
-                        payments_df = pd.DataFrame(columns=['id', 'type', 'name', 'total_amount', 'paid_amount', 
-                                                          'pending_amount', 'status', 'payment_date', 
-                                                          'payment_method', 'notes', 'reference_id', 'reference_type'])
+                # Create payment record for purchase
+                if payment_status != 'Completed':
+                    try:
+                        # Generate new payment ID
+                        new_id = tx.next_ids('payment')[0]
                     
-                    # Generate new payment ID
-                    new_id = str(len(payments_df) + 1)
+                        # Create payment record
+                        new_payment = {
+                            'id': new_id,
+                            'type': 'supplier',
+                            'name': party,
+                            'total_amount': total_amount_inr,
+                            'paid_amount': 0,
+                            'pending_amount': total_amount_inr,
+                            'status': 'pending',
+                            'payment_date': pd.to_datetime(date),
+                            'payment_method': 'pending',
+                            'notes': f"Purchase payment for {description}",
+                            'reference_id': str(purchase_id),  # Record ID of the new purchase
+                            'reference_type': 'purchase'
+                        }
                     
-                    # Create payment record
-                    new_payment = {
-                        'id': new_id,
-                        'type': 'supplier',
-                        'name': party,
-                        'total_amount': total_amount_inr,
-                        'paid_amount': 0,
-                        'pending_amount': total_amount_inr,
-                        'status': 'pending',
-                        'payment_date': pd.to_datetime(date),
-                        'payment_method': 'pending',
-                        'notes': f"Purchase payment for {description}",
-                        'reference_id': str(len(purchases_df) - 1),  # Index of the new purchase
-                        'reference_type': 'purchase'
-                    }
-                    
-                    # Append new payment
-                    payments_df = pd.concat([payments_df, pd.DataFrame([new_payment])], ignore_index=True)
-                    payments_df.to_excel(PAYMENTS_FILE, index=False)
-                except Exception as e:
-                    print(f"Error creating payment record: {str(e)}")
-            
-            flash('Purchase recorded successfully!', 'success')
+                        # Append new payment
+                        tx.insert('payments', new_payment)
+                    except Exception:
+                        app.logger.exception(f"Error creating payment record for purchase {purchase_id}")
+                        return False
+                return True
+            
+            # Purchase and payment are written together on the ledger writer
+            if store.submit(record_purchase):
+                flash('Purchase recorded successfully!', 'success')
+            else:
+                flash('Purchase recorded, but its payment record could not be created.', 'warning')
             return redirect(url_for('records'))
         
         except Exception as e:
@@ -1120,9 +1215,6 @@ def sell():
             payment_due_date = request.form.get('payment_due_date') or None
             payment_notes = request.form.get('payment_notes') or None
             
-            # Initialize partial_payments as None
-            partial_payments = None
-            
             # Create a new sale record
             new_sale = {
                 'date': date,
@@ -1142,59 +1234,47 @@ def sell():
                 'payment_date': payment_date,
                 'payment_reference': payment_reference,
                 'payment_due_date': payment_due_date,
-                'payment_notes': payment_notes,
-                'partial_payments': partial_payments
+                'payment_notes': payment_notes
             }
             
-            # Load existing sales or create a new DataFrame
-            if os.path.exists(SALES_FILE):
-                sales_df = pd.read_excel(SALES_FILE)
-            else:
-                sales_df = pd.DataFrame(columns=list(new_sale.keys()))
-            
-            # Append the new sale
-            sales_df = pd.concat([sales_df, pd.DataFrame([new_sale])], ignore_index=True)
-            
-            # Save the updated DataFrame
-            sales_df.to_excel(SALES_FILE, index=False)
+            def record_sale(tx):
+                # Append the new sale to the ledger
+                sale_id = tx.insert('sales', new_sale)
             
-            # Create payment record for sale
-            if payment_status != 'Completed':
-                try:
-                    # Load existing payments or create new DataFrame
-                    if os.path.exists(PAYMENTS_FILE):
-                        payments_df = pd.read_excel(PAYMENTS_FILE)
-                    else:
-                        payments_df = pd.DataFrame(columns=['id', 'type', 'name', 'total_amount', 'paid_amount', 
-                                                          'pending_amount', 'status', 'payment_date', 
-                                                          'payment_method', 'notes', 'reference_id', 'reference_type'])
-                    
-                    # Generate new payment ID
-                    new_id = str(len(payments_df) + 1)
+                # Create payment record for sale
+                if payment_status != 'Completed':
+                    try:
+                        # Generate new payment ID
+                        new_id = tx.next_ids('payment')[0]
                     
-                    # Create payment record
-                    new_payment = {
-                        'id': new_id,
-                        'type': 'customer',
-                        'name': party,
-                        'total_amount': total_amount_inr,
-                        'paid_amount': 0,
-                        'pending_amount': total_amount_inr,
-                        'status': 'pending',
-                        'payment_date': pd.to_datetime(date),
-                        'payment_method': 'pending',
-                        'notes': f"Sale payment for {description}",
-                        'reference_id': str(len(sales_df) - 1),  # Index of the new sale
-                        'reference_type': 'sale'
-                    }
+                        # Create payment record
+                        new_payment = {
+                            'id': new_id,
+                            'type': 'customer',
+                            'name': party,
+                            'total_amount': total_amount_inr,
+                            'paid_amount': 0,
+                            'pending_amount': total_amount_inr,
+                            'status': 'pending',
+                            'payment_date': pd.to_datetime(date),
+                            'payment_method': 'pending',
+                            'notes': f"Sale payment for {description}",
+                            'reference_id': str(sale_id),  # Record ID of the new sale
+                            'reference_type': 'sale'
+                        }
                     
-                    # Append new payment
-                    payments_df = pd.concat([payments_df, pd.DataFrame([new_payment])], ignore_index=True)
-                    payments_df.to_excel(PAYMENTS_FILE, index=False)
-                except Exception as e:
-                    print(f"Error creating payment record: {str(e)}")
-            
-            flash('Sale recorded successfully!', 'success')
+                        # Append new payment
+                        tx.insert('payments', new_payment)
+                    except Exception:
+                        app.logger.exception(f"Error creating payment record for sale {sale_id}")
+                        return False
+                return True
+            
+            # Sale and payment are written together on the ledger writer
+            if store.submit(record_sale):
+                flash('Sale recorded successfully!', 'success')
+            else:
+                flash('Sale recorded, but its payment record could not be created.', 'warning')
             return redirect(url_for('records'))
         
         except Exception as e:
@@ -1203,100 +1283,147 @@ def sell():
     
     return render_template('sell.html')
 
+def record_filters():
+    """Store filters for the records page and API from the request arguments."""
+    return ledger_filters('Date', 'Party', 'Payment Status',
+                          status=request.args.get('status'),
+                          party=request.args.get('party'),
+                          start_date=request.args.get('start_date'),
+                          end_date=request.args.get('end_date'),
+                          amount_field='Total Amount USD',
+                          min_amount=request.args.get('min_amount'),
+                          max_amount=request.args.get('max_amount'))
+
+def record_page(record_type):
+    """One page of purchase or sale records for the current request."""
+    return page_records(store, record_type, record_filters(),
+                        sort=request.args.get('sort', 'date'),
+                        order=request.args.get('order', 'desc'),
+                        page=request.args.get('page', 1, type=int),
+                        per_page=page_size(request.args.get('per_page')))
+
 @app.route('/records')
 def records():
-    # Load purchase records
-    if os.path.exists(PURCHASES_FILE):
-        purchases_df = pd.read_excel(PURCHASES_FILE)
-        # Replace NaN values with None for proper handling in templates
-        purchases_df = purchases_df.replace({pd.NA: None, float('nan'): None})
-        purchases = purchases_df.to_dict('records')
-    else:
-        purchases = []
+    # Render only the first page of each ledger; the page fetches the rest from /api/records
+    purchases = record_page('purchase')
+    sales = record_page('sale')
+    return render_template('records.html', purchases=purchases['items'], sales=sales['items'],
+                           purchase_page=purchases, sale_page=sales)
+
+@app.route('/api/records')
+def api_records():
+    """
+    Paged purchase or sale records as JSON.
+    Arguments: type (purchase/sale), page, per_page, sort, order (asc/desc)
+    and the filters status, party, start_date, end_date, min_amount, max_amount.
+    """
+    record_type = request.args.get('type', 'purchase')
+    if record_type not in RECORD_LEDGERS:
+        return jsonify({'error': f'Unknown record type: {record_type}'}), 400
+    try:
+        return jsonify(record_page(record_type))
+    except Exception as e:
+        app.logger.error(f"Error in api_records: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def reports_version():
+    """Besides the rollup, the default report depends on when it was last refreshed."""
+    if request.args.get('start') or request.args.get('end'):
+        return None
+    return refresher.refreshed_at('reports')
+
+def report_metrics(start=None, end=None):
+    """Report figures for a period of 'YYYY-MM' months (everything by default)."""
+    # Sum the monthly rollup instead of the ledgers' records
+    totals = {row['ledger']: row for row in rollup(store, ('ledger',), start=start, end=end)}
+    purchase_totals = totals.get('purchases', {})
+    sale_totals = totals.get('sales', {})
+    monthly = monthly_pnl(store, start=start, end=end)
+    
+    # Calculate basic metrics
+    total_purchases = purchase_totals.get('amount_usd', 0)
+    total_sales = sale_totals.get('amount_usd', 0)
+    # Profit of the period's sales against the cost of the stones they sold
+    realized = realized_pnl(store, start, end)
+    
+    # Calculate volume metrics
+    total_carats_purchased = purchase_totals.get('carats', 0)
+    total_carats_sold = sale_totals.get('carats', 0)
     
-    # Load sales records
-    if os.path.exists(SALES_FILE):
-        sales_df = pd.read_excel(SALES_FILE)
-        # Replace NaN values with None for proper handling in templates
-        sales_df = sales_df.replace({pd.NA: None, float('nan'): None})
-        sales = sales_df.to_dict('records')
+    # Calculate average prices - prevent division by zero
+    if total_carats_purchased > 0:
+        avg_purchase_price = total_purchases / total_carats_purchased
     else:
-        sales = []
+        avg_purchase_price = 0
+        
+    if total_carats_sold > 0:
+        avg_sale_price = total_sales / total_carats_sold
+    else:
+        avg_sale_price = 0
+    
+    # Count transactions
+    purchase_count = purchase_totals.get('records', 0)
+    sales_count = sale_totals.get('records', 0)
     
-    return render_template('records.html', purchases=purchases, sales=sales)
+    # Stock and best sellers from the report engine's grouped reads; only
+    # the totals are needed, so no records are listed
+    inventory = run_report(store, 'inventory', row_limit=0)
+    rough = rough_inventory_stats(DashboardSnapshot(store))
+    period = {'start_date': f'{start}-01' if start else None,
+              'end_date': (pd.Period(end, 'M').end_time.strftime('%Y-%m-%d') if end else None)}
+    sold_shapes = sorted(run_report(store, 'sales', period, row_limit=0)['by_shape'],
+                         key=lambda row: row['amount_inr'], reverse=True)
+    
+    return {
+        'total_purchases': total_purchases,
+        'total_sales': total_sales,
+        'profit': realized['realized_profit'],
+        'profit_percentage': realized['profit_percentage'],
+        'profit_margin': realized['profit_margin'],
+        'cost_of_goods_sold': realized['cost_of_goods_sold'],
+        'unmatched_sales_count': realized['unmatched_sales_count'],
+        'total_carats_purchased': total_carats_purchased,
+        'total_carats_sold': total_carats_sold,
+        'avg_purchase_price': avg_purchase_price,
+        'avg_sale_price': avg_sale_price,
+        'purchase_count': purchase_count,
+        'sales_count': sales_count,
+        'total_inventory_value': inventory['summary']['market_value'],
+        'total_inventory_carats': inventory['summary']['carats'],
+        'total_rough_inventory_value': rough['total_value'],
+        'total_rough_inventory_weight': rough['total_weight'],
+        'inventory_categories': [row['shape'] or 'Unknown' for row in inventory['by_shape']],
+        'inventory_distribution': [row['carats'] for row in inventory['by_shape']],
+        'top_selling_items': [{'name': row['shape'] or 'Unknown', 'quantity': row['pcs'],
+                               'revenue': row['amount_inr']} for row in sold_shapes[:5]],
+        'months': [month['month'] for month in monthly],
+        'monthly_sales': [month['sales_amount_usd'] for month in monthly],
+        'monthly_purchases': [month['purchases_amount_usd'] for month in monthly]
+    }
 
 @app.route('/reports')
+@versioned('monthly_rollup', 'purchases', 'sales', 'inventory', 'rough_inventory', vary=reports_version)
 def reports():
     """Generate comprehensive business reports and analytics."""
-    # Check if the purchases file exists
-    if not os.path.exists(PURCHASES_FILE):
-        flash('No purchase records found. Please add some purchases first.', 'warning')
-        return redirect(url_for('index'))
-    
-    # Check if the sales file exists
-    if not os.path.exists(SALES_FILE):
-        flash('No sales records found. Please add some sales first.', 'warning')
-        return redirect(url_for('index'))
-    
-    # Load purchases and sales data
-    purchases_df = pd.read_excel(PURCHASES_FILE)
-    sales_df = pd.read_excel(SALES_FILE)
+    # Optional period, as 'YYYY-MM' months, both inclusive
+    start, end = request.args.get('start'), request.args.get('end')
     
     try:
-        # Calculate basic metrics
-        total_purchases = purchases_df['Total Amount USD'].sum() if 'Total Amount USD' in purchases_df.columns else 0
-        total_sales = sales_df['Total Amount USD'].sum() if 'Total Amount USD' in sales_df.columns else 0
-        profit = total_sales - total_purchases
-        
-        # Calculate profit percentage - prevent division by zero
-        if total_purchases > 0:
-            profit_percentage = (profit / total_purchases * 100)
-        else:
-            profit_percentage = 0
-            if profit > 0:
-                # If there's profit but no purchases, set to 100%
-                profit_percentage = 100
-        
-        # Calculate volume metrics
-        total_carats_purchased = purchases_df['Carat'].sum() if 'Carat' in purchases_df.columns else 0
-        total_carats_sold = sales_df['Carat'].sum() if 'Carat' in sales_df.columns else 0
-        
-        # Calculate average prices - prevent division by zero
-        if total_carats_purchased > 0:
-            avg_purchase_price = total_purchases / total_carats_purchased
-        else:
-            avg_purchase_price = 0
-            
-        if total_carats_sold > 0:
-            avg_sale_price = total_sales / total_carats_sold
+        if start or end:
+            report_data, refreshed_at = report_metrics(start, end), datetime.now()
         else:
-            avg_sale_price = 0
-        
-        # Count transactions
-        purchase_count = len(purchases_df)
-        sales_count = len(sales_df)
-        
-        # Prepare report data
-        report_data = {
-            'total_purchases': total_purchases,
-            'total_sales': total_sales,
-            'profit': profit,
-            'profit_percentage': profit_percentage,
-            'total_carats_purchased': total_carats_purchased,
-            'total_carats_sold': total_carats_sold,
-            'avg_purchase_price': avg_purchase_price,
-            'avg_sale_price': avg_sale_price,
-            'purchase_count': purchase_count,
-            'sales_count': sales_count
-        }
+            # The whole-history report is kept fresh in the background
+            report_data, refreshed_at = refresher.get('reports')
     except Exception as e:
         flash(f'Error generating reports: {str(e)}', 'danger')
+        refreshed_at = None
         # Provide default values for the report data
         report_data = {
             'total_purchases': 0,
             'total_sales': 0,
             'profit': 0,
             'profit_percentage': 0,
+            'profit_margin': 0,
             'total_carats_purchased': 0,
             'total_carats_sold': 0,
             'avg_purchase_price': 0,
@@ -1305,184 +1432,210 @@ def reports():
             'sales_count': 0
         }
     
-    return render_template('reports.html', report_data=report_data)
+    return render_template('reports.html', report_data=report_data, refreshed_at=refreshed_at)
+
+@app.route('/api/reports/rollup')
+@versioned('monthly_rollup')
+def api_rollup():
+    """
+    Sums of the monthly rollup as JSON.
+    Arguments: group_by (comma separated, from month, ledger, party, platform,
+    shape; default month,ledger), start and end ('YYYY-MM'), ledger, party,
+    platform and shape. With pnl=1, sales against purchases per month instead.
+    """
+    filters = {name: request.args.get(name) for name in ('party', 'platform', 'shape')}
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        if request.args.get('pnl') in ('1', 'true'):
+            return jsonify({'items': monthly_pnl(store, start=start, end=end, **filters)})
+        group_by = [g for g in request.args.get('group_by', 'month,ledger').split(',') if g]
+        ledger = request.args.get('ledger')
+        items = rollup(store, group_by, ledgers=[ledger] if ledger else None, start=start, end=end,
+                       **filters)
+        return jsonify({'items': items})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in api_rollup: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/dashboard')
-def dashboard():
-    # Check if the purchases file exists
-    if not os.path.exists(PURCHASES_FILE):
-        flash('No purchase records found. Please add some purchases first.', 'warning')
-        return redirect(url_for('index'))
-    
-    # Check if the sales file exists
-    if not os.path.exists(SALES_FILE):
-        flash('No sales records found. Please add some sales first.', 'warning')
+@app.route('/api/reports/<name>', methods=['GET', 'POST'])
+def api_report(name):
+    """
+    A report as JSON: sales, purchases, inventory or payments (totals, a
+    monthly trend, breakdowns and the newest matching records), or
+    profit_loss. Filters come from the query string, or the form on POST:
+    start_date, end_date and the report's own, e.g. party, platform, shape
+    and status. Only the matching records are read.
+    """
+    filters = request.form.to_dict() if request.method == 'POST' else request.args.to_dict()
+    if name != 'profit_loss' and name not in REPORTS:
+        return jsonify({'error': f'Unknown report: {name}'}), 404
+    try:
+        if name == 'profit_loss':
+            return jsonify(get_profit_loss_report(filters, store))
+        return jsonify(run_report(store, name, filters))
+    except Exception as e:
+        app.logger.error(f"Error in api_report: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def aging_version():
+    """Besides the ledgers, aging depends on the day, or for the default report on its last refresh."""
+    if request.args.get('buckets') or request.args.get('as_of'):
+        return datetime.now().date()
+    return refresher.refreshed_at('aging')
+
+@app.route('/reports/aging', methods=['GET', 'POST'])
+@versioned('purchases', 'sales', PAYMENT_LINES, vary=aging_version)
+def aging():
+    """Receivables and payables aging by party and platform (JSON on POST)."""
+    filters = request.form.to_dict() if request.method == 'POST' else request.args.to_dict()
+    try:
+        if filters.get('buckets') or filters.get('as_of'):
+            report_data, refreshed_at = aging_report(store, parse_buckets(filters.get('buckets')),
+                                                     filters.get('as_of')), datetime.now()
+        else:
+            # The default buckets as of today are kept fresh in the background
+            report_data, refreshed_at = refresher.get('aging')
+    except Exception as e:
+        app.logger.error(f"Error generating aging report: {str(e)}")
+        if request.method == 'POST':
+            return jsonify({'error': str(e)}), 500
+        flash(f'Error generating aging report: {str(e)}', 'error')
         return redirect(url_for('index'))
-    
-    # Load purchases and sales data
+    if request.method == 'POST':
+        return jsonify({**report_data, 'refreshed_at': refreshed_at.isoformat(timespec='seconds')})
+    return render_template('reports/aging_report.html', data=report_data, refreshed_at=refreshed_at)
+
+def kapans_version():
+    """Besides the ledgers, the report of all kapans depends on when it was last refreshed."""
+    if request.args.get('kapan'):
+        return None
+    return refresher.refreshed_at('kapans')
+
+@app.route('/reports/kapans', methods=['GET', 'POST'])
+@versioned('purchases', 'sales', 'rough_inventory', vary=kapans_version)
+def kapans():
+    """Rough in, polished out, yield and realized margin per kapan (JSON on POST)."""
+    filters = request.form.to_dict() if request.method == 'POST' else request.args.to_dict()
+    # Optional comma separated kapan numbers
+    selected = [k.strip() for k in (filters.get('kapan') or '').split(',') if k.strip()]
     try:
-        purchases_df = pd.read_excel(PURCHASES_FILE)
-        sales_df = pd.read_excel(SALES_FILE)
+        if selected:
+            report_data, refreshed_at = kapan_report(store, selected), datetime.now()
+        else:
+            # The report of all kapans is kept fresh in the background
+            report_data, refreshed_at = refresher.get('kapans')
     except Exception as e:
-        flash(f'Error loading Excel files: {str(e)}', 'danger')
+        app.logger.error(f"Error generating kapan report: {str(e)}")
+        if request.method == 'POST':
+            return jsonify({'error': str(e)}), 500
+        flash(f'Error generating kapan report: {str(e)}', 'error')
         return redirect(url_for('index'))
+    if request.method == 'POST':
+        return jsonify({**report_data, 'refreshed_at': refreshed_at.isoformat(timespec='seconds')})
+    return render_template('reports/kapan_report.html', data=report_data, refreshed_at=refreshed_at)
+
+def dashboard_metrics():
+    """
+    Dashboard figures from the ledger totals the store maintains, the
+    lot-matched sales and one snapshot of the inventory ledgers.
+    """
+    totals = ledger_totals(store)
+    snapshot = DashboardSnapshot(store)
+    purchase_totals, sale_totals = totals['purchases'], totals['sales']
     
-    # Calculate totals - handle different column name formats
+    total_purchases = purchase_totals['amount_usd']
+    total_sales = sale_totals['amount_usd']
+    
+    # Profit of the sales against the cost of the stones they sold; stones
+    # still on hand are stock, not a loss
+    realized = realized_pnl(store)
+    
+    return {
+        'total_purchases': total_purchases,
+        'total_sales': total_sales,
+        'profit': realized['realized_profit'],
+        'profit_percentage': realized['profit_percentage'],
+        'profit_margin': realized['profit_margin'],
+        'cost_of_goods_sold': realized['cost_of_goods_sold'],
+        'unmatched_sales_count': realized['unmatched_sales_count'],
+        'stock_on_hand_carats': realized['stock_on_hand_carats'],
+        'stock_on_hand_usd': realized['stock_on_hand_usd'],
+        # Volume metrics
+        'total_carats_purchased': purchase_totals['carats'],
+        'total_carats_sold': sale_totals['carats'],
+        'purchase_count': purchase_totals['records'],
+        'sales_count': sale_totals['records'],
+        'total_pcs_purchased': purchase_totals['pcs'],
+        'total_pcs_sold': sale_totals['pcs'],
+        # Payment statuses
+        'completed_purchase_count': purchase_totals['statuses'].get('Completed', 0),
+        'pending_purchase_count': purchase_totals['statuses'].get('Pending', 0),
+        'partial_purchase_count': purchase_totals['statuses'].get('Partial', 0),
+        'completed_sale_count': sale_totals['statuses'].get('Completed', 0),
+        'pending_sale_count': sale_totals['statuses'].get('Pending', 0),
+        'partial_sale_count': sale_totals['statuses'].get('Partial', 0),
+        # Stock
+        'inventory_stats': inventory_stats(snapshot),
+        'rough_inventory_stats': rough_inventory_stats(snapshot),
+        # Sales and purchases of the last days
+        'recent_sales': recent_trade(snapshot, 'sales'),
+        'recent_purchases': recent_trade(snapshot, 'purchases')
+    }
+
+@app.route('/dashboard')
+@versioned('ledger_totals', 'purchases', 'sales', 'inventory', 'rough_inventory',
+           vary=lambda: refresher.refreshed_at('dashboard'))
+def dashboard():
+    # Served from the background refresher; it recomputes the figures shortly
+    # after writes, so opening the dashboard never waits on them
     try:
-        # Try different possible column names for total amount
-        if 'Total Amount USD' in purchases_df.columns:
-            total_purchases = purchases_df['Total Amount USD'].sum()
-        elif 'Total Amount (USD)' in purchases_df.columns:
-            total_purchases = purchases_df['Total Amount (USD)'].sum()
-        elif 'Total Amount' in purchases_df.columns:
-            total_purchases = purchases_df['Total Amount'].sum()
-        else:
-            # If no matching column is found, use 0
-            flash('Warning: Could not find total amount column in purchases file', 'warning')
-            total_purchases = 0
-        
-        if 'Total Amount USD' in sales_df.columns:
-            total_sales = sales_df['Total Amount USD'].sum()
-        elif 'Total Amount (USD)' in sales_df.columns:
-            total_sales = sales_df['Total Amount (USD)'].sum()
-        elif 'Total Amount' in sales_df.columns:
-            total_sales = sales_df['Total Amount'].sum()
-        else:
-            # If no matching column is found, use 0
-            flash('Warning: Could not find total amount column in sales file', 'warning')
-            total_sales = 0
-        
-        profit = total_sales - total_purchases
-        
-        # Calculate profit percentage with safe division
-        if total_purchases > 0:
-            profit_percentage = (profit / total_purchases) * 100
-        else:
-            # Handle division by zero
-            if profit > 0:
-                # If there's profit but no purchases, set to 100%
-                profit_percentage = 100
-            elif profit < 0:
-                # If there's loss but no purchases, set to -100%
-                profit_percentage = -100
-            else:
-                # If no profit and no purchases, set to 0%
-                profit_percentage = 0
-        
-        # Calculate volume metrics
-        if 'Carat' in purchases_df.columns:
-            total_carats_purchased = purchases_df['Carat'].sum()
-        else:
-            total_carats_purchased = 0
-            
-        if 'Carat' in sales_df.columns:
-            total_carats_sold = sales_df['Carat'].sum()
-        else:
-            total_carats_sold = 0
-            
-        # Count transactions
-        purchase_count = len(purchases_df)
-        sales_count = len(sales_df)
-        
-        # Calculate total pieces
-        total_pcs_purchased = purchases_df['Pcs'].sum() if 'Pcs' in purchases_df.columns else 0
-        total_pcs_sold = sales_df['Pcs'].sum() if 'Pcs' in sales_df.columns else 0
-        
-        # Count payment statuses for purchases
-        if 'Payment Status' in purchases_df.columns:
-            completed_purchase_count = len(purchases_df[purchases_df['Payment Status'] == 'Completed'])
-            pending_purchase_count = len(purchases_df[purchases_df['Payment Status'] == 'Pending'])
-            partial_purchase_count = len(purchases_df[purchases_df['Payment Status'] == 'Partial'])
-        else:
-            completed_purchase_count = 0
-            pending_purchase_count = 0
-            partial_purchase_count = 0
-        
-        # Count payment statuses for sales
-        if 'Payment Status' in sales_df.columns:
-            completed_sale_count = len(sales_df[sales_df['Payment Status'] == 'Completed'])
-            pending_sale_count = len(sales_df[sales_df['Payment Status'] == 'Pending'])
-            partial_sale_count = len(sales_df[sales_df['Payment Status'] == 'Partial'])
-        else:
-            completed_sale_count = 0
-            pending_sale_count = 0
-            partial_sale_count = 0
-        
+        metrics, refreshed_at = refresher.get('dashboard')
     except Exception as e:
-        flash(f'Error calculating dashboard metrics: {str(e)}', 'danger')
-        total_purchases = 0
-        total_sales = 0
-        profit = 0
-        profit_percentage = 0
-        total_carats_purchased = 0
-        total_carats_sold = 0
-        purchase_count = 0
-        sales_count = 0
-        total_pcs_purchased = 0
-        total_pcs_sold = 0
-        completed_purchase_count = 0
-        pending_purchase_count = 0
-        partial_purchase_count = 0
-        completed_sale_count = 0
-        pending_sale_count = 0
-        partial_sale_count = 0
+        flash(f'Error loading ledgers: {str(e)}', 'danger')
+        return redirect(url_for('index'))
     
-    return render_template('dashboard.html', 
-                           total_purchases=total_purchases,
-                           total_sales=total_sales,
-                           profit=profit,
-                           profit_percentage=profit_percentage,
-                           total_carats_purchased=total_carats_purchased,
-                           total_carats_sold=total_carats_sold,
-                           purchase_count=purchase_count,
-                           sales_count=sales_count,
-                           total_pcs_purchased=total_pcs_purchased,
-                           total_pcs_sold=total_pcs_sold,
-                           completed_purchase_count=completed_purchase_count,
-                           pending_purchase_count=pending_purchase_count,
-                           partial_purchase_count=partial_purchase_count,
-                           completed_sale_count=completed_sale_count,
-                           pending_sale_count=pending_sale_count,
-                           partial_sale_count=partial_sale_count)
+    return render_template('dashboard.html', refreshed_at=refreshed_at, **metrics)
+
+# Pages kept computed ahead of requests, and what each is derived from
+# The dashboard's recent windows move with the date too
+refresher.register('dashboard', dashboard_metrics,
+                   depends_on=['ledger_totals', 'purchases', 'sales', 'inventory', 'rough_inventory'],
+                   max_age=3600)
+refresher.register('reports', report_metrics,
+                   depends_on=['monthly_rollup', 'purchases', 'sales', 'inventory', 'rough_inventory'])
+# Aging depends on the date too, so it is recomputed at least hourly
+refresher.register('aging', lambda: aging_report(store),
+                   depends_on=['purchases', 'sales', PAYMENT_LINES], max_age=3600)
+refresher.register('kapans', lambda: kapan_report(store), depends_on=['purchases', 'sales', 'rough_inventory'])
+refresher.start()
 
 @app.route('/delete_record', methods=['POST'])
 def delete_record():
     record_type = request.form.get('record_type')
-    record_index = request.form.get('record_index')
+    record_id = request.form.get('record_id')
     
-    if not record_type or not record_index:
+    if not record_type or not record_id:
         flash('Invalid request', 'danger')
         return redirect(url_for('records'))
     
     try:
-        record_index = int(record_index)
+        record_id = int(record_id)
         
         if record_type == 'purchase':
-            file_path = PURCHASES_FILE
+            ledger = 'purchases'
         elif record_type == 'sale':
-            file_path = SALES_FILE
+            ledger = 'sales'
         else:
             flash('Invalid record type', 'danger')
             return redirect(url_for('records'))
         
-        # Load the data
-        if not os.path.exists(file_path):
-            flash('Record file not found', 'danger')
-            return redirect(url_for('records'))
-        
-        df = pd.read_excel(file_path)
-        
-        if record_index < 0 or record_index >= len(df):
+        # Delete the record
+        if not store.delete(ledger, record_id):
             flash('Record not found', 'danger')
             return redirect(url_for('records'))
         
-        # Delete the record
-        df = df.drop(record_index).reset_index(drop=True)
-        
-        # Save the updated dataframe
-        df.to_excel(file_path, index=False)
-        enhance_excel_formatting(file_path)
-        
         flash('Record deleted successfully!', 'success')
         
     except Exception as e:
@@ -1491,23 +1644,19 @@ def delete_record():
     return redirect(url_for('records'))
 
 @app.route('/export/<file_type>')
+@versioned('purchases', 'sales')
 def export(file_type):
     try:
         if file_type == 'purchases':
-            source_file = PURCHASES_FILE
+            ledger = 'purchases'
             filename = 'diamond_purchases.xlsx'
         elif file_type == 'sales':
-            source_file = SALES_FILE
+            ledger = 'sales'
             filename = 'diamond_sales.xlsx'
         else:
             flash('Invalid file type', 'danger')
             return redirect(url_for('records'))
         
-        # Ensure the source file exists
-        if not os.path.exists(source_file):
-            flash(f'Source file not found: {source_file}', 'danger')
-            return redirect(url_for('records'))
-        
         # Create a temporary directory if it doesn't exist
         temp_dir = os.path.join(DATA_DIR, 'temp')
         os.makedirs(temp_dir, exist_ok=True)
@@ -1515,37 +1664,22 @@ def export(file_type):
         # Create a unique temporary file path
         temp_file = os.path.join(temp_dir, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}")
         
-        # Read the source file with pandas
-        try:
-            df = pd.read_excel(source_file)
-            
-            # Write to the temporary file
-            with pd.ExcelWriter(temp_file, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Sheet1')
-                
-            # Enhance the Excel file after it's been properly saved
-            enhance_excel_formatting(temp_file)
-            
-            # Send the file to the user
-            return send_file(
-                temp_file,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        except Exception as e:
-            # If there's an error with pandas, try a direct file copy
-            import shutil
-            shutil.copy2(source_file, temp_file)
+        # Generate the workbook from the ledger store
+        df = store.read(ledger)
+        
+        # Write to the temporary file
+        write_excel(df, temp_file, sheet_name='Sheet1')
             
-            # Send the file to the user without enhancement
-            flash(f'Warning: Could not enhance the Excel file. Sending original format.', 'warning')
-            return send_file(
-                temp_file,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        # Enhance the Excel file after it's been properly saved
+        enhance_excel_formatting(temp_file)
+        
+        # Send the file to the user
+        return send_file(
+            temp_file,
+            as_attachment=True,
+            download_name=filename,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
             
     except Exception as e:
         flash(f'Error exporting file: {str(e)}', 'danger')
@@ -1555,36 +1689,19 @@ def export(file_type):
 def debug_excel():
     """Debug route to display Excel file information."""
     try:
-        purchases_info = {}
-        sales_info = {}
-        
-        if os.path.exists(PURCHASES_FILE):
-            purchases_df = pd.read_excel(PURCHASES_FILE)
-            purchases_info = {
-                'exists': True,
-                'columns': list(purchases_df.columns),
-                'row_count': len(purchases_df),
-                'file_path': PURCHASES_FILE
-            }
-        else:
-            purchases_info = {
-                'exists': False,
-                'file_path': PURCHASES_FILE
-            }
-            
-        if os.path.exists(SALES_FILE):
-            sales_df = pd.read_excel(SALES_FILE)
-            sales_info = {
-                'exists': True,
-                'columns': list(sales_df.columns),
-                'row_count': len(sales_df),
-                'file_path': SALES_FILE
-            }
-        else:
-            sales_info = {
-                'exists': False,
-                'file_path': SALES_FILE
-            }
+        purchases_info = {
+            'exists': True,
+            'columns': store.columns('purchases'),
+            'row_count': store.count('purchases'),
+            'file_path': store.db_path
+        }
+        
+        sales_info = {
+            'exists': True,
+            'columns': store.columns('sales'),
+            'row_count': store.count('sales'),
+            'file_path': store.db_path
+        }
             
         return render_template('debug_excel.html', 
                               purchases_info=purchases_info,
@@ -1593,8 +1710,7 @@ def debug_excel():
         return f"""
         <h1>Excel Debug Information</h1>
         <p style="color: red;">Error: {str(e)}</p>
-        <p>Purchases file path: {PURCHASES_FILE}</p>
-        <p>Sales file path: {SALES_FILE}</p>
+        <p>Ledger database path: {store.db_path}</p>
         """
 
 @app.route('/reinitialize_excel', methods=['GET', 'POST'])
@@ -1608,37 +1724,29 @@ def reinitialize_excel():
             # Backup existing files if they exist
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             
-            if os.path.exists(PURCHASES_FILE):
-                backup_file = os.path.join(backup_dir, f'purchases_backup_{timestamp}.xlsx')
-                import shutil
-                shutil.copy2(PURCHASES_FILE, backup_file)
-                flash(f'Backed up purchases file to {backup_file}', 'info')
+            backup_file = os.path.join(backup_dir, f'purchases_backup_{timestamp}.xlsx')
+            store.export_excel('purchases', backup_file)
+            flash(f'Backed up purchases file to {backup_file}', 'info')
             
-            if os.path.exists(SALES_FILE):
-                backup_file = os.path.join(backup_dir, f'sales_backup_{timestamp}.xlsx')
-                import shutil
-                shutil.copy2(SALES_FILE, backup_file)
-                flash(f'Backed up sales file to {backup_file}', 'info')
+            backup_file = os.path.join(backup_dir, f'sales_backup_{timestamp}.xlsx')
+            store.export_excel('sales', backup_file)
+            flash(f'Backed up sales file to {backup_file}', 'info')
             
-            # Create new purchases file
+            # Create new purchases ledger
             purchases_df = pd.DataFrame(columns=[
                 'Date', 'Party', 'Description', 'Stone ID', 'Rough ID', 'Kapan No', 'Platform',
                 'Carat', 'Than', 'Pcs', 'Price Per Carat', 'Price Per Carat INR', 'Rate', 'Total Amount USD', 'Total Amount INR',
                 'Payment Status', 'Reference Party', 'Payment Due Date', 'Payment Days', 'Payment Done Date', 'Notes'
             ])
-            purchases_df.to_excel(PURCHASES_FILE, index=False)
+            store.replace('purchases', purchases_df)
             
-            # Create new sales file
+            # Create new sales ledger
             sales_df = pd.DataFrame(columns=[
                 'Date', 'Party', 'Description', 'Stone ID', 'Rough ID', 'Kapan No', 'Platform',
                 'Carat', 'Than', 'Pcs', 'Price Per Carat', 'Price Per Carat INR', 'Rate', 'Total Amount USD', 'Total Amount INR',
                 'Payment Status', 'Reference Party', 'Payment Due Date', 'Payment Days', 'Payment Done Date', 'Notes'
             ])
-            sales_df.to_excel(SALES_FILE, index=False)
-            
-            # Apply formatting
-            enhance_excel_formatting(PURCHASES_FILE)
-            enhance_excel_formatting(SALES_FILE)
+            store.replace('sales', sales_df)
             
             flash('Excel files have been reinitialized successfully!', 'success')
             return redirect(url_for('index'))
@@ -1648,24 +1756,18 @@ def reinitialize_excel():
     
     return render_template('reinitialize_confirm.html')
 
-@app.route('/edit_record/<record_type>/<int:record_index>', methods=['GET', 'POST'])
-def edit_record(record_type, record_index):
+@app.route('/edit_record/<record_type>/<int:record_id>', methods=['GET', 'POST'])
+def edit_record(record_type, record_id):
     if record_type not in ['purchase', 'sale']:
         flash('Invalid record type.', 'danger')
         return redirect(url_for('records'))
     
-    file_path = PURCHASES_FILE if record_type == 'purchase' else SALES_FILE
-    
-    if not os.path.exists(file_path):
-        flash(f'No {record_type} records found.', 'danger')
-        return redirect(url_for('records'))
+    ledger = 'purchases' if record_type == 'purchase' else 'sales'
     
     try:
-        df = pd.read_excel(file_path)
-        df = df.replace({pd.NA: None, float('nan'): None})
-        
-        if record_index < 0 or record_index >= len(df):
-            flash('Invalid record index.', 'danger')
+        record = store.get(ledger, record_id)
+        if record is None:
+            flash('Record not found.', 'danger')
             return redirect(url_for('records'))
         
         if request.method == 'POST':
@@ -1684,37 +1786,37 @@ def edit_record(record_type, record_index):
                     carat = float(request.form.get('carat'))
                     if carat <= 0:
                         flash('Carat must be greater than 0', 'danger')
-                        return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                        return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 except (ValueError, TypeError):
                     flash('Invalid carat value', 'danger')
-                    return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                    return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 
                 try:
                     quantity = int(request.form.get('quantity'))
                     if quantity <= 0:
                         flash('Quantity must be greater than 0', 'danger')
-                        return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                        return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 except (ValueError, TypeError):
                     flash('Invalid quantity value', 'danger')
-                    return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                    return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 
                 try:
                     price_per_carat = float(request.form.get('price_per_carat'))
                     if price_per_carat <= 0:
                         flash('Price per carat must be greater than 0', 'danger')
-                        return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                        return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 except (ValueError, TypeError):
                     flash('Invalid price per carat value', 'danger')
-                    return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                    return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 
                 try:
                     price_per_carat_inr = float(request.form.get('price_per_carat_inr'))
                     if price_per_carat_inr <= 0:
                         flash('Price per carat (INR) must be greater than 0', 'danger')
-                        return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                        return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 except (ValueError, TypeError):
                     flash('Invalid price per carat (INR) value', 'danger')
-                    return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                    return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
                 
                 # Calculate total amounts
                 total_amount_usd = carat * price_per_carat
@@ -1727,48 +1829,45 @@ def edit_record(record_type, record_index):
                 payment_due_date = request.form.get('payment_due_date') or None
                 payment_notes = request.form.get('payment_notes') or None
                 
-                # Preserve existing partial payments
-                partial_payments = df.at[record_index, 'partial_payments']
-                
                 # Update record
-                df.at[record_index, 'Date'] = date
-                df.at[record_index, 'Party'] = party
-                df.at[record_index, 'Description'] = description
-                df.at[record_index, 'Stone ID'] = stone_id
-                df.at[record_index, 'Rough ID'] = rough_id
-                df.at[record_index, 'Kapan No'] = kapan_no
-                df.at[record_index, 'Platform'] = platform
-                df.at[record_index, 'Carat'] = carat
-                df.at[record_index, 'Quantity'] = quantity
-                df.at[record_index, 'Price Per Carat'] = price_per_carat
-                df.at[record_index, 'Price Per Carat INR'] = price_per_carat_inr
-                df.at[record_index, 'Total Amount USD'] = total_amount_usd
-                df.at[record_index, 'Total Amount INR'] = total_amount_inr
-                df.at[record_index, 'Payment Status'] = payment_status
-                df.at[record_index, 'Payment Done Date'] = payment_date
-                df.at[record_index, 'Reference Party'] = payment_reference
-                df.at[record_index, 'Payment Due Date'] = payment_due_date
-                df.at[record_index, 'Notes'] = payment_notes
+                changes = {
+                    'Date': date,
+                    'Party': party,
+                    'Description': description,
+                    'Stone ID': stone_id,
+                    'Rough ID': rough_id,
+                    'Kapan No': kapan_no,
+                    'Platform': platform,
+                    'Carat': carat,
+                    'Quantity': quantity,
+                    'Price Per Carat': price_per_carat,
+                    'Price Per Carat INR': price_per_carat_inr,
+                    'Total Amount USD': total_amount_usd,
+                    'Total Amount INR': total_amount_inr,
+                    'Payment Status': payment_status,
+                    'Payment Done Date': payment_date,
+                    'Reference Party': payment_reference,
+                    'Payment Due Date': payment_due_date,
+                    'Notes': payment_notes
+                }
                 
-                # If status is not Partial, clear partial payments
-                if payment_status != 'Partial':
-                    df.at[record_index, 'partial_payments'] = None
-                else:
-                    # Keep existing partial payments
-                    df.at[record_index, 'partial_payments'] = partial_payments
+                def save_record(tx):
+                    # If status is not Partial, clear partial payments; otherwise keep them
+                    if payment_status != 'Partial':
+                        tx.clear_payment_lines(ledger, record_id)
+                    return tx.update(ledger, record_id, changes)
                 
-                # Save the updated DataFrame
-                df.to_excel(file_path, index=False)
+                # Save the updated record
+                store.submit(save_record)
                 
                 flash(f'{record_type.capitalize()} record updated successfully!', 'success')
                 return redirect(url_for('records'))
             
             except Exception as e:
                 flash(f'Error updating record: {str(e)}', 'danger')
-                return redirect(url_for('edit_record', record_type=record_type, record_index=record_index))
+                return redirect(url_for('edit_record', record_type=record_type, record_id=record_id))
         
         # GET request - display the form with current values
-        record = df.iloc[record_index].to_dict()
         
         # Use the appropriate template based on record type
         template_name = f'edit_{record_type}.html'
@@ -1777,7 +1876,7 @@ def edit_record(record_type, record_index):
             template_name,
             record=record,
             record_type=record_type,
-            record_index=record_index
+            record_id=record_id
         )
     
     except Exception as e:
@@ -1800,14 +1899,21 @@ def backup():
         zip_filename = f'diamond_data_backup_{timestamp}.zip'
         zip_path = os.path.join(backup_dir, zip_filename)
         
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            # Add purchases file if it exists
-            if os.path.exists(PURCHASES_FILE):
-                zipf.write(PURCHASES_FILE, os.path.basename(PURCHASES_FILE))
-            
-            # Add sales file if it exists
-            if os.path.exists(SALES_FILE):
-                zipf.write(SALES_FILE, os.path.basename(SALES_FILE))
+        # Build the zip under a temporary name so an interrupted backup never
+        # leaves a truncated archive among the real ones
+        with tempfile.TemporaryDirectory() as temp_dir, atomic_path(zip_path) as partial_zip, \
+                zipfile.ZipFile(partial_zip, 'w') as zipf:
+            # Add a consistent copy of the ledger database
+            db_copy = store.backup_to(os.path.join(temp_dir, os.path.basename(store.db_path)))
+            zipf.write(db_copy, os.path.basename(store.db_path))
+            
+            # Add purchases and sales workbooks exported from the ledger, with
+            # their record IDs so payments still reference the right records
+            # when only the workbooks are restored
+            for ledger, source_file in (('purchases', PURCHASES_FILE), ('sales', SALES_FILE)):
+                export_file = store.export_excel(ledger, os.path.join(temp_dir, os.path.basename(source_file)),
+                                                 record_ids=True)
+                zipf.write(export_file, os.path.basename(source_file))
         
         # Send the zip file to the user
         return send_file(
@@ -1856,30 +1962,26 @@ def restore():
                 with zipfile.ZipFile(backup_path, 'r') as zipf:
                     zipf.extractall(temp_dir)
                 
-                # Create backup of current files before restoring
+                # Create backup of current ledgers before restoring
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 backup_dir = os.path.join(DATA_DIR, 'backup')
                 os.makedirs(backup_dir, exist_ok=True)
                 
-                if os.path.exists(PURCHASES_FILE):
-                    backup_purchases = os.path.join(backup_dir, f'purchases_before_restore_{timestamp}.xlsx')
-                    shutil.copy2(PURCHASES_FILE, backup_purchases)
-                
-                if os.path.exists(SALES_FILE):
-                    backup_sales = os.path.join(backup_dir, f'sales_before_restore_{timestamp}.xlsx')
-                    shutil.copy2(SALES_FILE, backup_sales)
+                store.backup_to(os.path.join(backup_dir, f'ledger_before_restore_{timestamp}.db'))
                 
-                # Restore the files
+                # Restore the ledger database, or the workbooks from older backups
+                extracted_db = os.path.join(temp_dir, os.path.basename(store.db_path))
                 extracted_purchases = os.path.join(temp_dir, os.path.basename(PURCHASES_FILE))
                 extracted_sales = os.path.join(temp_dir, os.path.basename(SALES_FILE))
                 
-                if os.path.exists(extracted_purchases):
-                    shutil.copy2(extracted_purchases, PURCHASES_FILE)
-                    enhance_excel_formatting(PURCHASES_FILE)
-                
-                if os.path.exists(extracted_sales):
-                    shutil.copy2(extracted_sales, SALES_FILE)
-                    enhance_excel_formatting(SALES_FILE)
+                if os.path.exists(extracted_db):
+                    store.restore_from(extracted_db)
+                else:
+                    if os.path.exists(extracted_purchases):
+                        store.import_excel('purchases', extracted_purchases)
+                    
+                    if os.path.exists(extracted_sales):
+                        store.import_excel('sales', extracted_sales)
                 
                 flash('Data restored successfully!', 'success')
                 return redirect(url_for('index'))
@@ -1893,7 +1995,7 @@ def restore():
 @app.route('/update_payment_status', methods=['POST'])
 def update_payment_status():
     record_type = request.form.get('record_type')
-    record_index = request.form.get('record_index')
+    record_id = request.form.get('record_id')
     new_status = request.form.get('payment_status')
     payment_done_date = request.form.get('payment_done_date')
     total_amount_inr = request.form.get('total_amount_inr')
@@ -1907,27 +2009,23 @@ def update_payment_status():
     payment_currency = request.form.get('payment_currency', 'INR')  # Default to INR
     
     try:
-        record_index = int(record_index)
+        record_id = int(record_id)
         
         if record_type not in ['purchase', 'sale']:
             flash('Invalid record type.', 'danger')
             return redirect(url_for('records'))
         
-        file_path = PURCHASES_FILE if record_type == 'purchase' else SALES_FILE
-        
-        if not os.path.exists(file_path):
-            flash(f'No {record_type} records found.', 'danger')
-            return redirect(url_for('records'))
-        
-        df = pd.read_excel(file_path)
+        ledger = 'purchases' if record_type == 'purchase' else 'sales'
         
-        if record_index < 0 or record_index >= len(df):
-            flash('Invalid record index.', 'danger')
+        record = store.get(ledger, record_id)
+        if record is None:
+            flash('Record not found.', 'danger')
             return redirect(url_for('records'))
         
         # Security check: Verify the total amount hasn't been tampered with
-        stored_total_inr = df.at[record_index, 'Total Amount INR']
-        if total_amount_inr and abs(float(total_amount_inr) - float(stored_total_inr)) > 0.01:
+        stored_total_inr = field_value(record, ledger, 'Total Amount INR')
+        if total_amount_inr and stored_total_inr is not None and \
+                abs(float(total_amount_inr) - float(stored_total_inr)) > 0.01:
             flash('Security warning: Total amount mismatch detected.', 'danger')
             return redirect(url_for('records'))
         
@@ -1939,92 +2037,38 @@ def update_payment_status():
                 return redirect(url_for('records'))
         
         # Get the original exchange rate from the record
-        stored_rate = df.at[record_index, 'Rate']
-        if not original_exchange_rate or abs(float(original_exchange_rate) - float(stored_rate)) > 0.01:
+        stored_rate = record_rate(record, ledger)
+        if stored_rate is None:
+            # Neither a rate nor totals to imply one; take the submitted rate
+            exchange_rate = original_exchange_rate or None
+        elif not original_exchange_rate or abs(float(original_exchange_rate) - float(stored_rate)) > 0.01:
             # Use the stored rate if there's a mismatch
             exchange_rate = stored_rate
         else:
             exchange_rate = original_exchange_rate
         
-        # Update payment status
-        df.at[record_index, 'Payment Status'] = new_status
-        
         # Handle different payment status types
-        if new_status == 'Completed':
-            # For completed payments, update the payment date
-            if payment_done_date:
-                df.at[record_index, 'Payment Done Date'] = payment_done_date
-            
-            # Clear partial payments if any (convert to completed)
-            df.at[record_index, 'partial_payments'] = None
-            
-        elif new_status == 'Partial':
+        if new_status == 'Partial':
             # For partial payments, add to the payment history
             if partial_amount and partial_payment_date:
                 try:
                     partial_amount = float(partial_amount)
-                    exchange_rate = float(exchange_rate)
-                    
-                    # Get existing partial payments or create new list
-                    partial_payments = []
-                    if pd.notna(df.at[record_index, 'partial_payments']) and df.at[record_index, 'partial_payments']:
-                        try:
-                            partial_payments = json.loads(df.at[record_index, 'partial_payments'])
-                        except:
-                            partial_payments = []
-                    
-                    # Add new payment with currency information
-                    new_payment = {
-                        'date': partial_payment_date,
-                        'amount': partial_amount,
-                        'currency': payment_currency,
-                        'exchange_rate': exchange_rate,  # Always use the original exchange rate
-                        'reference': partial_payment_reference or ''
-                    }
-                    partial_payments.append(new_payment)
-                    
-                    # Store as JSON string
-                    df.at[record_index, 'partial_payments'] = json.dumps(partial_payments)
-                    
-                    # Calculate total received in both currencies
-                    total_received_usd = 0
-                    total_received_inr = 0
-                    
-                    for payment in partial_payments:
-                        payment_amount = float(payment['amount'])
-                        # Always use the original exchange rate for consistency
-                        payment_rate = float(exchange_rate)
-                        
-                        if payment.get('currency') == 'INR':
-                            # For INR payments
-                            total_received_inr += payment_amount
-                            total_received_usd += payment_amount / payment_rate
-                        else:
-                            # For USD payments
-                            total_received_usd += payment_amount
-                            total_received_inr += payment_amount * payment_rate
-                    
-                    # Check if fully paid (based on INR amount)
-                    total_amount_inr = df.at[record_index, 'Total Amount INR']
-                    
-                    # If received amount is within 1 rupee of total, consider it fully paid
-                    if abs(total_received_inr - total_amount_inr) <= 1.0:
-                        df.at[record_index, 'Payment Status'] = 'Completed'
-                        df.at[record_index, 'Payment Done Date'] = partial_payment_date
-                        
+                    exchange_rate = float(exchange_rate) if exchange_rate else None
                 except ValueError:
                     flash('Invalid payment amount or exchange rate.', 'danger')
                     return redirect(url_for('records'))
             else:
                 flash('Payment amount and date are required for partial payments.', 'danger')
                 return redirect(url_for('records'))
-        else:
-            # For pending or other statuses, clear payment date
-            df.at[record_index, 'Payment Done Date'] = None
-            df.at[record_index, 'partial_payments'] = None
         
-        # Save the updated DataFrame
-        df.to_excel(file_path, index=False)
+        # Save the updated record. The installment and the record's received
+        # totals are updated on the writer in the same step, so concurrent
+        # partial payments add up instead of overwriting each other
+        store.submit(lambda tx: set_payment_status(
+            tx, ledger, record_id, new_status,
+            date=partial_payment_date if new_status == 'Partial' else payment_done_date,
+            amount=partial_amount, currency=payment_currency,
+            reference=partial_payment_reference, exchange_rate=exchange_rate))
         
         flash(f'{record_type.capitalize()} payment status updated successfully.', 'success')
         return redirect(url_for('records'))
@@ -2036,83 +2080,46 @@ def update_payment_status():
 @app.route('/get_record_details')
 def get_record_details():
     record_type = request.args.get('record_type')
-    record_index = request.args.get('record_index')
+    record_id = request.args.get('record_id')
     
     try:
-        record_index = int(record_index)
+        record_id = int(record_id)
         
         if record_type not in ['purchase', 'sale']:
             return jsonify({'error': 'Invalid record type'}), 400
         
-        file_path = PURCHASES_FILE if record_type == 'purchase' else SALES_FILE
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': f'No {record_type} records found'}), 404
-        
-        df = pd.read_excel(file_path)
-        
-        if record_index < 0 or record_index >= len(df):
-            return jsonify({'error': 'Invalid record index'}), 400
+        ledger = 'purchases' if record_type == 'purchase' else 'sales'
         
         # Get record details
-        record = df.iloc[record_index].replace({pd.NA: None, float('nan'): None})
+        record_dict = store.get(ledger, record_id)
+        if record_dict is None:
+            return jsonify({'error': 'Record not found'}), 404
         
-        # Convert to dictionary
-        record_dict = record.to_dict()
+        # Installments received so far, oldest first
+        record_dict['partial_payments'] = store.payment_lines(ledger, record_id)
         
-        # Parse partial payments if they exist
-        if 'partial_payments' in record_dict and record_dict['partial_payments']:
-            try:
-                if isinstance(record_dict['partial_payments'], str):
-                    record_dict['partial_payments'] = json.loads(record_dict['partial_payments'])
-                else:
-                    record_dict['partial_payments'] = []
-            except:
-                record_dict['partial_payments'] = []
-        else:
-            record_dict['partial_payments'] = []
+        # Ensure all required fields exist, read under whichever name the
+        # record stores them
+        stored_total_inr = field_value(record_dict, ledger, 'Total Amount INR')
+        record_dict['Total Amount USD'] = field_value(record_dict, ledger, 'Total Amount USD',
+                                                      record_dict.get('Total Amount') or 0)
         
-        # Ensure all required fields exist
-        if 'Total Amount USD' not in record_dict:
-            record_dict['Total Amount USD'] = record_dict.get('Total Amount', 0)
+        # Ensure Rate is present
+        record_dict['Rate'] = record_rate(record_dict, ledger) or 83.50  # Default rate
         
-        if 'Total Amount INR' not in record_dict:
+        if stored_total_inr is None:
             # Calculate INR amount if not present
-            if 'Rate' in record_dict and record_dict['Rate'] and record_dict['Rate'] is not None and 'Total Amount USD' in record_dict:
-                try:
-                    rate = float(record_dict['Rate'])
-                    total_usd = float(record_dict['Total Amount USD'])
-                    record_dict['Total Amount INR'] = total_usd * rate
-                except (ValueError, TypeError):
-                    record_dict['Total Amount INR'] = 0
-            else:
+            try:
+                record_dict['Total Amount INR'] = float(record_dict['Total Amount USD']) * float(record_dict['Rate'])
+            except (ValueError, TypeError):
                 record_dict['Total Amount INR'] = 0
+        else:
+            record_dict['Total Amount INR'] = stored_total_inr
         
-        # Ensure Rate is present
-        if 'Rate' not in record_dict or not record_dict['Rate']:
-            record_dict['Rate'] = 83.50  # Default rate
-        
-        # Calculate received amounts in both currencies using the original rate
-        total_received_usd = 0
-        total_received_inr = 0
-        original_rate = float(record_dict['Rate'])
-        
-        if record_dict['partial_payments']:
-            for payment in record_dict['partial_payments']:
-                payment_amount = float(payment['amount'])
-                
-                # Always use the original exchange rate for consistency
-                if payment.get('currency') == 'INR':
-                    # For INR payments
-                    total_received_inr += payment_amount
-                    total_received_usd += payment_amount / original_rate
-                else:
-                    # For USD payments
-                    total_received_usd += payment_amount
-                    total_received_inr += payment_amount * original_rate
-                
-                # Ensure the payment has the original exchange rate
-                payment['exchange_rate'] = original_rate
+        # Received amounts are kept up to date as installments are added
+        received = store.received(ledger, [record_id])
+        total_received_usd = float(received['received_usd'].sum())
+        total_received_inr = float(received['received_inr'].sum())
         
         # Add received amounts to the response
         record_dict['received_amount_usd'] = total_received_usd
@@ -2131,8 +2138,9 @@ def get_record_details():
                 except (ValueError, TypeError):
                     record_dict[key] = 0
         
-        # Add a security hash to prevent tampering with total amounts
-        record_dict['security_hash'] = generate_security_hash(record_dict['Total Amount INR'])
+        # Add a security hash to prevent tampering with total amounts; like
+        # update_payment_status, it covers the stored total only
+        record_dict['security_hash'] = generate_security_hash(stored_total_inr)
         
         # Add a flag indicating the rate is locked
         record_dict['rate_locked'] = True
@@ -2169,234 +2177,46 @@ def get_payment_status_color(status):
     }
     return status_colors.get(status.lower(), 'secondary')
 
+def transaction_page():
+    """One page of the transaction history for the current request."""
+    return page_transactions(store,
+                             status=request.args.get('status'),
+                             type_filter=request.args.get('type'),
+                             party=request.args.get('party'),
+                             start_date=request.args.get('start_date'),
+                             end_date=request.args.get('end_date'),
+                             limit=page_size(request.args.get('limit')),
+                             cursor=request.args.get('cursor'))
+
+def pending_payment_page():
+    """One page of pending payments for the current request."""
+    return page_pending_payments(store,
+                                 type_filter=request.args.get('type'),
+                                 party=request.args.get('party'),
+                                 start_date=request.args.get('start_date'),
+                                 end_date=request.args.get('end_date'),
+                                 limit=page_size(request.args.get('limit')),
+                                 cursor=request.args.get('cursor'))
+
 @app.route('/payments')
 def payments():
     try:
-        # Load payments data
-        if os.path.exists(PAYMENTS_FILE):
-            payments_df = pd.read_excel(PAYMENTS_FILE)
-        else:
-            payments_df = pd.DataFrame(columns=['id', 'type', 'name', 'total_amount', 'paid_amount', 'pending_amount', 
-                                     'status', 'payment_date', 'payment_method', 'notes'])
-            payments_df.to_excel(PAYMENTS_FILE, index=False)
-
-        # Load purchases and sales data
-        purchases_df = pd.read_excel(PURCHASES_FILE) if os.path.exists(PURCHASES_FILE) else pd.DataFrame()
-        sales_df = pd.read_excel(SALES_FILE) if os.path.exists(SALES_FILE) else pd.DataFrame()
-
-        # Calculate totals
-        total_pending = payments_df['pending_amount'].sum() if not payments_df.empty else 0
-        total_received = payments_df['paid_amount'].sum() if not payments_df.empty else 0
-        total_purchases = purchases_df['Total Amount INR'].sum() if not purchases_df.empty else 0
-        total_sales = sales_df['Total Amount INR'].sum() if not sales_df.empty else 0
-
-        # Apply filters if provided
-        status = request.args.get('status')
-        type_filter = request.args.get('type')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
+        # Calculate totals in the store rather than loading the ledgers
+        total_pending = store.total('payments', 'pending_amount')
+        total_received = store.total('payments', 'paid_amount')
+        total_purchases = store.total('purchases', 'Total Amount INR')
+        total_sales = store.total('sales', 'Total Amount INR')
 
-        # Prepare transactions list
-        transactions = []
-
-        # Safely convert a date with full NaT handling
-        def safe_date_convert(date_value):
-            if pd.isna(date_value):
-                return pd.Timestamp.now(), "00:00"
-            
-            try:
-                date_obj = pd.to_datetime(date_value)
-                if pd.isna(date_obj):
-                    return pd.Timestamp.now(), "00:00"
-                return date_obj, date_obj.strftime('%H:%M')
-            except:
-                return pd.Timestamp.now(), "00:00"
-
-        # Add purchases to transactions
-        if not purchases_df.empty:
-            for _, row in purchases_df.iterrows():
-                # Safely handle all potential NaT/NaN values
-                date_value, time_str = safe_date_convert(row.get('Date'))
-                status_value = str(row.get('Payment Status', "Unknown")) if pd.notna(row.get('Payment Status')) else "Unknown"
-                party_value = str(row.get('Party', "Unknown")) if pd.notna(row.get('Party')) else "Unknown"
-                
-                try:
-                    amount = float(row.get('Total Amount INR', 0))
-                except:
-                    amount = 0
-                
-                transaction = {
-                    'date': date_value,
-                    'time': time_str,
-                    'type': 'purchase',
-                    'party': party_value,
-                    'amount': amount,
-                    'status': status_value,
-                    'status_color': get_payment_status_color(status_value),
-                    'id': str(row.name)  # Use index as ID
-                }
-                transactions.append(transaction)
-
-        # Add sales to transactions
-        if not sales_df.empty:
-            for _, row in sales_df.iterrows():
-                # Safely handle all potential NaT/NaN values
-                date_value, time_str = safe_date_convert(row.get('Date'))
-                status_value = str(row.get('Payment Status', "Unknown")) if pd.notna(row.get('Payment Status')) else "Unknown"
-                party_value = str(row.get('Party', "Unknown")) if pd.notna(row.get('Party')) else "Unknown"
-                
-                try:
-                    amount = float(row.get('Total Amount INR', 0))
-                except:
-                    amount = 0
-                
-                transaction = {
-                    'date': date_value,
-                    'time': time_str,
-                    'type': 'sale',
-                    'party': party_value,
-                    'amount': amount,
-                    'status': status_value,
-                    'status_color': get_payment_status_color(status_value),
-                    'id': str(row.name)  # Use index as ID
-                }
-                transactions.append(transaction)
-
-        # Add payments to transactions
-        if not payments_df.empty:
-            for _, row in payments_df.iterrows():
-                # Safely handle all potential NaT/NaN values
-                date_value, time_str = safe_date_convert(row.get('payment_date'))
-                status_value = str(row.get('status', "Unknown")) if pd.notna(row.get('status')) else "Unknown"
-                name_value = str(row.get('name', "Unknown")) if pd.notna(row.get('name')) else "Unknown"
-                
-                try:
-                    amount = float(row.get('total_amount', 0))
-                except:
-                    amount = 0
-                
-                transaction = {
-                    'date': date_value,
-                    'time': time_str,
-                    'type': 'payment',
-                    'party': name_value,
-                    'amount': amount,
-                    'status': status_value,
-                    'status_color': get_payment_status_color(status_value),
-                    'id': str(row.get('id', row.name))
-                }
-                transactions.append(transaction)
-
-        # Sort transactions by date (newest first)
-        transactions.sort(key=lambda x: x['date'], reverse=True)
-
-        # Apply filters to transactions
-        if status:
-            transactions = [t for t in transactions if isinstance(t['status'], str) and t['status'].lower() == status.lower()]
-        if type_filter:
-            transactions = [t for t in transactions if t['type'] == type_filter]
-        if start_date:
-            try:
-                start_date = pd.to_datetime(start_date)
-                transactions = [t for t in transactions if t['date'] >= start_date]
-            except:
-                pass  # Ignore invalid start date
-        if end_date:
-            try:
-                end_date = pd.to_datetime(end_date)
-                transactions = [t for t in transactions if t['date'] <= end_date]
-            except:
-                pass  # Ignore invalid end date
-
-        # Prepare pending payments list from both purchases and sales
-        pending_payments = []
-
-        # Add pending purchases
-        if not purchases_df.empty:
-            for _, row in purchases_df.iterrows():
-                # Check if payment status is pending or partial (case insensitive)
-                status_value = str(row.get('Payment Status', "")).lower() if pd.notna(row.get('Payment Status')) else ""
-                if status_value not in ['pending', 'partial']:
-                    continue
-                
-                # Safely get date
-                date_value, _ = safe_date_convert(row.get('Date'))
-                
-                # Ensure values are of proper type
-                formatted_status = str(row.get('Payment Status', "Unknown")) if pd.notna(row.get('Payment Status')) else "Unknown"
-                party_value = str(row.get('Party', "Unknown")) if pd.notna(row.get('Party')) else "Unknown"
-                
-                try:
-                    amount = float(row.get('Total Amount INR', 0))
-                except:
-                    amount = 0
-                
-                payment = {
-                    'id': str(row.name),
-                    'type': 'supplier',
-                    'name': party_value,
-                    'total_amount': amount,
-                    'pending_amount': amount,
-                    'status': formatted_status,
-                    'status_color': get_payment_status_color(formatted_status),
-                    'reference_type': 'purchase',
-                    'date': date_value
-                }
-                pending_payments.append(payment)
-
-        # Add pending sales
-        if not sales_df.empty:
-            for _, row in sales_df.iterrows():
-                # Check if payment status is pending or partial (case insensitive)
-                status_value = str(row.get('Payment Status', "")).lower() if pd.notna(row.get('Payment Status')) else ""
-                if status_value not in ['pending', 'partial']:
-                    continue
-                
-                # Safely get date
-                date_value, _ = safe_date_convert(row.get('Date'))
-                
-                # Ensure values are of proper type
-                formatted_status = str(row.get('Payment Status', "Unknown")) if pd.notna(row.get('Payment Status')) else "Unknown"
-                party_value = str(row.get('Party', "Unknown")) if pd.notna(row.get('Party')) else "Unknown"
-                
-                try:
-                    amount = float(row.get('Total Amount INR', 0))
-                except:
-                    amount = 0
-                
-                payment = {
-                    'id': str(row.name),
-                    'type': 'customer',
-                    'name': party_value,
-                    'total_amount': amount,
-                    'pending_amount': amount,
-                    'status': formatted_status,
-                    'status_color': get_payment_status_color(formatted_status),
-                    'reference_type': 'sale',
-                    'date': date_value
-                }
-                pending_payments.append(payment)
-
-        # Apply filters to pending payments
-        if type_filter:
-            type_filter_lower = type_filter.lower()
-            pending_payments = [p for p in pending_payments if p['type'] == type_filter_lower]
-        if start_date:
-            try:
-                start_date = pd.to_datetime(start_date)
-                pending_payments = [p for p in pending_payments if p['date'] >= start_date]
-            except:
-                pass  # Ignore invalid start date
-        if end_date:
-            try:
-                end_date = pd.to_datetime(end_date)
-                pending_payments = [p for p in pending_payments if p['date'] <= end_date]
-            except:
-                pass  # Ignore invalid end date
+        # First page of the history and of the pending payments, with any
+        # filters applied; the page loads further pages from the API
+        transactions, next_transactions = transaction_page()
+        pending_payments, next_pending = pending_payment_page()
 
         return render_template('payments.html', 
                              payments=pending_payments,
                              transactions=transactions,
+                             next_transactions=next_transactions,
+                             next_pending=next_pending,
                              total_pending=total_pending,
                              total_received=total_received,
                              total_purchases=total_purchases,
@@ -2408,11 +2228,144 @@ def payments():
         return render_template('payments.html', 
                              payments=[],
                              transactions=[],
+                             next_transactions=None,
+                             next_pending=None,
                              total_pending=0,
                              total_received=0,
                              total_purchases=0,
                              total_sales=0)
 
+@app.route('/api/payments/transactions')
+def api_transactions():
+    """
+    A page of the transaction history as JSON, newest first.
+    Arguments: limit, cursor (next_cursor of the previous page) and the
+    filters status, type, party, start_date, end_date.
+    """
+    try:
+        items, next_cursor = transaction_page()
+        return jsonify({'items': json_rows(items), 'next_cursor': next_cursor})
+    except Exception as e:
+        app.logger.error(f"Error in api_transactions: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/payments/pending')
+def api_pending_payments():
+    """A page of pending payments as JSON; same arguments as /api/payments/transactions."""
+    try:
+        items, next_cursor = pending_payment_page()
+        return jsonify({'items': json_rows(items), 'next_cursor': next_cursor})
+    except Exception as e:
+        app.logger.error(f"Error in api_pending_payments: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/balances')
+def balances():
+    """Who owes us and whom we owe, largest outstanding balance first."""
+    try:
+        limit = page_size(request.args.get('limit'))
+        receivables = party_balances(store, 'receivable', limit=limit)
+        payables = party_balances(store, 'payable', limit=limit)
+    except Exception as e:
+        flash(f'Error loading balances: {str(e)}', 'error')
+        receivables, payables = [], []
+    return render_template('balances.html', receivables=receivables, payables=payables)
+
+@app.route('/api/balances')
+def api_balances():
+    """
+    Party balances as JSON, largest outstanding first.
+    Arguments: direction (receivable/payable), all (include settled parties), limit, offset.
+    """
+    direction = request.args.get('direction', 'receivable')
+    if direction not in ('receivable', 'payable'):
+        return jsonify({'error': f'Unknown direction: {direction}'}), 400
+    try:
+        items = party_balances(store, direction,
+                               open_only=request.args.get('all') not in ('1', 'true'),
+                               limit=page_size(request.args.get('limit')),
+                               offset=request.args.get('offset', 0, type=int))
+        return jsonify({'items': items})
+    except Exception as e:
+        app.logger.error(f"Error in api_balances: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/balances/<path:party>')
+def api_party_balance(party):
+    """A single party's receivable and payable balances."""
+    try:
+        balance = party_balance(store, party)
+        if not balance:
+            return jsonify({'error': 'Party not found'}), 404
+        return jsonify({'party': party, 'balances': balance})
+    except Exception as e:
+        app.logger.error(f"Error in api_party_balance: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/remittances', methods=['POST'])
+def api_remittance():
+    """
+    Allocate one lump-sum payment over a party's open invoices in a single write.
+    Takes JSON or form fields: record_type (sale/purchase), party, amount,
+    currency (INR/USD), date, reference and optionally record_ids, the records
+    to settle in that order. Without record_ids the party's oldest open
+    records are settled first.
+    """
+    data = request.get_json(silent=True) or request.form.to_dict()
+    record_type = data.get('record_type', 'sale')
+    if record_type not in RECORD_LEDGERS:
+        return jsonify({'error': f'Unknown record type: {record_type}'}), 400
+    record_ids = data.get('record_ids')
+    if isinstance(record_ids, str):
+        record_ids = [r for r in record_ids.split(',') if r.strip()]
+    try:
+        result = apply_remittance(store, RECORD_LEDGERS[record_type], data.get('amount'),
+                                  party=data.get('party') or None,
+                                  record_ids=record_ids or None,
+                                  currency=(data.get('currency') or 'INR').upper(),
+                                  date=data.get('date') or None,
+                                  reference=data.get('reference') or None)
+        return jsonify(result)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in api_remittance: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/payment_status/batch', methods=['POST'])
+def api_payment_status_batch():
+    """
+    Apply many payment status updates in a single write.
+    Takes a JSON list, or {"updates": [...]}, of objects with record_type
+    (purchase/sale), record_id, status, date, amount, currency, reference and
+    optionally security_hash. All updates are validated first; if any fails
+    nothing is saved and the response says which ones failed.
+    """
+    data = request.get_json(silent=True)
+    updates = data.get('updates') if isinstance(data, dict) else data
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'error': 'Expected a non-empty list of updates.'}), 400
+    
+    def verify(record, update):
+        # Same tamper check as the single update form
+        security_hash = update.get('security_hash')
+        ledger = RECORD_LEDGERS[update.get('record_type', 'sale')]
+        if security_hash and security_hash != generate_security_hash(
+                field_value(record, ledger, 'Total Amount INR')):
+            return 'Data integrity check failed.'
+        return None
+    
+    try:
+        ok, results = apply_payment_statuses(store, updates, RECORD_LEDGERS, verify=verify)
+        if not ok:
+            return jsonify({'error': 'No updates were saved.', 'results': results}), 400
+        return jsonify({'updated': len(results), 'results': results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in api_payment_status_batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/add_payment', methods=['POST'])
 def add_payment():
     try:
@@ -2424,19 +2377,8 @@ def add_payment():
         payment_method = request.form.get('payment_method')
         notes = request.form.get('notes')
 
-        # Load existing payments
-        if os.path.exists(PAYMENTS_FILE):
-            df = pd.read_excel(PAYMENTS_FILE)
-        else:
-            df = pd.DataFrame(columns=['id', 'type', 'name', 'total_amount', 'paid_amount', 'pending_amount', 
-                                     'status', 'payment_date', 'payment_method', 'notes'])
-
-        # Generate new payment ID
-        new_id = str(len(df) + 1)
-
         # Create new payment record
         new_payment = {
-            'id': new_id,
             'type': payment_type,
             'name': name,
             'total_amount': amount,
@@ -2448,11 +2390,13 @@ def add_payment():
             'notes': notes
         }
 
-        # Append new payment to DataFrame
-        df = pd.concat([df, pd.DataFrame([new_payment])], ignore_index=True)
+        def record_payment(tx):
+            # Allocate the payment ID in the same transaction as the insert
+            new_payment['id'] = tx.next_ids('payment')[0]
+            return tx.insert('payments', new_payment)
 
-        # Save to Excel
-        df.to_excel(PAYMENTS_FILE, index=False)
+        # Append new payment to the ledger
+        store.submit(record_payment)
 
         return jsonify({'success': True})
     except Exception as e:
@@ -2461,12 +2405,11 @@ def add_payment():
 @app.route('/payment_details/<payment_id>')
 def payment_details(payment_id):
     try:
-        if not os.path.exists(PAYMENTS_FILE):
-            flash('No payment records found', 'error')
+        payment = store.find('payments', payment_id)
+        if payment is None:
+            flash('Payment not found', 'error')
             return redirect(url_for('payments'))
-
-        df = pd.read_excel(PAYMENTS_FILE)
-        payment = df[df['id'] == payment_id].iloc[0].to_dict()
+        payment['payment_date'] = pd.to_datetime(payment.get('payment_date'))
 
         return render_template('payment_details.html', payment=payment)
     except Exception as e:
@@ -2476,27 +2419,28 @@ def payment_details(payment_id):
 @app.route('/edit_payment/<payment_id>', methods=['GET', 'POST'])
 def edit_payment(payment_id):
     try:
-        if not os.path.exists(PAYMENTS_FILE):
-            flash('No payment records found', 'error')
+        payment = store.find('payments', payment_id)
+        if payment is None:
+            flash('Payment not found', 'error')
             return redirect(url_for('payments'))
-
-        df = pd.read_excel(PAYMENTS_FILE)
-        payment = df[df['id'] == payment_id].iloc[0].to_dict()
+        payment['payment_date'] = pd.to_datetime(payment.get('payment_date'))
 
         if request.method == 'POST':
             # Update payment details
-            df.loc[df['id'] == payment_id, 'name'] = request.form.get('name')
-            df.loc[df['id'] == payment_id, 'payment_date'] = pd.to_datetime(request.form.get('payment_date'))
-            df.loc[df['id'] == payment_id, 'payment_method'] = request.form.get('payment_method')
-            df.loc[df['id'] == payment_id, 'notes'] = request.form.get('notes')
+            changes = {
+                'name': request.form.get('name'),
+                'payment_date': pd.to_datetime(request.form.get('payment_date')),
+                'payment_method': request.form.get('payment_method'),
+                'notes': request.form.get('notes')
+            }
 
             # Update payment status based on amounts
-            total_amount = float(df.loc[df['id'] == payment_id, 'total_amount'].iloc[0])
+            total_amount = float(payment['total_amount'])
             paid_amount = float(request.form.get('paid_amount', 0))
             pending_amount = total_amount - paid_amount
 
-            df.loc[df['id'] == payment_id, 'paid_amount'] = paid_amount
-            df.loc[df['id'] == payment_id, 'pending_amount'] = pending_amount
+            changes['paid_amount'] = paid_amount
+            changes['pending_amount'] = pending_amount
 
             if pending_amount <= 0:
                 status = 'completed'
@@ -2505,10 +2449,10 @@ def edit_payment(payment_id):
             else:
                 status = 'pending'
 
-            df.loc[df['id'] == payment_id, 'status'] = status
+            changes['status'] = status
 
             # Save changes
-            df.to_excel(PAYMENTS_FILE, index=False)
+            store.update('payments', payment[RECORD_ID], changes)
             flash('Payment updated successfully', 'success')
             return redirect(url_for('payments'))
 
@@ -2532,12 +2476,7 @@ def get_inventory_status_color(status):
 def inventory():
     try:
         # Load inventory data
-        if os.path.exists(INVENTORY_FILE):
-            inventory_df = pd.read_excel(INVENTORY_FILE)
-        else:
-            inventory_df = pd.DataFrame(columns=['id', 'description', 'shape', 'carats', 'color', 'clarity', 'cut', 
-                                              'purchase_price', 'market_value', 'status', 'location', 'purchase_date', 'notes'])
-            inventory_df.to_excel(INVENTORY_FILE, index=False)
+        inventory_df = store.read('inventory')
         
         # Apply filters if provided
         shape = request.args.get('shape')
@@ -2638,19 +2577,8 @@ def add_inventory_item():
         location = request.form.get('location')
         notes = request.form.get('notes')
         
-        # Load existing inventory
-        if os.path.exists(INVENTORY_FILE):
-            inventory_df = pd.read_excel(INVENTORY_FILE)
-        else:
-            inventory_df = pd.DataFrame(columns=['id', 'description', 'shape', 'carats', 'color', 'clarity', 'cut', 
-                                              'purchase_price', 'market_value', 'status', 'location', 'purchase_date', 'notes'])
-        
-        # Generate a unique ID
-        item_id = f"D{int(time.time())}"
-        
         # Create new item
         new_item = {
-            'id': item_id,
             'description': description,
             'shape': shape,
             'carats': carats,
@@ -2665,11 +2593,13 @@ def add_inventory_item():
             'notes': notes
         }
         
-        # Add to DataFrame
-        inventory_df = pd.concat([inventory_df, pd.DataFrame([new_item])], ignore_index=True)
+        def record_item(tx):
+            # Allocate a unique ID for the item
+            new_item['id'] = tx.next_ids('inventory')[0]
+            return tx.insert('inventory', new_item)
         
-        # Save to Excel
-        inventory_df.to_excel(INVENTORY_FILE, index=False)
+        # Add to the inventory ledger
+        store.submit(record_item)
         
         flash('Inventory item added successfully!', 'success')
         return redirect(url_for('inventory'))
@@ -2680,21 +2610,13 @@ def add_inventory_item():
 @app.route('/inventory_item_details/<item_id>')
 def inventory_item_details(item_id):
     try:
-        # Load inventory data
-        if not os.path.exists(INVENTORY_FILE):
-            flash('Inventory file not found.', 'error')
-            return redirect(url_for('inventory'))
-        
-        inventory_df = pd.read_excel(INVENTORY_FILE)
-        
         # Find the item
-        item_row = inventory_df[inventory_df['id'] == item_id]
-        if item_row.empty:
+        item = store.find('inventory', item_id)
+        if item is None:
             flash('Item not found.', 'error')
             return redirect(url_for('inventory'))
         
         # Get item details
-        item = item_row.iloc[0].to_dict()
         item['status_color'] = get_inventory_status_color(str(item.get('status', '')))
         
         return render_template('inventory_item_details.html', item=item)
@@ -2705,41 +2627,32 @@ def inventory_item_details(item_id):
 @app.route('/edit_inventory_item/<item_id>', methods=['GET', 'POST'])
 def edit_inventory_item(item_id):
     try:
-        # Load inventory data
-        if not os.path.exists(INVENTORY_FILE):
-            flash('Inventory file not found.', 'error')
-            return redirect(url_for('inventory'))
-        
-        inventory_df = pd.read_excel(INVENTORY_FILE)
-        
         # Find the item
-        item_index = inventory_df[inventory_df['id'] == item_id].index
-        if len(item_index) == 0:
+        item = store.find('inventory', item_id)
+        if item is None:
             flash('Item not found.', 'error')
             return redirect(url_for('inventory'))
         
         if request.method == 'POST':
             # Update item with form data
-            inventory_df.at[item_index[0], 'description'] = request.form.get('description')
-            inventory_df.at[item_index[0], 'shape'] = request.form.get('shape')
-            inventory_df.at[item_index[0], 'carats'] = float(request.form.get('carats'))
-            inventory_df.at[item_index[0], 'color'] = request.form.get('color')
-            inventory_df.at[item_index[0], 'clarity'] = request.form.get('clarity')
-            inventory_df.at[item_index[0], 'cut'] = request.form.get('cut')
-            inventory_df.at[item_index[0], 'purchase_price'] = float(request.form.get('purchase_price'))
-            inventory_df.at[item_index[0], 'market_value'] = float(request.form.get('market_value'))
-            inventory_df.at[item_index[0], 'status'] = request.form.get('status')
-            inventory_df.at[item_index[0], 'location'] = request.form.get('location')
-            inventory_df.at[item_index[0], 'notes'] = request.form.get('notes')
-            
-            # Save to Excel
-            inventory_df.to_excel(INVENTORY_FILE, index=False)
+            store.update('inventory', item[RECORD_ID], {
+                'description': request.form.get('description'),
+                'shape': request.form.get('shape'),
+                'carats': float(request.form.get('carats')),
+                'color': request.form.get('color'),
+                'clarity': request.form.get('clarity'),
+                'cut': request.form.get('cut'),
+                'purchase_price': float(request.form.get('purchase_price')),
+                'market_value': float(request.form.get('market_value')),
+                'status': request.form.get('status'),
+                'location': request.form.get('location'),
+                'notes': request.form.get('notes')
+            })
             
             flash('Inventory item updated successfully!', 'success')
             return redirect(url_for('inventory'))
         else:
-            # Get item details for the form
-            item = inventory_df.iloc[item_index[0]].to_dict()
+            # Show the item details in the form
             return render_template('edit_inventory_item.html', item=item)
     except Exception as e:
         flash(f'Error editing inventory item: {str(e)}', 'error')
@@ -2751,19 +2664,13 @@ def delete_inventory_item():
         data = request.get_json()
         item_id = data.get('item_id')
         
-        # Load inventory data
-        if os.path.exists(INVENTORY_FILE):
-            inventory_df = pd.read_excel(INVENTORY_FILE)
-            
-            # Find and remove the item
-            inventory_df = inventory_df[inventory_df['id'] != item_id]
-            
-            # Save updated inventory
-            inventory_df.to_excel(INVENTORY_FILE, index=False)
-            
-            return jsonify({'success': True, 'message': 'Item deleted successfully'})
-        else:
-            return jsonify({'success': False, 'message': 'Inventory file not found'})
+        # Find and remove the item
+        def delete_item(tx):
+            for record_id in tx.find_ids('inventory', item_id):
+                tx.delete('inventory', record_id)
+        store.submit(delete_item)
+        
+        return jsonify({'success': True, 'message': 'Item deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -2794,23 +2701,13 @@ def upload_inventory():
                 flash(f'Missing required columns: {", ".join(missing_columns)}', 'error')
                 return redirect(url_for('inventory'))
             
-            # Load existing inventory
-            if os.path.exists(INVENTORY_FILE):
-                inventory_df = pd.read_excel(INVENTORY_FILE)
-            else:
-                inventory_df = pd.DataFrame(columns=['id', 'description', 'shape', 'carats', 'color', 'clarity', 'cut', 
-                                                  'purchase_price', 'market_value', 'status', 'location', 'purchase_date', 'notes'])
-            
             # Process each row in the uploaded file
+            new_items = []
             successful_imports = 0
             for _, row in uploaded_df.iterrows():
                 try:
-                    # Generate a unique ID for each new item
-                    item_id = f"D{int(time.time())}{successful_imports}"
-                    
                     # Create new item with required fields
                     new_item = {
-                        'id': item_id,
                         'description': row.get('description', ''),
                         'shape': row.get('shape', ''),
                         'carats': float(row.get('carats', 0)),
@@ -2825,18 +2722,20 @@ def upload_inventory():
                         'notes': row.get('notes', '')
                     }
                     
-                    # Add to DataFrame
-                    inventory_df = pd.concat([inventory_df, pd.DataFrame([new_item])], ignore_index=True)
+                    new_items.append(new_item)
                     successful_imports += 1
                     
-                    # Add a small delay to ensure unique timestamps for IDs
-                    time.sleep(0.01)
-                    
                 except Exception as e:
                     continue
             
-            # Save to Excel
-            inventory_df.to_excel(INVENTORY_FILE, index=False)
+            # Add all imported items in one transaction
+            def insert_items(tx):
+                # Allocate IDs for the whole upload as one block
+                item_ids = tx.next_ids('inventory', len(new_items))
+                for item_id, new_item in zip(item_ids, new_items):
+                    new_item['id'] = item_id
+                    tx.insert('inventory', new_item)
+            store.submit(insert_items)
             
             flash(f'Successfully imported {successful_imports} inventory items!', 'success')
             return redirect(url_for('inventory'))
@@ -2891,5 +2790,23 @@ def download_inventory_template():
         flash(f'Error generating template: {str(e)}', 'error')
         return redirect(url_for('inventory'))
 
+@app.cli.command('rebuild-views')
+def rebuild_views_command():
+    """Recompute the derived tables (e.g. party balances) from the ledgers."""
+    rebuilt = store.rebuild_views()
+    print(f"Rebuilt views: {', '.join(rebuilt) or 'none'}")
+
+@app.cli.command('verify-totals')
+@click.option('--repair', is_flag=True, help='Rebuild the totals if they differ.')
+def verify_totals_command(repair):
+    """Recompute the dashboard totals from scratch and compare them with the maintained ones."""
+    differences = verify_ledger_totals(store, repair=repair)
+    for ledger, status, field, stored, computed in differences:
+        print(f"{ledger} [{status or 'no status'}] {field}: maintained {stored}, recomputed {computed}")
+    if not differences:
+        print('Dashboard totals match the ledgers.')
+    elif repair:
+        print('Dashboard totals rebuilt.')
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
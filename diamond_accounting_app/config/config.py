@@ -9,6 +9,10 @@ class Config:
     LOG_DIR = os.path.join(BASE_DIR, 'logs')
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    LEDGER_ENGINE = 'sqlite'
+    LEDGER_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Memory for cached ledger DataFrames
+    LEDGER_CHECKPOINT_INTERVAL = 30  # Seconds between ledger journal compactions
+    LEDGER_COMMIT_WINDOW = 0.005  # Seconds the writer waits to group concurrent mutations
 
 class DevelopmentConfig(Config):
     """Development configuration."""
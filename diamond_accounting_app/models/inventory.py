@@ -3,6 +3,8 @@ import os
 from flask import current_app
 import logging
 
+from ..services.atomic import write_excel
+
 logger = logging.getLogger('diamond_app')
 
 __all__ = ['InventoryItem', 'get_inventory', 'add_inventory_item', 'update_inventory_item']
@@ -57,7 +59,7 @@ def add_inventory_item(item):
         df = pd.read_excel(inventory_file) if os.path.exists(inventory_file) else pd.DataFrame()
         new_row = pd.DataFrame([item.to_dict()])
         df = pd.concat([df, new_row], ignore_index=True)
-        df.to_excel(inventory_file, index=False)
+        write_excel(df, inventory_file)
         logger.info(f"Added inventory item: {item.item_id}")
         return True
     except Exception as e:
@@ -74,7 +76,7 @@ def update_inventory_item(item):
             logger.error(f"Inventory item not found: {item.item_id}")
             return False
         df.loc[idx] = pd.Series(item.to_dict())
-        df.to_excel(inventory_file, index=False)
+        write_excel(df, inventory_file)
         logger.info(f"Updated inventory item: {item.item_id}")
         return True
     except Exception as e:
@@ -1,6 +1,5 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from ..services.reports import (
-    get_dashboard_data,
     get_sales_report,
     get_purchases_report,
     get_inventory_report,
@@ -12,17 +11,6 @@ import logging
 bp = Blueprint('reports', __name__)
 logger = logging.getLogger('diamond_app')
 
-@bp.route('/dashboard')
-def dashboard():
-    """Display the dashboard with key metrics and charts."""
-    try:
-        data = get_dashboard_data()
-        return render_template('reports/dashboard.html', data=data)
-    except Exception as e:
-        logger.error(f"Error loading dashboard: {str(e)}")
-        flash('Error loading dashboard', 'error')
-        return redirect(url_for('main.index'))
-
 @bp.route('/reports')
 def reports():
     """Display the main reports page."""
@@ -1,15 +1,35 @@
+from .aging import *
+from .atomic import *
 from .auth import *
-from .inventory import *
-from .sales import *
-from .purchases import *
-from .reports import *
 from .backup import *
+from .balances import *
+from .costing import *
+from .dashboard import *
+from .kapans import *
+from .payments import *
+from .records import *
+from .refresher import *
+from .remittances import *
+from .reports import *
+from .rollups import *
+from .storage import *
+from .totals import *
 
 __all__ = (
+    aging.__all__ +
+    atomic.__all__ +
     auth.__all__ +
-    inventory.__all__ +
-    sales.__all__ +
-    purchases.__all__ +
+    backup.__all__ +
+    balances.__all__ +
+    costing.__all__ +
+    dashboard.__all__ +
+    kapans.__all__ +
+    payments.__all__ +
+    records.__all__ +
+    refresher.__all__ +
+    remittances.__all__ +
     reports.__all__ +
-    backup.__all__
-) 
\ No newline at end of file
+    rollups.__all__ +
+    storage.__all__ +
+    totals.__all__
+) 
@@ -0,0 +1,125 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .balances import DIRECTIONS
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['DEFAULT_BUCKETS', 'AGING_COLUMNS', 'parse_buckets', 'bucket_labels', 'age_lines',
+           'aging_report']
+
+# Upper bounds, in days past due, of every bucket but the last open-ended one
+DEFAULT_BUCKETS = (30, 60, 90)
+
+# Columns the report reads from the purchase and sale ledgers
+AGING_COLUMNS = ['Date', 'Party', 'Platform', 'Total Amount INR', 'Payment Status',
+                 'Payment Due Date', 'Payment Days']
+
+def parse_buckets(value):
+    """Parse '30,60,90' into bucket bounds; anything unusable gives DEFAULT_BUCKETS."""
+    if not value:
+        return DEFAULT_BUCKETS
+    try:
+        bounds = sorted({int(part) for part in str(value).split(',') if part.strip()})
+    except ValueError:
+        return DEFAULT_BUCKETS
+    bounds = [b for b in bounds if b > 0]
+    return tuple(bounds) or DEFAULT_BUCKETS
+
+def bucket_labels(buckets):
+    """Labels of the buckets for the given bounds, e.g. 0-30, 31-60, 61-90, 91+."""
+    labels, low = [], 0
+    for bound in buckets:
+        labels.append(f'{low}-{bound}')
+        low = bound + 1
+    labels.append(f'{low}+')
+    return labels
+
+def _as_of(value):
+    """The day to age against: value when it is a date, else today."""
+    as_of = pd.to_datetime(value, errors='coerce') if value else pd.NaT
+    return (pd.Timestamp.now() if pd.isna(as_of) else pd.Timestamp(as_of)).normalize()
+
+def age_lines(df, received, buckets=DEFAULT_BUCKETS, as_of=None):
+    """
+    Add due date, days past due, outstanding amount and bucket columns to
+    open ledger lines read with AGING_COLUMNS. The due date is the
+    'Payment Due Date', else the invoice date plus 'Payment Days', else the
+    invoice date. Lines not yet due fall in the first bucket. Everything is
+    computed on whole columns, without a Python loop over the lines.
+    """
+    as_of = _as_of(as_of)
+    index = df.index
+    invoiced = pd.to_datetime(df['Date'], errors='coerce') if 'Date' in df.columns else \
+        pd.Series(pd.NaT, index=index, dtype='datetime64[ns]')
+    due = pd.to_datetime(df['Payment Due Date'], errors='coerce') if 'Payment Due Date' in df.columns else \
+        pd.Series(pd.NaT, index=index, dtype='datetime64[ns]')
+    if 'Payment Days' in df.columns:
+        terms = pd.to_timedelta(pd.to_numeric(df['Payment Days'], errors='coerce').fillna(0), unit='D')
+    else:
+        terms = pd.Series(pd.Timedelta(0), index=index)
+    due = due.fillna(invoiced + terms).fillna(as_of)
+
+    amount = pd.to_numeric(df['Total Amount INR'], errors='coerce').fillna(0.0) \
+        if 'Total Amount INR' in df.columns else pd.Series(0.0, index=index)
+    paid = received['received_inr'].reindex(index, fill_value=0.0).astype(float)
+
+    days = (as_of - due).dt.days
+    bins = [-np.inf] + list(buckets) + [np.inf]
+    return df.assign(
+        due_date=due,
+        days_past_due=days,
+        outstanding=(amount - paid).clip(lower=0.0),
+        bucket=pd.cut(days, bins=bins, labels=bucket_labels(buckets), right=True)
+    )
+
+def _group(df, name):
+    """Text column for grouping, with missing values as 'Unknown'."""
+    if name not in df.columns:
+        return pd.Series('Unknown', index=df.index)
+    values = df[name]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Stay categorical; grouping on category codes is much cheaper than on strings
+        values = values.cat.rename_categories(lambda c: str(c))
+        if 'Unknown' not in values.cat.categories:
+            values = values.cat.add_categories('Unknown')
+        return values.fillna('Unknown')
+    values = values.astype(object)
+    return values.where(values.notna(), 'Unknown').astype(str)
+
+def _table(aged, labels, group_by):
+    """Outstanding per group and bucket, largest total first, as dicts."""
+    keys = [_group(aged, name).rename(name.lower()) for name in group_by]
+    # One pass over the lines gives both the amounts and the line counts
+    grouped = aged.groupby(keys + [aged['bucket']], observed=True)['outstanding'].agg(['sum', 'size'])
+    table = grouped['sum'].unstack('bucket', fill_value=0.0).reindex(columns=labels, fill_value=0.0)
+    table.columns = list(labels)
+    table['total'] = table[labels].sum(axis=1)
+    table['lines'] = grouped['size'].groupby(level=list(range(len(keys)))).sum().reindex(table.index)
+    table = table.sort_values('total', ascending=False).reset_index()
+    return table.to_dict('records')
+
+def aging_report(store, buckets=DEFAULT_BUCKETS, as_of=None, group_by=('Party', 'Platform')):
+    """
+    Age every open purchase and sale by days past due.
+    Returns the bucket labels and, per direction (receivable/payable), the
+    outstanding amount per group and bucket with the bucket totals.
+    """
+    labels = bucket_labels(buckets)
+    as_of = _as_of(as_of)
+    report = {'buckets': labels, 'as_of': as_of.strftime('%Y-%m-%d')}
+    for ledger, direction in DIRECTIONS.items():
+        df = store.read(ledger, columns=AGING_COLUMNS)
+        if 'Payment Status' in df.columns:
+            df = df[df['Payment Status'].astype(str).str.lower() != 'completed']
+        aged = age_lines(df, store.received(ledger), buckets, as_of)
+        aged = aged[aged['outstanding'] > 0.005]
+        totals = aged.groupby('bucket', observed=False)['outstanding'].sum().reindex(labels, fill_value=0.0)
+        report[direction] = {
+            'rows': _table(aged, labels, list(group_by)) if len(aged) else [],
+            'totals': {**{label: float(totals[label]) for label in labels},
+                       'total': float(totals.sum()), 'lines': int(len(aged))}
+        }
+    return report
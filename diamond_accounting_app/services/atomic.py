@@ -0,0 +1,67 @@
+import os
+import stat
+import tempfile
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['atomic_path', 'write_excel', 'save_workbook']
+
+def _fsync_dir(directory):
+    # Make the rename itself durable; not supported on every platform
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_path(file_path):
+    """
+    Yield a temporary path next to file_path to write the new contents to.
+    When the block succeeds the temp file is fsync'd and renamed over
+    file_path, so readers and crashes only ever see the old file or the
+    complete new one. When it fails the temp file is removed and file_path
+    is left untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    # Keep the extension; pandas and openpyxl pick their format from it
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix=f'.tmp{ext}', dir=directory)
+    os.close(fd)
+    try:
+        # mkstemp creates the file private to us; keep the permissions the file had
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+        yield temp_path
+        with open(temp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+        _fsync_dir(directory)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def write_excel(df, file_path, **kwargs):
+    """Atomically write a DataFrame to an .xlsx workbook (index=False by default)."""
+    kwargs.setdefault('index', False)
+    with atomic_path(file_path) as temp_path:
+        df.to_excel(temp_path, **kwargs)
+    return file_path
+
+def save_workbook(wb, file_path):
+    """Atomically save an openpyxl workbook."""
+    with atomic_path(file_path) as temp_path:
+        wb.save(temp_path)
+    return file_path
@@ -1,17 +1,35 @@
 import os
 import zipfile
 import tempfile
-import shutil
 from datetime import datetime
 import logging
 import traceback
 import sys
 from flask import current_app
+from .storage import LEDGERS, current_store
+from .atomic import atomic_path
 
 logger = logging.getLogger('diamond_app')
 
 __all__ = ['create_backup', 'restore_from_backup']
 
+def _write_backup(zip_path, data_dir, data_files):
+    """
+    Zip the data files into zip_path. The ledger database is added as a
+    consistent copy taken through the store, never as the live file, which
+    writers may be changing and whose journal lives in separate files.
+    """
+    store = current_store()
+    db_name = os.path.basename(store.db_path)
+    with tempfile.TemporaryDirectory() as temp_dir, atomic_path(zip_path) as partial_file, \
+            zipfile.ZipFile(partial_file, 'w') as zipf:
+        zipf.write(store.backup_to(os.path.join(temp_dir, db_name)), db_name)
+        for file_name in data_files:
+            file_path = os.path.join(data_dir, file_name)
+            if file_name != db_name and os.path.exists(file_path):
+                zipf.write(file_path, file_name)
+                logger.debug(f"Added file to backup: {file_name}")
+
 def create_backup():
     """
     Create a backup of all data files in a zip file.
@@ -29,7 +47,8 @@ def create_backup():
             'sales.xlsx',
             'payments.xlsx',
             'inventory.xlsx',
-            'rough_inventory.xlsx'
+            'rough_inventory.xlsx',
+            'ledger.db'
         ]
         
         # Create a timestamp for the backup file
@@ -48,12 +67,7 @@ def create_backup():
             logger.warning(f"The following files are missing and will not be included in the backup: {', '.join(missing_files)}")
         
         # Create a zip file containing all data files
-        with zipfile.ZipFile(backup_file, 'w') as zipf:
-            for file_name in data_files:
-                file_path = os.path.join(data_dir, file_name)
-                if os.path.exists(file_path):
-                    zipf.write(file_path, file_name)
-                    logger.debug(f"Added file to backup: {file_name}")
+        _write_backup(backup_file, data_dir, data_files)
         
         # Keep only the 10 most recent backups
         backup_files = sorted([os.path.join(backup_dir, f) for f in os.listdir(backup_dir) 
@@ -115,12 +129,8 @@ def restore_from_backup(backup_file):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         pre_restore_backup = os.path.join(backup_dir, f'pre_restore_backup_{timestamp}.zip')
         try:
-            with zipfile.ZipFile(pre_restore_backup, 'w') as zipf:
-                for file_name in ['purchases.xlsx', 'sales.xlsx', 'payments.xlsx', 
-                                'inventory.xlsx', 'rough_inventory.xlsx']:
-                    file_path = os.path.join(data_dir, file_name)
-                    if os.path.exists(file_path):
-                        zipf.write(file_path, file_name)
+            _write_backup(pre_restore_backup, data_dir, ['purchases.xlsx', 'sales.xlsx', 'payments.xlsx',
+                                                         'inventory.xlsx', 'rough_inventory.xlsx', 'ledger.db'])
             logger.info(f"Created pre-restore backup: {os.path.basename(pre_restore_backup)}")
         except Exception as e:
             logger.warning(f"Could not create pre-restore backup: {str(e)}")
@@ -135,12 +145,20 @@ def restore_from_backup(backup_file):
                 zipf.extractall(temp_dir)
                 logger.debug(f"Extracted backup to temporary directory")
             
-            # Copy the extracted files to the data directory
-            for file_name in os.listdir(temp_dir):
-                src_path = os.path.join(temp_dir, file_name)
-                dst_path = os.path.join(data_dir, file_name)
-                shutil.copy2(src_path, dst_path)
-                logger.debug(f"Copied {file_name} to data directory")
+            # Restore the ledger database through the store, which copies it
+            # into the live database and its journal; backups without one
+            # restore the ledgers from their workbooks instead
+            store = current_store()
+            extracted_db = os.path.join(temp_dir, os.path.basename(store.db_path))
+            if os.path.exists(extracted_db):
+                store.restore_from(extracted_db)
+                logger.debug("Restored the ledger database")
+            else:
+                for ledger, spec in LEDGERS.items():
+                    extracted_file = os.path.join(temp_dir, spec['file'])
+                    if os.path.exists(extracted_file):
+                        store.import_excel(ledger, extracted_file)
+                        logger.debug(f"Restored {ledger} from {spec['file']}")
         
         # Validate the restored data
         try:
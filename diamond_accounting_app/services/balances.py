@@ -0,0 +1,92 @@
+import logging
+
+from .storage import RECORD_ID, LedgerView, field_value, register_view
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['DIRECTIONS', 'BALANCE_FIELDS', 'PartyBalances', 'party_balance', 'party_balances']
+
+# Which way the money of each trade ledger flows: customers owe us for
+# sales, we owe suppliers for purchases
+DIRECTIONS = {'sales': 'receivable', 'purchases': 'payable'}
+
+BALANCE_FIELDS = ['party', 'direction', 'records', 'open_records', 'invoiced', 'received',
+                  'outstanding', 'oldest_open']
+
+@register_view
+class PartyBalances(LedgerView):
+    """
+    What each party has been invoiced, has paid and still owes, per direction.
+
+    A record counts as received in full once its status is Completed, and
+    up to its installments (see payment_lines) otherwise. A mutation only
+    recomputes the balances of the parties of the records it touched, using
+    the party index, so every balance is a primary key lookup away.
+    """
+    name = 'party_balances'
+    version = 1
+    ledgers = tuple(DIRECTIONS)
+
+    def create(self, conn):
+        conn.execute('DROP TABLE IF EXISTS party_balances')
+        conn.execute(
+            'CREATE TABLE party_balances ('
+            'party TEXT NOT NULL, direction TEXT NOT NULL, records INTEGER NOT NULL, '
+            'open_records INTEGER NOT NULL, invoiced REAL NOT NULL, received REAL NOT NULL, '
+            'outstanding REAL NOT NULL, oldest_open TEXT, PRIMARY KEY (party, direction))')
+        conn.execute('CREATE INDEX ix_party_balances_outstanding ON party_balances (direction, outstanding)')
+
+    def rebuild(self, tx, ledger):
+        tx.conn.execute('DELETE FROM party_balances WHERE direction = ?', (DIRECTIONS[ledger],))
+        self._refresh(tx, ledger)
+
+    def apply(self, tx, ledger, changes):
+        # An edit can move a record from one party to another; refresh both
+        parties = {field_value(record, ledger, 'Party', '') for pair in changes for record in pair if record is not None}
+        placeholders = ', '.join('?' for _ in parties)
+        tx.conn.execute(f'DELETE FROM party_balances WHERE direction = ? AND party IN ({placeholders})',
+                        [DIRECTIONS[ledger]] + list(parties))
+        self._refresh(tx, ledger, parties)
+
+    def _refresh(self, tx, ledger, parties=None):
+        """Insert the balances of the given parties (all by default) computed from the ledger."""
+        party = f"IFNULL({tx.field_sql(ledger, 'Party')}, '')"
+        amount = f"IFNULL({tx.field_sql(ledger, 'Total Amount INR')}, 0)"
+        completed = f"IFNULL({tx.field_sql(ledger, 'Payment Status')}, '') = 'completed' COLLATE NOCASE"
+        date = tx.field_sql(ledger, 'Date')
+        where, params = '', [DIRECTIONS[ledger], ledger]
+        if parties is not None:
+            placeholders = ', '.join('?' for _ in parties)
+            where = f' WHERE {party} IN ({placeholders})'
+            params += list(parties)
+            sources = tx.field_sources(ledger, 'Party')
+            if sources and '' not in parties:
+                # Lets SQLite find the rows through the party indexes
+                where += ' AND (' + ' OR '.join(f'{s} IN ({placeholders})' for s in sources) + ')'
+                params += list(parties) * len(sources)
+        tx.conn.execute(
+            f'INSERT INTO party_balances ({", ".join(BALANCE_FIELDS)}) '
+            f'SELECT party, ?, COUNT(*), TOTAL(is_open), TOTAL(amount), TOTAL(received), '
+            f'TOTAL(amount) - TOTAL(received), MIN(CASE WHEN is_open THEN date END) '
+            f'FROM (SELECT {party} AS party, {amount} AS amount, {date} AS date, '
+            f'NOT ({completed}) AS is_open, '
+            f'CASE WHEN {completed} THEN {amount} '
+            f'ELSE MIN({amount}, IFNULL(t.received_inr, 0)) END AS received '
+            f'FROM {ledger} r LEFT JOIN payment_totals t '
+            f'ON t.ledger = ? AND t.{RECORD_ID} = r.{RECORD_ID}{where}) '
+            f'GROUP BY party', params)
+
+def party_balance(store, party):
+    """Return {direction: balance row} for one party; empty if it has no records."""
+    rows = store.query(
+        f'SELECT {", ".join(BALANCE_FIELDS)} FROM party_balances WHERE party = ?', (party,))
+    return {row['direction']: row for row in rows}
+
+def party_balances(store, direction='receivable', open_only=True, limit=50, offset=0):
+    """Return balances in one direction, largest outstanding first."""
+    where = 'direction = ?'
+    if open_only:
+        where += ' AND outstanding > 0.005'
+    return store.query(
+        f'SELECT {", ".join(BALANCE_FIELDS)} FROM party_balances WHERE {where} '
+        f'ORDER BY outstanding DESC, party LIMIT ? OFFSET ?', (direction, int(limit), int(offset)))
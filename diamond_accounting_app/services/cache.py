@@ -0,0 +1,91 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+import pandas as pd
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['LedgerCache', 'file_token']
+
+# Cached frames are handed to many requests at once, each as its own copy so
+# a caller that modifies its frame cannot alter the cached one. pandas 3
+# copies on write, so a shallow copy is enough there; older versions get a
+# deep copy rather than switching copy-on-write on for the whole process.
+_DEEP_COPY = int(pd.__version__.split('.')[0]) < 3
+
+def file_token(*paths):
+    """Return the (path, mtime, size) of each file, used to validate cache entries."""
+    token = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            token.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            token.append((path, None, None))
+    return tuple(token)
+
+class LedgerCache:
+    """
+    In-process LRU cache of ledger DataFrames.
+    Each entry remembers the file token it was loaded under and is reloaded
+    as soon as the backing file changes, so writes made by other processes
+    are picked up too. Writes made through the app call invalidate() directly.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, token, loader):
+        """Return the cached frame for key, calling loader() if it is missing or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == token:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1].copy(deep=_DEEP_COPY)
+            self.misses += 1
+
+        df = loader()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self._lock:
+            self._discard(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (token, df, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._discard(oldest)
+                    logger.debug(f"Evicted {oldest} from ledger cache")
+        return df.copy(deep=_DEEP_COPY)
+
+    def invalidate(self, key=None):
+        """Drop every entry whose key starts with key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            else:
+                for cached in [k for k in self._entries if k[:len(key)] == key]:
+                    self._discard(cached)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,208 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .storage import RECORD_ID, _DEFAULT_RATE
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['MATCH_LEVELS', 'LOT_COLUMNS', 'match_lots', 'lot_matches', 'realized_pnl']
+
+# Keys sales are matched to purchases by, most specific first. Whatever a
+# level cannot cover falls through to the next one.
+MATCH_LEVELS = [('stone', 'Stone ID'), ('rough', 'Rough ID'), ('kapan', 'Kapan No')]
+
+# Columns the matching reads from the purchase and sale ledgers
+LOT_COLUMNS = ['Date', 'Stone ID', 'Rough ID', 'Kapan No', 'Carat', 'Pcs', 'Rate', 'Total Amount USD',
+               'Total Amount (USD)', 'Total Amount', 'Total Amount INR']
+
+def _column(df, name):
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype='float64')
+
+def _key(value):
+    """A match key as text; IDs read back from Excel may be stored as numbers."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+def _prepare(df):
+    """Order records oldest first with their carats, pieces, USD amount and match keys."""
+    amount = _column(df, 'Total Amount USD')
+    for name in ('Total Amount (USD)', 'Total Amount'):
+        amount = amount.fillna(pd.to_numeric(_column(df, name), errors='coerce'))
+    rate = pd.to_numeric(_column(df, 'Rate'), errors='coerce').fillna(_DEFAULT_RATE)
+    amount = amount.fillna(pd.to_numeric(_column(df, 'Total Amount INR'), errors='coerce') / rate)
+    prepared = pd.DataFrame({
+        'date': pd.to_datetime(_column(df, 'Date'), errors='coerce'),
+        'carats': pd.to_numeric(_column(df, 'Carat'), errors='coerce').fillna(0).clip(lower=0),
+        'pieces': pd.to_numeric(_column(df, 'Pcs'), errors='coerce').fillna(0),
+        'amount_usd': amount.fillna(0)
+    }, index=df.index)
+    for level, field in MATCH_LEVELS:
+        prepared[level] = _column(df, field).map(_key)
+    prepared = prepared.assign(_undated=prepared['date'].isna())
+    prepared = prepared.sort_values(['_undated', 'date'], kind='stable').drop(columns='_undated')
+    return prepared.rename_axis(RECORD_ID)
+
+def _reach(supply, lot_end, demand, available, level):
+    """
+    How far along its key's axis (see _fifo()) each sale may take carats:
+    up to the end of the last lot dated on or before it. Undated sales may
+    take every lot, while undated lots only go to undated sales.
+    """
+    reach = available.reindex(demand[level]).to_numpy(dtype=float, copy=True)
+    # merge_asof() wants both dates at one resolution
+    lots = pd.DataFrame({'key': supply[level], 'date': supply['date'].astype('datetime64[ns]'), 'reach': lot_end})
+    lots = lots[lots['date'].notna()].sort_values('date', kind='stable')
+    sold = pd.DataFrame({'key': demand[level], 'date': demand['date'].astype('datetime64[ns]'),
+                         'order': np.arange(len(demand))})
+    sold = sold[sold['date'].notna()].sort_values('date', kind='stable')
+    if not sold.empty:
+        found = pd.merge_asof(sold, lots, on='date', by='key', direction='backward')
+        reach[found['order'].to_numpy()] = found['reach'].fillna(0).to_numpy()
+    return pd.Series(reach, index=demand.index)
+
+def _fifo(lots, sales, level):
+    """
+    Match what the sales still need against what the lots still hold,
+    oldest first within each key of level, each sale only taking lots dated
+    on or before it. Both frames are updated in place.
+
+    Each key's lots are laid end to end on one carat axis, all keys one
+    after another, and the cost consumed up to any point of it is the
+    piecewise linear cumulative cost. The sales of a key take their carats
+    from the axis one after another, none beyond its reach (see _reach()),
+    so a sale occupies the stretch between where the key's sales before it
+    stopped and where it stops, and its cost is the difference of the
+    cumulative cost at both ends: one np.interp over all sales.
+    """
+    supply = lots[(lots['remaining'] > 0) & lots[level].notna()]
+    demand = sales[(sales['need'] > 0) & sales[level].notna()]
+    supply = supply[supply[level].isin(demand[level])]
+    demand = demand[demand[level].isin(supply[level])]
+    if demand.empty:
+        return
+    # Stable sorts keep the oldest first within each key
+    supply = supply.sort_values(level, kind='stable')
+    demand = demand.sort_values(level, kind='stable')
+
+    lot_end = supply.groupby(level, sort=False)['remaining'].cumsum()
+    lot_start = lot_end - supply['remaining']
+    available = supply.groupby(level, sort=False)['remaining'].sum()
+    offset = available.cumsum() - available
+
+    axis = np.concatenate([[0.0], (offset.reindex(supply[level]).to_numpy() + lot_end.to_numpy())])
+    cost = np.concatenate([[0.0], np.cumsum(supply['remaining'].to_numpy() * supply['unit_cost'].to_numpy())])
+
+    # Where a key's sales stop after each sale: their running need, held
+    # back by the tightest reach so far. As sales come oldest first their
+    # reach only grows, so this is need + min(0, running min of reach - need)
+    needed = demand.groupby(level, sort=False)['need'].cumsum()
+    reach = _reach(supply, lot_end, demand, available, level)
+    stop = needed + (reach - needed).clip(upper=0).groupby(demand[level], sort=False).cummin()
+    begin = stop.groupby(demand[level], sort=False).shift(1).fillna(0)
+    base = offset.reindex(demand[level]).to_numpy()
+    start = begin.to_numpy() + base
+    end = stop.to_numpy() + base
+    matched = end - start
+
+    sales.loc[demand.index, 'cost_usd'] += np.interp(end, axis, cost) - np.interp(start, axis, cost)
+    sales.loc[demand.index, 'matched_carats'] += matched
+    sales.loc[demand.index, 'need'] -= matched
+    first = demand.index[(matched > 0) & sales.loc[demand.index, 'matched_by'].isna().to_numpy()]
+    sales.loc[first, 'matched_by'] = level
+
+    taken = stop.groupby(demand[level], sort=False).last().reindex(supply[level]).to_numpy()
+    used = np.clip(taken - lot_start.to_numpy(), 0, supply['remaining'].to_numpy())
+    lots.loc[supply.index, 'remaining'] -= used
+
+def match_lots(purchases, sales):
+    """
+    Match the carats of every sale to purchase lots, as read with
+    LOT_COLUMNS, and return (sales, lots).
+
+    A sale takes the cost of the purchases with its Stone ID, then of its
+    Rough ID, then of its Kapan No, each at the purchase's USD cost per
+    carat and the oldest purchase first. Only purchases dated on or before
+    the sale are used; undated purchases only go to undated sales, which
+    may use any purchase. sales is indexed by the sale's
+    RECORD_ID with its date, carats, pieces, revenue_usd, cost_usd,
+    matched_carats, matched_by (the first level that matched) and
+    margin_usd, the revenue of the matched carats less their cost (NaN for
+    sales nothing matched). lots holds each purchase's carats, cost and
+    what remains of both.
+    """
+    lots = _prepare(purchases)
+    lots = lots[lots['carats'] > 0].copy()
+    lots['unit_cost'] = lots['amount_usd'] / lots['carats']
+    lots['remaining'] = lots['carats']
+
+    sold = _prepare(sales)
+    sold = sold.assign(need=sold['carats'], cost_usd=0.0, matched_carats=0.0,
+                       matched_by=pd.Series(None, index=sold.index, dtype=object))
+    for level, _ in MATCH_LEVELS:
+        _fifo(lots, sold, level)
+
+    share = np.where(sold['carats'] > 0, sold['matched_carats'] / sold['carats'].where(sold['carats'] > 0), 0)
+    margin = sold['amount_usd'] * share - sold['cost_usd']
+    sold = sold.assign(margin_usd=margin.where(sold['matched_carats'] > 0))
+    sold = sold.rename(columns={'amount_usd': 'revenue_usd'}).drop(columns='need')
+    lots = lots.assign(remaining_cost_usd=lots['remaining'] * lots['unit_cost'])
+    lots = lots.rename(columns={'amount_usd': 'cost_usd'})
+    return sold.sort_index(), lots.sort_index()
+
+def lot_matches(store):
+    """
+    match_lots() over the store's ledgers, cached until the next write to
+    either of them.
+    """
+    token, _ = store.data_version(['purchases', 'sales'])
+    computed = {}
+
+    def load(part):
+        def loader():
+            if not computed:
+                computed['sales'], computed['lots'] = match_lots(store.read('purchases', LOT_COLUMNS),
+                                                                 store.read('sales', LOT_COLUMNS))
+            return computed[part]
+        return loader
+
+    sales = store.cache.get((store.db_path, 'lot_matches', 'sales'), token, load('sales'))
+    lots = store.cache.get((store.db_path, 'lot_matches', 'lots'), token, load('lots'))
+    return sales, lots
+
+def realized_pnl(store, start=None, end=None):
+    """
+    Realized profit of the sales in a period of 'YYYY-MM' months (all by
+    default): revenue and cost of the matched carats, the margin on both,
+    how many sales are not or only partly matched, and the cost of the
+    stock still on hand.
+    """
+    sales, lots = lot_matches(store)
+    month = sales['date'].dt.strftime('%Y-%m').fillna('')
+    if start:
+        sales = sales[month.reindex(sales.index) >= str(start)[:7]]
+    if end:
+        sales = sales[month.reindex(sales.index) <= str(end)[:7]]
+    matched = sales[sales['matched_carats'] > 0]
+    cost = float(matched['cost_usd'].sum())
+    profit = float(matched['margin_usd'].sum())
+    revenue = cost + profit
+    return {
+        'realized_revenue': revenue,
+        'cost_of_goods_sold': cost,
+        'realized_profit': profit,
+        'profit_percentage': profit / cost * 100 if cost > 0 else 0,
+        'profit_margin': profit / revenue * 100 if revenue > 0 else 0,
+        'matched_sales_count': int(len(matched)),
+        'unmatched_sales_count': int((sales['matched_carats'] <= 0).sum()),
+        'partly_matched_sales_count': int(((sales['matched_carats'] > 0) &
+                                           (sales['matched_carats'] < sales['carats'] - 1e-9)).sum()),
+        'stock_on_hand_carats': float(lots['remaining'].sum()),
+        'stock_on_hand_usd': float(lots['remaining_cost_usd'].sum())
+    }
@@ -1,204 +1,108 @@
-from ..services.inventory import get_inventory_items, get_rough_inventory_items
-from ..services.sales import get_sales_records, get_payment_records
-from ..services.purchases import get_purchase_records
-import pandas as pd
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .totals import SUMMED_FIELDS
 
 logger = logging.getLogger('diamond_app')
 
-def get_dashboard_data():
-    """Gather all data needed for the dashboard."""
-    try:
-        data = {
-            'summary': get_summary_metrics(),
-            'inventory': get_inventory_metrics(),
-            'sales': get_sales_metrics(),
-            'purchases': get_purchase_metrics(),
-            'payments': get_payment_metrics(),
-            'charts': get_chart_data()
-        }
-        return data
-    except Exception as e:
-        logger.error(f"Error gathering dashboard data: {str(e)}")
-        return {}
+__all__ = ['SNAPSHOT_COLUMNS', 'RECENT_WINDOWS', 'RECENT_DAYS', 'DashboardSnapshot', 'window_totals',
+           'inventory_stats', 'rough_inventory_stats', 'recent_trade']
+
+# Fields the snapshot reads from each ledger the dashboard shows
+SNAPSHOT_COLUMNS = {
+    'inventory': ['carats', 'purchase_price', 'market_value'],
+    'rough_inventory': ['weight', 'pieces', 'purchase_price'],
+    'sales': ['Date'] + SUMMED_FIELDS['amount_usd'],
+    'purchases': ['Date'] + SUMMED_FIELDS['amount_usd']
+}
 
-def get_summary_metrics():
-    """Get summary metrics for the dashboard."""
-    try:
-        inventory = get_inventory_items()
-        rough_inventory = get_rough_inventory_items()
-        sales = get_sales_records()
-        purchases = get_purchase_records()
-        payments = get_payment_records()
-        
-        # Calculate total values
-        total_inventory_value = sum(item['price'] for item in inventory)
-        total_rough_value = sum(item['purchase_price'] for item in rough_inventory)
-        total_sales = sum(sale['amount'] for sale in sales)
-        total_purchases = sum(purchase['amount'] for purchase in purchases)
-        total_payments = sum(payment['amount'] for payment in payments)
-        pending_payments = total_sales - total_payments
-        
-        return {
-            'total_inventory_value': total_inventory_value,
-            'total_rough_value': total_rough_value,
-            'total_sales': total_sales,
-            'total_purchases': total_purchases,
-            'total_payments': total_payments,
-            'pending_payments': pending_payments,
-            'profit': total_sales - total_purchases
-        }
-    except Exception as e:
-        logger.error(f"Error calculating summary metrics: {str(e)}")
-        return {}
+# Windows, in days, the recent sales and purchase metrics are reported for
+RECENT_WINDOWS = (7, 30, 90, 365)
 
-def get_inventory_metrics():
-    """Get inventory-related metrics."""
-    try:
-        inventory = get_inventory_items()
-        rough_inventory = get_rough_inventory_items()
-        
-        return {
-            'total_items': len(inventory),
-            'total_rough_items': len(rough_inventory),
-            'total_carats': sum(item.get('carats', 0) for item in inventory),
-            'total_rough_carats': sum(item.get('weight', 0) for item in rough_inventory),
-            'avg_price_per_carat': calculate_avg_price_per_carat(inventory)
-        }
-    except Exception as e:
-        logger.error(f"Error calculating inventory metrics: {str(e)}")
-        return {}
+# The window behind the recent_* figures
+RECENT_DAYS = 30
 
-def get_sales_metrics():
-    """Get sales-related metrics."""
-    try:
-        sales = get_sales_records()
-        
-        # Get recent sales (last 30 days)
-        recent_sales = [
-            sale for sale in sales
-            if (datetime.now() - datetime.strptime(sale['date'], '%Y-%m-%d')).days <= 30
-        ]
-        
-        return {
-            'total_sales_count': len(sales),
-            'recent_sales_count': len(recent_sales),
-            'avg_sale_value': sum(sale['amount'] for sale in sales) / len(sales) if sales else 0,
-            'recent_sales_value': sum(sale['amount'] for sale in recent_sales)
-        }
-    except Exception as e:
-        logger.error(f"Error calculating sales metrics: {str(e)}")
-        return {}
+class DashboardSnapshot:
+    """
+    The ledgers behind the dashboard, each read from the store at most once,
+    on first use, and only with the fields in SNAPSHOT_COLUMNS. All figures
+    of one dashboard computation share a snapshot.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._frames = {}
 
-def get_purchase_metrics():
-    """Get purchase-related metrics."""
-    try:
-        purchases = get_purchase_records()
-        
-        # Get recent purchases (last 30 days)
-        recent_purchases = [
-            purchase for purchase in purchases
-            if (datetime.now() - datetime.strptime(purchase['date'], '%Y-%m-%d')).days <= 30
-        ]
-        
-        return {
-            'total_purchases_count': len(purchases),
-            'recent_purchases_count': len(recent_purchases),
-            'avg_purchase_value': sum(purchase['amount'] for purchase in purchases) / len(purchases) if purchases else 0,
-            'recent_purchases_value': sum(purchase['amount'] for purchase in recent_purchases)
-        }
-    except Exception as e:
-        logger.error(f"Error calculating purchase metrics: {str(e)}")
-        return {}
+    def frame(self, name):
+        """A ledger as a DataFrame with its pinned dtypes; treat it as read-only."""
+        if name not in self._frames:
+            self._frames[name] = self.store.read(name, SNAPSHOT_COLUMNS[name])
+        return self._frames[name]
 
-def get_payment_metrics():
-    """Get payment-related metrics."""
-    try:
-        payments = get_payment_records()
-        sales = get_sales_records()
-        
-        total_sales_amount = sum(sale['amount'] for sale in sales)
-        total_payments_amount = sum(payment['amount'] for payment in payments)
-        
-        return {
-            'total_payments': total_payments_amount,
-            'pending_payments': total_sales_amount - total_payments_amount,
-            'payment_ratio': (total_payments_amount / total_sales_amount * 100) if total_sales_amount > 0 else 0
-        }
-    except Exception as e:
-        logger.error(f"Error calculating payment metrics: {str(e)}")
-        return {}
+def _sum(df, column):
+    if column not in df.columns:
+        return 0.0
+    return float(pd.to_numeric(df[column], errors='coerce').sum())
 
-def get_chart_data():
-    """Get data for dashboard charts."""
-    try:
-        sales = get_sales_records()
-        purchases = get_purchase_records()
-        payments = get_payment_records()
-        
-        # Convert to pandas DataFrames for easier analysis
-        sales_df = pd.DataFrame(sales)
-        purchases_df = pd.DataFrame(purchases)
-        payments_df = pd.DataFrame(payments)
-        
-        # Add date columns
-        sales_df['date'] = pd.to_datetime(sales_df['date'])
-        purchases_df['date'] = pd.to_datetime(purchases_df['date'])
-        payments_df['date'] = pd.to_datetime(payments_df['date'])
-        
-        return {
-            'monthly_sales': get_monthly_trend(sales_df, 'amount'),
-            'monthly_purchases': get_monthly_trend(purchases_df, 'amount'),
-            'monthly_payments': get_monthly_trend(payments_df, 'amount'),
-            'payment_status': get_payment_status_distribution(sales_df, payments_df)
-        }
-    except Exception as e:
-        logger.error(f"Error generating chart data: {str(e)}")
-        return {}
+def window_totals(df, windows=RECENT_WINDOWS, reference=None, value_column='amount', date_column='date'):
+    """
+    Count and sum value_column over the records dated (in date_column, a
+    datetime64 column) at most each of windows days before reference (now
+    by default), as {days: {'count', 'value'}}. All windows come from one
+    pass over the dates; records without a valid date, or dated after
+    reference, are left out.
+    """
+    totals = {days: {'count': 0, 'value': 0.0} for days in windows}
+    if df.empty or date_column not in df:
+        return totals
+    reference = pd.Timestamp(reference or datetime.now())
+    ages = (reference - df[date_column]).to_numpy(dtype='timedelta64[ns]')
+    dated = ~np.isnat(ages) & (ages >= np.timedelta64(0, 'ns'))
+    order = np.argsort(ages[dated], kind='stable')
+    ages = ages[dated][order]
+    values = np.cumsum(pd.to_numeric(df[value_column], errors='coerce').fillna(0).to_numpy(dtype=float)[dated][order])
+    limits = np.array([pd.Timedelta(days=days).to_timedelta64() for days in windows], dtype='timedelta64[ns]')
+    for days, count in zip(windows, np.searchsorted(ages, limits, side='right')):
+        totals[days] = {'count': int(count), 'value': float(values[count - 1]) if count else 0.0}
+    return totals
 
-def get_monthly_trend(df, value_column):
-    """Calculate monthly trend for a DataFrame."""
-    try:
-        if df.empty:
-            return []
-        
-        monthly = df.groupby(df['date'].dt.strftime('%Y-%m'))[value_column].sum()
-        return [
-            {'month': month, 'value': float(value)}
-            for month, value in monthly.items()
-        ]
-    except Exception as e:
-        logger.error(f"Error calculating monthly trend: {str(e)}")
-        return []
+def inventory_stats(snapshot):
+    """Items, carats and market value of the polished inventory."""
+    df = snapshot.frame('inventory')
+    return {
+        'total_items': len(df),
+        'total_carats': _sum(df, 'carats'),
+        'total_value': _sum(df, 'market_value'),
+        'total_cost': _sum(df, 'purchase_price')
+    }
 
-def get_payment_status_distribution(sales_df, payments_df):
-    """Calculate payment status distribution."""
-    try:
-        if sales_df.empty:
-            return {'paid': 0, 'pending': 0}
-        
-        total_sales = sales_df['amount'].sum()
-        total_payments = payments_df['amount'].sum() if not payments_df.empty else 0
-        
-        return {
-            'paid': float(total_payments),
-            'pending': float(total_sales - total_payments)
-        }
-    except Exception as e:
-        logger.error(f"Error calculating payment distribution: {str(e)}")
-        return {'paid': 0, 'pending': 0}
+def rough_inventory_stats(snapshot):
+    """Items, weight, pieces and purchase value of the rough inventory."""
+    df = snapshot.frame('rough_inventory')
+    return {
+        'total_items': len(df),
+        'total_weight': _sum(df, 'weight'),
+        'total_pieces': _sum(df, 'pieces'),
+        'total_value': _sum(df, 'purchase_price')
+    }
 
-def calculate_avg_price_per_carat(inventory):
-    """Calculate average price per carat for inventory items."""
-    try:
-        if not inventory:
-            return 0
-        
-        total_price = sum(item['price'] for item in inventory)
-        total_carats = sum(item.get('carats', 0) for item in inventory)
-        
-        return total_price / total_carats if total_carats > 0 else 0
-    except Exception as e:
-        logger.error(f"Error calculating average price per carat: {str(e)}")
-        return 0 
\ No newline at end of file
+def recent_trade(snapshot, ledger, windows=RECENT_WINDOWS, reference=None):
+    """
+    Count and USD value of the ledger's records in the last RECENT_DAYS
+    days and in each of windows days, all from one window_totals() pass.
+    """
+    df = snapshot.frame(ledger)
+    amount = pd.Series(np.nan, index=df.index, dtype='float64')
+    # Older rows only carry the USD total under a legacy name
+    for name in SUMMED_FIELDS['amount_usd']:
+        if name in df.columns:
+            amount = amount.fillna(pd.to_numeric(df[name], errors='coerce'))
+    recent = window_totals(df.assign(amount=amount), tuple(windows) + (RECENT_DAYS,), reference,
+                           date_column='Date')
+    return {
+        'recent_count': recent[RECENT_DAYS]['count'],
+        'recent_value': recent[RECENT_DAYS]['value'],
+        'windows': {days: recent[days] for days in windows}
+    }
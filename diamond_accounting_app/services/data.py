@@ -6,6 +6,8 @@ from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 from openpyxl import load_workbook, Workbook
 
+from .atomic import write_excel, save_workbook
+
 logger = logging.getLogger('diamond_app')
 
 __all__ = ['fix_data_types', 'validate_data_consistency', 'enhance_excel_formatting']
@@ -54,7 +56,7 @@ def fix_data_types():
                                 df[col] = ''
                     
                     # Save the fixed DataFrame
-                    df.to_excel(file_path, index=False)
+                    write_excel(df, file_path)
                     logger.info(f"Fixed data types in {file_name}")
         
         return True
@@ -149,7 +151,7 @@ def enhance_excel_formatting(file_path, sheet_name='Sheet1'):
             wb = Workbook()
             sheet = wb.active
             sheet.title = sheet_name
-            wb.save(file_path)
+            save_workbook(wb, file_path)
             logger.info(f"Created new Excel file at {file_path}")
         
         # Load the workbook directly with openpyxl
@@ -214,7 +216,7 @@ def enhance_excel_formatting(file_path, sheet_name='Sheet1'):
                         cell.alignment = Alignment(vertical='center')
         
         # Save the workbook
-        wb.save(file_path)
+        save_workbook(wb, file_path)
         logger.info(f"Enhanced formatting for {os.path.basename(file_path)}")
         return True
     except Exception as e:
@@ -0,0 +1,60 @@
+import os
+import threading
+import logging
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['JournalCompactor']
+
+class JournalCompactor(threading.Thread):
+    """
+    Background thread that folds the ledger's write-ahead journal into the
+    database file.
+
+    The store runs SQLite in WAL mode: every committed transaction is
+    appended and fsync'd to ledger.db-wal, so a write costs the same no
+    matter how large the ledgers are, and a crash can never leave a half
+    rewritten ledger behind. Automatic checkpoints are disabled on the
+    request path; this thread checkpoints every `interval` seconds, or
+    sooner once the journal grows past `max_bytes`.
+
+    SQLite checkpoints and deletes the journal when the last connection to
+    the database closes, so the compactor keeps one connection open for the
+    lifetime of the store and runs its checkpoints through it.
+    """
+    def __init__(self, store, interval=30, max_bytes=4 * 1024 * 1024):
+        super().__init__(name='ledger-compactor', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.journal_path = store.db_path + '-wal'
+        self.conn = store._connect(check_same_thread=False)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def notify(self):
+        """Called after each commit; wakes the thread early if the journal is large."""
+        if self.journal_size() >= self.max_bytes:
+            self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self.journal_size() == 0:
+                continue
+            try:
+                self.store.checkpoint(self.conn)
+            except Exception as e:
+                logger.error(f"Error compacting ledger journal: {str(e)}")
+        self.conn.close()
@@ -0,0 +1,111 @@
+import logging
+
+import pandas as pd
+
+from .costing import _column, _key, lot_matches
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['KAPAN_FIELDS', 'kapan_analytics', 'kapan_report']
+
+# Figures per kapan, in the order the report shows them
+KAPAN_FIELDS = [
+    'kapan', 'first_purchase', 'rough_records', 'rough_carats', 'rough_pieces', 'rough_cost_usd',
+    'rough_on_hand_carats', 'rough_on_hand_cost_usd', 'rough_inventory_carats',
+    'rough_inventory_pieces', 'polished_records', 'polished_carats', 'polished_pieces',
+    'revenue_usd', 'yield_pct', 'cost_per_polished_carat', 'revenue_per_polished_carat',
+    'cost_of_goods_sold_usd', 'realized_margin_usd', 'realized_margin_pct', 'net_usd',
+    'unmatched_sales'
+]
+
+# Figures that are counts of records
+_COUNTS = ['rough_records', 'polished_records', 'unmatched_sales']
+
+# Columns read from the rough inventory
+_ROUGH_COLUMNS = ['kapan_no', 'rough_id', 'weight', 'pieces']
+
+def _kapan_of_sales(sales, lots):
+    """
+    The kapan of each sale: its own Kapan No, else the kapan of the
+    purchase with its Rough ID, else of the purchase with its Stone ID.
+    """
+    kapan = sales['kapan']
+    for level in ('rough', 'stone'):
+        known = lots[lots[level].notna() & lots['kapan'].notna()].drop_duplicates(level)
+        kapan = kapan.fillna(sales[level].map(known.set_index(level)['kapan']))
+    return kapan
+
+def _ratio(numerator, denominator, scale=1):
+    """numerator / denominator * scale, with 0 where the denominator is not positive."""
+    denominator = denominator.where(denominator > 0)
+    return (numerator / denominator * scale).fillna(0)
+
+def _derive(df):
+    """Add the ratios, computed from the summed columns so they also hold for totals."""
+    df['yield_pct'] = _ratio(df['polished_carats'], df['rough_carats'], 100)
+    df['cost_per_polished_carat'] = _ratio(df['rough_cost_usd'], df['polished_carats'])
+    df['revenue_per_polished_carat'] = _ratio(df['revenue_usd'], df['polished_carats'])
+    df['realized_margin_pct'] = _ratio(df['realized_margin_usd'],
+                                       df['cost_of_goods_sold_usd'] + df['realized_margin_usd'], 100)
+    df['net_usd'] = df['revenue_usd'] - df['rough_cost_usd']
+    return df
+
+def _compute(store):
+    sales, lots = lot_matches(store)
+    sales = sales.assign(kapan=_kapan_of_sales(sales, lots))
+    lots = lots[lots['kapan'].notna()]
+    sales = sales[sales['kapan'].notna()]
+
+    rough_in = lots.groupby('kapan').agg(
+        first_purchase=('date', 'min'), rough_records=('carats', 'size'), rough_carats=('carats', 'sum'),
+        rough_pieces=('pieces', 'sum'), rough_cost_usd=('cost_usd', 'sum'),
+        rough_on_hand_carats=('remaining', 'sum'), rough_on_hand_cost_usd=('remaining_cost_usd', 'sum'))
+    polished_out = sales.assign(unmatched=sales['matched_carats'] <= 0).groupby('kapan').agg(
+        polished_records=('carats', 'size'), polished_carats=('carats', 'sum'),
+        polished_pieces=('pieces', 'sum'), revenue_usd=('revenue_usd', 'sum'),
+        cost_of_goods_sold_usd=('cost_usd', 'sum'), realized_margin_usd=('margin_usd', 'sum'),
+        unmatched_sales=('unmatched', 'sum'))
+
+    rough = store.read('rough_inventory', _ROUGH_COLUMNS)
+    on_hand = pd.DataFrame({
+        'kapan': _column(rough, 'kapan_no').map(_key),
+        'rough_inventory_carats': pd.to_numeric(_column(rough, 'weight'), errors='coerce'),
+        'rough_inventory_pieces': pd.to_numeric(_column(rough, 'pieces'), errors='coerce')
+    }, index=rough.index).dropna(subset=['kapan']).groupby('kapan').sum()
+
+    df = rough_in.join(polished_out, how='outer').join(on_hand, how='outer')
+    amounts = [c for c in df.columns if c not in _COUNTS and c != 'first_purchase']
+    df[_COUNTS] = df[_COUNTS].fillna(0).astype('int64')
+    df[amounts] = df[amounts].fillna(0.0)
+    df = _derive(df).rename_axis('kapan').reset_index()
+    # Newest kapans first, those without purchases last
+    df = df.assign(_undated=df['first_purchase'].isna())
+    df = df.sort_values(['_undated', 'first_purchase', 'kapan'], ascending=[True, False, True], kind='stable')
+    return df[KAPAN_FIELDS].reset_index(drop=True)
+
+def kapan_analytics(store):
+    """
+    One row per kapan: rough carats, pieces and cost bought (purchases with
+    the Kapan No), rough still in the rough inventory, polished carats,
+    pieces and revenue sold (sales with the kapan, or whose Rough or Stone
+    ID belongs to one of its purchases), the yield, the cost and revenue
+    per polished carat and the realized margin of the lot-matched sales.
+    Kept in the store's cache until the purchases, sales or rough
+    inventory change.
+    """
+    token, _ = store.data_version(['purchases', 'sales', 'rough_inventory'])
+    return store.cache.get((store.db_path, 'kapan_analytics'), token, lambda: _compute(store))
+
+def kapan_report(store, kapans=None):
+    """
+    The kapan analytics as JSON-friendly rows plus their totals, for all
+    kapans or the given ones.
+    """
+    df = kapan_analytics(store)
+    if kapans:
+        df = df[df['kapan'].isin([_key(k) for k in kapans])]
+    totals = _derive(df.drop(columns=['kapan', 'first_purchase']).sum().to_frame().T.astype('float64'))
+    totals = {k: int(v) if k in _COUNTS else float(v) for k, v in totals.iloc[0].items()}
+    rows = df.assign(first_purchase=df['first_purchase'].dt.strftime('%Y-%m-%d'))
+    rows = rows.astype(object).where(rows.notna(), None)
+    return {'kapans': rows.to_dict('records'), 'totals': {'kapans': len(rows), **totals}}
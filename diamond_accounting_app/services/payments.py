@@ -0,0 +1,202 @@
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .storage import SORT_KEY
+from .records import DEFAULT_PAGE_SIZE, ledger_filters
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['TRADE_COLUMNS', 'PAYMENT_COLUMNS', 'page_transactions', 'page_pending_payments']
+
+# Columns the payments page needs from each ledger
+TRADE_COLUMNS = ['Date', 'Party', 'Total Amount INR', 'Payment Status']
+PAYMENT_COLUMNS = ['id', 'name', 'total_amount', 'paid_amount', 'pending_amount', 'status', 'payment_date']
+
+STATUS_COLORS = {
+    'pending': 'danger',
+    'partial': 'warning',
+    'completed': 'success'
+}
+
+# Where each kind of transaction comes from, in the order kinds dated the
+# same day are listed: (kind, ledger, date, party, amount, status field)
+TRANSACTION_SOURCES = [
+    ('purchase', 'purchases', 'Date', 'Party', 'Total Amount INR', 'Payment Status'),
+    ('sale', 'sales', 'Date', 'Party', 'Total Amount INR', 'Payment Status'),
+    ('payment', 'payments', 'payment_date', 'name', 'total_amount', 'status')
+]
+
+# Purchases and sales awaiting payment: (type, reference type, ledger)
+PENDING_SOURCES = [
+    ('supplier', 'purchase', 'purchases'),
+    ('customer', 'sale', 'sales')
+]
+
+# 'HH:MM' label for every minute of the day, indexed by hour * 60 + minute
+TIME_LABELS = np.array([f'{m // 60:02d}:{m % 60:02d}' for m in range(24 * 60)], dtype=object)
+
+def _column(df, name, default=None):
+    """Return a column as a Series, or a Series of default if the ledger lacks it."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+def _text(df, name, default='Unknown'):
+    values = _column(df, name)
+    return values.astype(object).where(values.notna(), default).astype(str)
+
+def _dates(df, name, now):
+    """Parse a date column in one pass; missing or invalid dates fall back to now."""
+    dates = _column(df, name)
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+    minutes = (dates.dt.hour * 60 + dates.dt.minute).fillna(0).astype(int)
+    times = pd.Series(TIME_LABELS[minutes.to_numpy()], index=df.index)
+    return dates.fillna(now), times
+
+def _amounts(df, name):
+    return pd.to_numeric(_column(df, name), errors='coerce').fillna(0.0).astype(float)
+
+def _records(df):
+    """Like df.to_dict('records'), but converts whole columns to Python values at once."""
+    columns = list(df.columns)
+    values = []
+    for name in columns:
+        column = df[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            # Plain datetimes convert much faster than boxing a Timestamp per row
+            values.append(list(column.dt.to_pydatetime()))
+        else:
+            values.append(column.tolist())
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+def _frame(df, kind, date_column, party_column, amount_column, status_column, ids, now):
+    dates, times = _dates(df, date_column, now)
+    status = _text(df, status_column)
+    return pd.DataFrame({
+        'date': dates,
+        'time': times,
+        'type': kind,
+        'party': _text(df, party_column),
+        'amount': _amounts(df, amount_column),
+        'status': status,
+        'status_color': status.str.lower().map(STATUS_COLORS).fillna('secondary'),
+        'id': ids
+    })
+
+def _cursor(value):
+    """Parse a 'sort key|source|record id' cursor; anything else starts from the top."""
+    if not value:
+        return None
+    try:
+        key, source, record_id = str(value).rsplit('|', 2)
+        return key, int(source), int(record_id)
+    except ValueError:
+        return None
+
+def _after(cursor, source):
+    """
+    Keyset position to continue a source from. Pages are ordered by date
+    (newest first), then source, then RECORD_ID (newest first), so sources
+    listed before the cursor's continue after its date and those listed
+    after it continue from its date.
+    """
+    if cursor is None:
+        return None
+    key, cursor_source, record_id = cursor
+    if source == cursor_source:
+        return key, record_id
+    return key, (0 if source < cursor_source else sys.maxsize)
+
+def _merge(frames, limit):
+    """Take the first limit rows of per-source pages, returning them and the next cursor."""
+    if not frames:
+        return None, None
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.sort_values(['sort_key', 'source', 'record_id'], ascending=[False, True, False],
+                                kind='stable').head(limit)
+    next_cursor = None
+    if len(merged) == limit:
+        last = merged.iloc[-1]
+        next_cursor = f"{last['sort_key']}|{last['source']}|{last['record_id']}"
+    return merged.drop(columns=['sort_key', 'source', 'record_id']), next_cursor
+
+def _keys(df, source):
+    """Merge keys of a page read with store.select."""
+    return {'sort_key': df[SORT_KEY].astype(str).to_numpy(), 'source': source,
+            'record_id': df.index.to_numpy()}
+
+def page_transactions(store, status=None, type_filter=None, party=None, start_date=None,
+                      end_date=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    Return one page of purchases, sales and payments, newest first, as
+    transaction dicts, and the cursor of the next page (None on the last).
+    Each ledger is asked for at most limit rows past the cursor, so a page
+    costs the same however long the history is.
+    """
+    now = pd.Timestamp.now()
+    cursor = _cursor(cursor)
+    frames = []
+    for source, (kind, ledger, date_field, party_field, amount_field, status_field) in \
+            enumerate(TRANSACTION_SOURCES):
+        if type_filter and kind != type_filter:
+            continue
+        columns = [date_field, party_field, amount_field, status_field]
+        if ledger == 'payments':
+            columns.append('id')
+        where = ledger_filters(date_field, party_field, status_field, status=status, party=party,
+                               start_date=start_date, end_date=end_date)
+        df = store.select(ledger, columns, where, order_by=date_field, descending=True,
+                          limit=limit, after=_after(cursor, source))
+        if ledger == 'payments':
+            # Payments are addressed by their payment ID where they have one
+            ids = _text(df, 'id', None).where(_column(df, 'id').notna(), df.index.astype(str))
+        else:
+            ids = df.index.astype(str)
+        frame = _frame(df, kind, date_field, party_field, amount_field, status_field, ids, now)
+        frames.append(frame.assign(**_keys(df, source)))
+    transactions, next_cursor = _merge(frames, limit)
+    return (_records(transactions) if transactions is not None else []), next_cursor
+
+def _pending(df, kind, reference_type, received, now):
+    dates, _ = _dates(df, 'Date', now)
+    amounts = _amounts(df, 'Total Amount INR')
+    # Installments already received on partially paid records
+    paid = received['received_inr'].reindex(df.index, fill_value=0.0).astype(float)
+    formatted_status = _text(df, 'Payment Status')
+    return pd.DataFrame({
+        'id': df.index.astype(str),
+        'type': kind,
+        'name': _text(df, 'Party'),
+        'total_amount': amounts,
+        'pending_amount': (amounts - paid).clip(lower=0.0),
+        'status': formatted_status,
+        'status_color': formatted_status.str.lower().map(STATUS_COLORS).fillna('secondary'),
+        'reference_type': reference_type,
+        'date': dates
+    })
+
+def page_pending_payments(store, type_filter=None, start_date=None, end_date=None, party=None,
+                          limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    Return one page of purchases and sales still awaiting payment, newest
+    first, as payment dicts, and the cursor of the next page.
+    """
+    now = pd.Timestamp.now()
+    cursor = _cursor(cursor)
+    frames = []
+    for source, (kind, reference_type, ledger) in enumerate(PENDING_SOURCES):
+        if type_filter and kind != type_filter.lower():
+            continue
+        where = ledger_filters('Date', 'Party', 'Payment Status', party=party,
+                               start_date=start_date, end_date=end_date)
+        where.append(('Payment Status', 'in', ['pending', 'partial']))
+        df = store.select(ledger, TRADE_COLUMNS, where, order_by='Date', descending=True,
+                          limit=limit, after=_after(cursor, source))
+        received = store.received(ledger, df.index)
+        frames.append(_pending(df, kind, reference_type, received, now).assign(**_keys(df, source)))
+    pending, next_cursor = _merge(frames, limit)
+    return (_records(pending) if pending is not None else []), next_cursor
@@ -0,0 +1,118 @@
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from .storage import RECORD_ID
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['RECORD_LEDGERS', 'RECORD_FIELDS', 'MAX_PAGE_SIZE', 'page_size', 'ledger_filters',
+           'page_records', 'json_rows']
+
+# Record types shown on the records page and the ledger each lives in
+RECORD_LEDGERS = {'purchase': 'purchases', 'sale': 'sales'}
+
+# Fields shown on the records page, under the keys the page uses for them.
+# These keys are also the sort keys the records API accepts.
+RECORD_FIELDS = {
+    'date': 'Date', 'party': 'Party', 'description': 'Description', 'carat': 'Carat',
+    'amount_usd': 'Total Amount USD', 'amount_inr': 'Total Amount INR',
+    'payment_status': 'Payment Status'
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a requested page size, clamped to 1..MAX_PAGE_SIZE."""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+def _parse_date(value):
+    """Parse a filter date, ignoring values that are not dates."""
+    if not value:
+        return None
+    try:
+        return pd.to_datetime(value)
+    except (ValueError, TypeError):
+        return None
+
+def _parse_number(value):
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def ledger_filters(date_field, party_field, status_field, status=None, party=None,
+                   start_date=None, end_date=None, amount_field=None, min_amount=None,
+                   max_amount=None):
+    """
+    Turn the page filters into store filters on the given ledger fields.
+    Empty and unparseable values are ignored, like the pages always did.
+    """
+    where = []
+    if status and status.lower() != 'all':
+        where.append((status_field, '=', status))
+    if party:
+        where.append((party_field, 'like', f'%{party}%'))
+    start, end = _parse_date(start_date), _parse_date(end_date)
+    if start is not None:
+        where.append((date_field, '>=', start))
+    if end is not None:
+        where.append((date_field, '<=', end))
+    if amount_field:
+        low, high = _parse_number(min_amount), _parse_number(max_amount)
+        if low is not None:
+            where.append((amount_field, '>=', low))
+        if high is not None:
+            where.append((amount_field, '<=', high))
+    return where
+
+def _rows(df, fields):
+    """Convert a page to dicts keyed by the page's names, with missing values as None."""
+    columns = {RECORD_ID: df.index.tolist()}
+    for key, name in fields.items():
+        if name not in df.columns:
+            columns[key] = [None] * len(df)
+            continue
+        values = df[name]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            columns[key] = values.dt.strftime('%Y-%m-%d').astype(object).where(values.notna(), None).tolist()
+        else:
+            columns[key] = values.astype(object).where(values.notna(), None).tolist()
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+def page_records(store, record_type, where=(), sort='date', order='desc', page=1,
+                 per_page=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of purchase or sale records and the paging details.
+    Only the requested page is read from the store.
+    """
+    ledger = RECORD_LEDGERS[record_type]
+    if sort not in RECORD_FIELDS:
+        sort = 'date'
+    total = store.count(ledger, where)
+    pages = max(1, -(-total // per_page))
+    page = max(1, min(int(page), pages))
+    df = store.select(ledger, RECORD_FIELDS.values(), where, order_by=RECORD_FIELDS[sort],
+                      descending=order != 'asc', limit=per_page, offset=(page - 1) * per_page)
+    return {
+        'items': _rows(df, RECORD_FIELDS),
+        'total': total,
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'sort': sort,
+        'order': 'asc' if order == 'asc' else 'desc'
+    }
+
+def json_rows(rows):
+    """Make row dicts JSON friendly: datetimes become 'YYYY-MM-DD' strings."""
+    return [{k: v.strftime('%Y-%m-%d') if isinstance(v, datetime) else v for k, v in row.items()}
+            for row in rows]
@@ -0,0 +1,154 @@
+import threading
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['PayloadRefresher']
+
+class _Payload:
+    def __init__(self, compute, depends_on, max_age):
+        self.compute = compute
+        self.depends_on = frozenset(depends_on) if depends_on is not None else None
+        self.max_age = max_age
+        self.value = None
+        self.refreshed_at = None
+        self.computed = False
+        # Store data version of depends_on the value was computed from
+        self.version = None
+        self.lock = threading.Lock()
+
+    def due(self, now, version):
+        """Whether the payload needs recomputing: its sources changed or it got older than max_age."""
+        if not self.computed:
+            return False
+        if version != self.version:
+            return True
+        return self.max_age is not None and (now - self.refreshed_at).total_seconds() >= self.max_age
+
+class PayloadRefresher(threading.Thread):
+    """
+    Background thread that keeps expensive page payloads (dashboard,
+    reports) computed ahead of the requests that show them.
+
+    Each payload names the ledgers and views it is derived from and
+    remembers their version in the store's data_versions when it was
+    computed. A payload is stale once that version moved, whoever wrote:
+    this process, another worker, the CLI or a reloaded app. Commits from
+    this process wake the thread at once, and once writes have been quiet
+    for `delay` seconds (or `max_delay` seconds after the first of a burst)
+    it recomputes what went stale; other writers are noticed within `poll`
+    seconds. Until then get() keeps serving the last good payload with the
+    time it was computed, so a request never waits on recomputation; only
+    the very first request for a payload computes it inline. A failed
+    recompute keeps the previous payload.
+    """
+    def __init__(self, store, delay=2.0, max_delay=30.0, poll=5.0):
+        super().__init__(name='payload-refresher', daemon=True)
+        self.store = store
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll = poll
+        self.refreshes = 0
+        self._payloads = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        store.subscribe(self.notify)
+
+    def register(self, name, compute, depends_on=None, max_age=None):
+        """
+        Keep compute() fresh under name. It is recomputed after commits
+        touching any of depends_on (any commit when None), and at least every
+        max_age seconds when given, e.g. for payloads that depend on the date.
+        """
+        self._payloads[name] = _Payload(compute, depends_on, max_age)
+
+    def get(self, name):
+        """Return (payload, refreshed_at) for a registered payload."""
+        payload = self._payloads[name]
+        if not payload.computed:
+            with payload.lock:
+                # Concurrent first requests compute it once
+                if not payload.computed:
+                    self._compute(payload, raise_errors=True)
+        return payload.value, payload.refreshed_at
+
+    def refreshed_at(self, name):
+        """When the payload being served was computed, or None before its first computation; never computes."""
+        return self._payloads[name].refreshed_at
+
+    def is_stale(self, name):
+        """Whether a write has changed what the payload's current value was computed from."""
+        payload = self._payloads[name]
+        return payload.computed and self._version(payload) != payload.version
+
+    def notify(self, touched):
+        """Store listener: wake the thread when a commit touched what a payload is derived from."""
+        if any(p.depends_on is None or p.depends_on & touched for p in self._payloads.values()):
+            self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _version(self, payload):
+        return self.store.data_version(payload.depends_on)[0]
+
+    def _compute(self, payload, raise_errors=False):
+        try:
+            # Read first, so a write during the computation leaves it stale
+            version = self._version(payload)
+            value = payload.compute()
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.error(f"Error refreshing payload: {str(e)}")
+            return False
+        payload.value, payload.refreshed_at, payload.computed = value, datetime.now(), True
+        payload.version = version
+        self.refreshes += 1
+        return True
+
+    def _refresh(self, payload, now):
+        """Recompute the payload if it is due; returns False if that failed."""
+        try:
+            due = payload.due(now, self._version(payload))
+        except Exception as e:
+            logger.error(f"Error checking payload version: {str(e)}")
+            return False
+        if not due:
+            return True
+        with payload.lock:
+            return self._compute(payload)
+
+    def _timeout(self):
+        """Seconds until the next version poll or payload reaching its max_age, or None to wait for writes."""
+        now = datetime.now()
+        waits = [p.max_age - (now - p.refreshed_at).total_seconds()
+                 for p in self._payloads.values() if p.computed and p.max_age is not None]
+        if self.poll is not None:
+            waits.append(self.poll)
+        return max(0.0, min(waits)) if waits else None
+
+    def _debounce(self):
+        """Wait until writes have been quiet for delay seconds, or max_delay has passed."""
+        first = time.monotonic()
+        while time.monotonic() - first < self.max_delay and not self._stopped.is_set():
+            if not self._wake.wait(self.delay):
+                return
+            self._wake.clear()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if self._wake.wait(self._timeout()):
+                self._wake.clear()
+                self._debounce()
+            if self._stopped.is_set():
+                break
+            now, failed = datetime.now(), False
+            for payload in list(self._payloads.values()):
+                failed |= not self._refresh(payload, now)
+            if failed:
+                # Retry after a pause rather than in a tight loop
+                self._stopped.wait(self.delay)
@@ -0,0 +1,254 @@
+import logging
+from datetime import datetime
+
+from .storage import RECORD_ID, _DEFAULT_RATE, field_value
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['REMITTANCE_CURRENCIES', 'PAYMENT_STATUSES', 'MAX_BATCH_SIZE', 'record_rate', 'allocate_remittance',
+           'apply_remittance', 'set_payment_status', 'apply_payment_statuses']
+
+REMITTANCE_CURRENCIES = ('INR', 'USD')
+
+PAYMENT_STATUSES = ('Pending', 'Partial', 'Completed')
+
+# Most status updates accepted in one batch
+MAX_BATCH_SIZE = 500
+
+# A record counts as paid in full once less than this much INR is left open,
+# as for single partial payments
+PAID_TOLERANCE_INR = 1.0
+
+def _open_records(tx, ledger, party=None, record_ids=None):
+    """
+    Return the open records a remittance can settle, as dicts with their
+    amounts and what has been received so far. Without record_ids these are
+    the party's records oldest first; otherwise the given records, in the
+    given order.
+    """
+    party_sql = tx.field_sql(ledger, 'Party')
+    total_inr = f"IFNULL({tx.field_sql(ledger, 'Total Amount INR')}, 0)"
+    # As record_rate(): the record's rate, else what its totals imply
+    rate = (f"COALESCE(NULLIF({tx.field_sql(ledger, 'Rate')}, 0), "
+            f"{tx.field_sql(ledger, 'Total Amount INR')} / NULLIF({tx.field_sql(ledger, 'Total Amount USD')}, 0), "
+            f"{_DEFAULT_RATE})")
+    total_usd = f"IFNULL({tx.field_sql(ledger, 'Total Amount USD')}, {total_inr} / {rate})"
+    status = f"IFNULL({tx.field_sql(ledger, 'Payment Status')}, '')"
+    date = tx.field_sql(ledger, 'Date')
+    clauses, params = [], [ledger]
+    if record_ids is not None:
+        clauses.append(f'r.{RECORD_ID} IN ({", ".join("?" for _ in record_ids)})')
+        params += record_ids
+    else:
+        # Completed records are only reported back when asked for by ID
+        clauses.append(f"{status} != 'completed' COLLATE NOCASE")
+    if party is not None:
+        clauses.append(f'{party_sql} = ?')
+        params.append(party)
+        sources = tx.field_sources(ledger, 'Party')
+        if sources:
+            # Lets SQLite find the party's rows through the party indexes
+            clauses.append('(' + ' OR '.join(f'r.{s} = ?' for s in sources) + ')')
+            params += [party] * len(sources)
+    where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    rows = tx.conn.execute(
+        f'SELECT r.{RECORD_ID}, {party_sql}, {date}, {total_inr}, {total_usd}, {rate}, {status}, '
+        f'IFNULL(t.received_inr, 0), IFNULL(t.received_usd, 0) '
+        f'FROM {ledger} r LEFT JOIN payment_totals t ON t.ledger = ? AND t.{RECORD_ID} = r.{RECORD_ID}'
+        f'{where} ORDER BY {date} IS NULL, {date}, r.{RECORD_ID}', params).fetchall()
+    fields = [RECORD_ID, 'party', 'date', 'total_inr', 'total_usd', 'rate', 'status',
+              'received_inr', 'received_usd']
+    records = [dict(zip(fields, row)) for row in rows]
+    if record_ids is not None:
+        found = {record[RECORD_ID]: record for record in records}
+        missing = [r for r in record_ids if r not in found]
+        if missing:
+            raise ValueError(f"Records not found{' for ' + party if party else ''}: "
+                             f"{', '.join(str(r) for r in missing)}")
+        records = [found[r] for r in record_ids]
+    return records
+
+def record_rate(record, ledger):
+    """
+    The record's INR per USD rate: its own Rate, else what its INR and USD
+    totals imply, else None.
+    """
+    rate = field_value(record, ledger, 'Rate')
+    if rate:
+        return float(rate)
+    total_inr = field_value(record, ledger, 'Total Amount INR')
+    total_usd = field_value(record, ledger, 'Total Amount USD')
+    if total_inr and total_usd:
+        return float(total_inr) / float(total_usd)
+    return None
+
+def allocate_remittance(tx, ledger, amount, party=None, record_ids=None, currency='INR',
+                        date=None, reference=None):
+    """
+    Spread one remittance over open records inside a store transaction.
+
+    Each record receives at most what is still open on it, as an installment
+    converted at the record's own rate. Records paid in full become
+    Completed; the others Partial. Returns the allocations, the records
+    skipped because they were already completed, and what was left over.
+    """
+    amount = float(amount)
+    if amount <= 0:
+        raise ValueError('The remittance amount must be positive.')
+    if currency not in REMITTANCE_CURRENCIES:
+        raise ValueError(f'Unsupported currency: {currency}')
+    if party is None and record_ids is None:
+        raise ValueError('A remittance needs a party or a list of records.')
+    if record_ids is not None:
+        # Keep the caller's order, once per record
+        record_ids = list(dict.fromkeys(int(r) for r in record_ids))
+    date = date or datetime.now().strftime('%Y-%m-%d')
+
+    left = round(amount, 2)
+    allocations, skipped = [], []
+    for record in _open_records(tx, ledger, party, record_ids):
+        if str(record['status']).lower() == 'completed':
+            skipped.append(record[RECORD_ID])
+            continue
+        if left <= 0:
+            break
+        if currency == 'INR':
+            open_amount = record['total_inr'] - record['received_inr']
+        else:
+            open_amount = record['total_usd'] - record['received_usd']
+        applied = round(min(max(open_amount, 0.0), left), 2)
+        if applied <= 0:
+            continue
+        totals = tx.add_payment_line(ledger, record[RECORD_ID], applied, currency=currency,
+                                     exchange_rate=record['rate'], date=date, reference=reference)
+        remaining_inr = max(record['total_inr'] - totals['received_inr'], 0.0)
+        changes = {'Payment Status': 'Partial'}
+        if remaining_inr <= PAID_TOLERANCE_INR:
+            changes = {'Payment Status': 'Completed', 'Payment Done Date': date}
+        tx.update(ledger, record[RECORD_ID], changes)
+        left = round(left - applied, 2)
+        allocations.append({
+            RECORD_ID: record[RECORD_ID],
+            'party': record['party'],
+            'date': record['date'],
+            'applied': applied,
+            'remaining_inr': round(remaining_inr, 2),
+            'payment_status': changes['Payment Status']
+        })
+    return {
+        'amount': round(amount, 2),
+        'currency': currency,
+        'allocated': round(amount - left, 2),
+        'unallocated': left,
+        'allocations': allocations,
+        'skipped': skipped
+    }
+
+def apply_remittance(store, ledger, amount, **options):
+    """Allocate a remittance (see allocate_remittance()) as a single write."""
+    return store.submit(lambda tx: allocate_remittance(tx, ledger, amount, **options))
+
+def set_payment_status(tx, ledger, record_id, status, date=None, amount=None, currency='INR',
+                       reference=None, exchange_rate=None):
+    """
+    Change the payment status of one record inside a store transaction.
+
+    Partial adds an installment of amount at exchange_rate, by default the
+    record's own rate, and completes the record once at most
+    PAID_TOLERANCE_INR of its total is left open. Records without a total
+    stay Partial. Completed and other statuses drop the record's
+    installments; only Completed keeps a payment date. Returns the record's
+    new status and received totals.
+    """
+    record = tx.get(ledger, record_id)
+    if record is None:
+        raise ValueError(f'Record not found: {record_id}')
+    changes = {'Payment Status': status}
+    if status == 'Partial':
+        totals = tx.add_payment_line(ledger, record_id, amount, currency=currency,
+                                     exchange_rate=exchange_rate or record_rate(record, ledger),
+                                     date=date, reference=reference)
+        total_inr = float(field_value(record, ledger, 'Total Amount INR') or 0)
+        if total_inr > 0 and total_inr - totals['received_inr'] <= PAID_TOLERANCE_INR:
+            changes = {'Payment Status': 'Completed', 'Payment Done Date': date}
+    else:
+        # Completed and pending records keep no payment history
+        tx.clear_payment_lines(ledger, record_id)
+        if status != 'Completed':
+            changes['Payment Done Date'] = None
+        elif date:
+            changes['Payment Done Date'] = date
+        totals = tx.payment_totals(ledger, record_id)
+    tx.update(ledger, record_id, changes)
+    return {RECORD_ID: int(record_id), 'payment_status': changes['Payment Status'],
+            'received_inr': totals['received_inr'], 'received_usd': totals['received_usd']}
+
+def _parse_update(update, ledgers):
+    """Check one batch item and return it as set_payment_status() arguments."""
+    if not isinstance(update, dict):
+        raise ValueError('Each update must be an object.')
+    record_type = update.get('record_type', 'sale')
+    if record_type not in ledgers:
+        raise ValueError(f'Unknown record type: {record_type}')
+    try:
+        record_id = int(update.get('record_id'))
+    except (TypeError, ValueError):
+        raise ValueError('A numeric record_id is required.')
+    status = str(update.get('status') or update.get('payment_status') or '').capitalize()
+    if status not in PAYMENT_STATUSES:
+        raise ValueError(f"Unknown payment status: {update.get('status') or update.get('payment_status')}")
+    currency = str(update.get('currency') or 'INR').upper()
+    if currency not in REMITTANCE_CURRENCIES:
+        raise ValueError(f'Unsupported currency: {currency}')
+    date, amount = update.get('date') or None, update.get('amount')
+    if status == 'Partial':
+        if amount in (None, '') or not date:
+            raise ValueError('Payment amount and date are required for partial payments.')
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid payment amount: {amount}')
+        if amount <= 0:
+            raise ValueError('The payment amount must be positive.')
+    return {'ledger': ledgers[record_type], 'record_id': record_id, 'status': status, 'date': date,
+            'amount': amount, 'currency': currency, 'reference': update.get('reference') or None}
+
+def apply_payment_statuses(store, updates, ledgers, verify=None):
+    """
+    Apply a batch of payment status updates as a single write.
+
+    updates are dicts with record_type (a key of ledgers), record_id,
+    status, date, amount, currency and reference. Every update is checked
+    first, including verify(record, update) when given, which returns an
+    error message or None. If any update fails nothing is written.
+    Returns (ok, results) with one result per update, in order.
+    """
+    if len(updates) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} updates can be applied at once.')
+    results, parsed = [], []
+    for update in updates:
+        result = {RECORD_ID: update.get('record_id') if isinstance(update, dict) else None, 'ok': True}
+        try:
+            parsed.append(_parse_update(update, ledgers))
+        except ValueError as e:
+            parsed.append(None)
+            result.update(ok=False, error=str(e))
+        results.append(result)
+
+    def apply(tx):
+        # Check against the ledger as this write sees it, before changing anything
+        for update, result, args in zip(updates, results, parsed):
+            if args is None:
+                continue
+            record = tx.get(args['ledger'], args['record_id'])
+            error = f"Record not found: {args['record_id']}" if record is None else \
+                verify(record, update) if verify else None
+            if error:
+                result.update(ok=False, error=error)
+        if not all(result['ok'] for result in results):
+            return False
+        for result, args in zip(results, parsed):
+            result.update(set_payment_status(tx, **args))
+        return True
+
+    return store.submit(apply), results
@@ -0,0 +1,198 @@
+import logging
+
+from .records import _parse_date, _rows
+from .storage import current_store
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['REPORTS', 'REPORT_ROW_LIMIT', 'compile_filters', 'run_report', 'get_sales_report',
+           'get_purchases_report', 'get_inventory_report', 'get_payment_report', 'get_profit_loss_report']
+
+# Fields of the purchase and sale ledgers the trade reports read
+_TRADE_REPORT = {
+    'date': 'Date',
+    # Report filters and the ledger fields they match; dates are ranged with
+    # start_date and end_date, the others are exact (case-insensitive) matches
+    'filters': {'party': 'Party', 'platform': 'Platform', 'status': 'Payment Status', 'shape': 'Shape'},
+    # Breakdowns the report shows besides the months, by ledger field
+    'groups': {'party': 'Party', 'platform': 'Platform', 'shape': 'Shape', 'status': 'Payment Status'},
+    # Sums per group; older rows only carry the USD total as 'Total Amount (USD)' or 'Total Amount'
+    'measures': {
+        'records': ('count', None),
+        'carats': ('sum', 'Carat'),
+        'pcs': ('sum', 'Pcs'),
+        'amount_usd': ('sum', ['Total Amount USD', 'Total Amount (USD)', 'Total Amount']),
+        'amount_inr': ('sum', 'Total Amount INR')
+    },
+    # Record listing, under the keys the report uses for them
+    'columns': {
+        'date': 'Date', 'party': 'Party', 'description': 'Description', 'platform': 'Platform',
+        'shape': 'Shape', 'carat': 'Carat', 'amount_usd': 'Total Amount USD',
+        'amount_inr': 'Total Amount INR', 'payment_status': 'Payment Status'
+    }
+}
+
+# How each report reads its ledger
+REPORTS = {
+    'sales': dict(_TRADE_REPORT, ledger='sales'),
+    'purchases': dict(_TRADE_REPORT, ledger='purchases'),
+    'inventory': {
+        'ledger': 'inventory',
+        'date': 'purchase_date',
+        'filters': {'status': 'status', 'shape': 'shape', 'location': 'location'},
+        'groups': {'shape': 'shape', 'status': 'status', 'location': 'location'},
+        'measures': {
+            'records': ('count', None),
+            'carats': ('sum', 'carats'),
+            'purchase_price': ('sum', 'purchase_price'),
+            'market_value': ('sum', 'market_value')
+        },
+        'columns': {
+            'id': 'id', 'purchase_date': 'purchase_date', 'description': 'description',
+            'shape': 'shape', 'carats': 'carats', 'color': 'color', 'clarity': 'clarity',
+            'purchase_price': 'purchase_price', 'market_value': 'market_value',
+            'status': 'status', 'location': 'location'
+        }
+    },
+    'payments': {
+        'ledger': 'payments',
+        'date': 'payment_date',
+        'filters': {'party': 'name', 'status': 'status', 'type': 'type', 'method': 'payment_method'},
+        'groups': {'status': 'status', 'type': 'type', 'method': 'payment_method'},
+        'measures': {
+            'records': ('count', None),
+            'total_amount': ('sum', 'total_amount'),
+            'paid_amount': ('sum', 'paid_amount'),
+            'pending_amount': ('sum', 'pending_amount')
+        },
+        'columns': {
+            'id': 'id', 'payment_date': 'payment_date', 'name': 'name', 'type': 'type',
+            'total_amount': 'total_amount', 'paid_amount': 'paid_amount',
+            'pending_amount': 'pending_amount', 'status': 'status', 'payment_method': 'payment_method'
+        }
+    }
+}
+
+# Most records a report lists; the totals always cover every matching record
+REPORT_ROW_LIMIT = 500
+
+def compile_filters(report, filters):
+    """
+    Turn a report form into store filters on the report's ledger fields.
+    Empty, 'all' and unparseable values and filters the report does not
+    have are ignored, so the store reads only the matching records.
+    """
+    spec = REPORTS[report]
+    filters = filters or {}
+    where, applied = [], {}
+    for key, op in (('start_date', '>='), ('end_date', '<=')):
+        value = _parse_date(filters.get(key))
+        if value is not None:
+            where.append((spec['date'], op, value))
+            applied[key] = value.strftime('%Y-%m-%d')
+    for key, field in spec['filters'].items():
+        value = str(filters.get(key) or '').strip()
+        if value and value.lower() != 'all':
+            where.append((field, '=', value))
+            applied[key] = value
+    return where, applied
+
+def _rollup(cells, keys, measures):
+    """
+    Combine the measures of the cells per value of keys, in order of the
+    keys. Like the store's grouping, text values differing only in case
+    are one group, shown as the first of them.
+    """
+    groups = {}
+    for cell in cells:
+        key = tuple(cell[k].lower() if isinstance(cell[k], str) else cell[k] for k in keys)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict({k: cell[k] for k in keys}, **{
+                m: 0 if function in ('count', 'sum') else None for m, (function, _) in measures.items()})
+        for measure, (function, _) in measures.items():
+            value, current = cell[measure], group[measure]
+            if value is None:
+                continue
+            if function in ('count', 'sum'):
+                group[measure] += value
+            elif current is None or (value < current if function == 'min' else value > current):
+                group[measure] = value
+    return sorted(groups.values(), key=lambda g: tuple('' if g[k] is None else str(g[k]).lower() for k in keys))
+
+def _cells(store, spec, where, groups):
+    """The report's measures per month and groups in one grouped read of the matching records."""
+    return store.aggregate(spec['ledger'], spec['measures'], group_by=list(groups.values()),
+                           where=where, month_of=spec['date'])
+
+def run_report(store, report, filters=None, row_limit=REPORT_ROW_LIMIT):
+    """
+    Build a report: totals, a monthly trend and a breakdown by each of the
+    report's groups, plus up to row_limit of the matching records, newest
+    first. The breakdowns are rolled up from a single grouped read, so the
+    work grows with what matches the filters rather than the whole ledger.
+    """
+    spec = REPORTS[report]
+    where, applied = compile_filters(report, filters)
+    measures = spec['measures']
+    cells = _cells(store, spec, where, spec['groups'])
+    for cell in cells:
+        for key, field in spec['groups'].items():
+            cell[key] = cell.pop(field)
+    summary = _rollup(cells, [], measures)
+    data = {
+        'filters': applied,
+        'summary': summary[0] if summary else {m: 0 for m in measures},
+        'by_month': [row for row in _rollup(cells, ['month'], measures) if row['month']]
+    }
+    for key in spec['groups']:
+        data[f'by_{key}'] = _rollup(cells, [key], measures)
+    rows = store.select(spec['ledger'], spec['columns'].values(), where, order_by=spec['date'],
+                        descending=True, limit=row_limit)
+    data['records'] = _rows(rows, spec['columns'])
+    data['truncated'] = data['summary']['records'] > len(data['records'])
+    return data
+
+def get_sales_report(filters=None, store=None):
+    """Sales report for the filters of the reports form."""
+    return run_report(store or current_store(), 'sales', filters)
+
+def get_purchases_report(filters=None, store=None):
+    """Purchases report for the filters of the reports form."""
+    return run_report(store or current_store(), 'purchases', filters)
+
+def get_inventory_report(filters=None, store=None):
+    """Inventory report for the filters of the reports form."""
+    return run_report(store or current_store(), 'inventory', filters)
+
+def get_payment_report(filters=None, store=None):
+    """Payment report for the filters of the reports form."""
+    return run_report(store or current_store(), 'payments', filters)
+
+def get_profit_loss_report(filters=None, store=None):
+    """
+    Sales against purchases per month for the filters of the reports form,
+    with the profit in USD and INR. Both sides are filtered the same way
+    and only their monthly totals are read.
+    """
+    store = store or current_store()
+    spec = REPORTS['sales']
+    where, applied = compile_filters('sales', filters)
+    measures = spec['measures']
+    months = {}
+    for ledger in ('sales', 'purchases'):
+        for row in _rollup(_cells(store, REPORTS[ledger], where, {}), ['month'], measures):
+            if not row['month']:
+                # Undated records have no month to show them in
+                continue
+            month = months.setdefault(row['month'], {'month': row['month'], **{
+                f'{side}_{m}': 0 for side in ('sales', 'purchases') for m in measures}})
+            for measure in measures:
+                month[f'{ledger}_{measure}'] = row[measure]
+    rows = [months[m] for m in sorted(months)]
+    totals = {f'{side}_{m}': sum(row[f'{side}_{m}'] for row in rows)
+              for side in ('sales', 'purchases') for m in measures}
+    for row in rows + [totals]:
+        row['profit_usd'] = row['sales_amount_usd'] - row['purchases_amount_usd']
+        row['profit_inr'] = row['sales_amount_inr'] - row['purchases_amount_inr']
+    return {'filters': applied, 'months': rows, 'totals': totals}
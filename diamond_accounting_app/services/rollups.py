@@ -0,0 +1,145 @@
+import re
+import logging
+from collections import defaultdict
+
+from .storage import LedgerView, field_value, register_view
+from .totals import SUMMED_FIELDS, summed_sql, summed_value
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['ROLLUP_DIMENSIONS', 'ROLLUP_MEASURES', 'MonthlyRollup', 'rollup', 'monthly_pnl']
+
+# What the cube is keyed by: the month of the record's Date plus these fields
+ROLLUP_DIMENSIONS = {'party': 'Party', 'platform': 'Platform', 'shape': 'Shape'}
+
+# What the cube sums, besides the record count
+ROLLUP_MEASURES = ['carats', 'amount_usd', 'amount_inr']
+
+_KEY = ['month', 'ledger'] + list(ROLLUP_DIMENSIONS)
+_MONTH = re.compile(r'\d{4}-\d{2}')
+
+def _month(value):
+    """'YYYY-MM' of a stored date, like the SQL in _select() reads it; '' when undated."""
+    text = '' if value is None else str(value)
+    return text[:7] if _MONTH.match(text) else ''
+
+def _select(tx, ledger):
+    """SQL computing the cube cells of a ledger from scratch."""
+    date = tx.field_sql(ledger, 'Date')
+    month = f"CASE WHEN {date} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr({date}, 1, 7) ELSE '' END"
+    dimensions = [f"IFNULL(CAST({tx.field_sql(ledger, name)} AS TEXT), '')"
+                  for name in ROLLUP_DIMENSIONS.values()]
+    sums = [f'TOTAL({summed_sql(tx, ledger, SUMMED_FIELDS[m])})' for m in ROLLUP_MEASURES]
+    groups = ', '.join(str(i) for i in range(1, len(dimensions) + 2))
+    return (f'SELECT {month}, {", ".join(dimensions)}, COUNT(*), {", ".join(sums)} '
+            f'FROM {ledger} GROUP BY {groups}')
+
+@register_view
+class MonthlyRollup(LedgerView):
+    """
+    Record counts, carats and amounts of the purchase and sale ledgers per
+    month, party, platform and shape.
+
+    Like the ledger totals, each write applies its delta to the cells it
+    touches, so trend charts and period reports read a few hundred cells
+    instead of grouping every record.
+    """
+    name = 'monthly_rollup'
+    version = 1
+    ledgers = ('purchases', 'sales')
+
+    def create(self, conn):
+        conn.execute('DROP TABLE IF EXISTS monthly_rollup')
+        conn.execute(
+            'CREATE TABLE monthly_rollup ('
+            'month TEXT NOT NULL, ledger TEXT NOT NULL, party TEXT NOT NULL, platform TEXT NOT NULL, '
+            'shape TEXT NOT NULL, records INTEGER NOT NULL, carats REAL NOT NULL, '
+            'amount_usd REAL NOT NULL, amount_inr REAL NOT NULL, '
+            'PRIMARY KEY (month, ledger, party, platform, shape))')
+
+    def rebuild(self, tx, ledger):
+        tx.conn.execute('DELETE FROM monthly_rollup WHERE ledger = ?', (ledger,))
+        columns = ['month'] + list(ROLLUP_DIMENSIONS) + ['records'] + ROLLUP_MEASURES
+        tx.conn.execute(
+            f'INSERT INTO monthly_rollup (ledger, {", ".join(columns)}) '
+            f'SELECT ?, * FROM ({_select(tx, ledger)})', (ledger,))
+
+    def apply(self, tx, ledger, changes):
+        deltas = defaultdict(lambda: [0] * (1 + len(ROLLUP_MEASURES)))
+        for before, after in changes:
+            # Installments change a record's payment totals, not these
+            if before == after:
+                continue
+            for record, sign in ((before, -1), (after, 1)):
+                if record is None:
+                    continue
+                key = (_month(field_value(record, ledger, 'Date')), ledger) + tuple(
+                    str(field_value(record, ledger, name, '')) for name in ROLLUP_DIMENSIONS.values())
+                delta = deltas[key]
+                delta[0] += sign
+                for i, measure in enumerate(ROLLUP_MEASURES, start=1):
+                    delta[i] += sign * summed_value(record, ledger, SUMMED_FIELDS[measure])
+        for key, delta in deltas.items():
+            tx.conn.execute(
+                f'INSERT INTO monthly_rollup ({", ".join(_KEY)}, records, {", ".join(ROLLUP_MEASURES)}) '
+                f'VALUES ({", ".join("?" for _ in range(len(_KEY) + len(delta)))}) '
+                f'ON CONFLICT ({", ".join(_KEY)}) DO UPDATE SET records = records + excluded.records, '
+                + ', '.join(f'{m} = {m} + excluded.{m}' for m in ROLLUP_MEASURES),
+                list(key) + delta)
+        tx.conn.execute('DELETE FROM monthly_rollup WHERE ledger = ? AND records <= 0', (ledger,))
+
+def rollup(store, group_by=('month', 'ledger'), ledgers=None, start=None, end=None, **filters):
+    """
+    Sum the cube over everything but group_by (names from 'month', 'ledger'
+    and ROLLUP_DIMENSIONS). start and end are inclusive 'YYYY-MM' months;
+    filters are exact matches on the dimensions, e.g. party='Acme'.
+    Returns row dicts ordered by group_by.
+    """
+    group_by = list(group_by)
+    unknown = [name for name in group_by + list(filters) if name not in _KEY]
+    if unknown:
+        raise ValueError(f"Unknown rollup dimensions: {', '.join(unknown)}")
+    clauses, params = [], []
+    if ledgers is not None:
+        ledgers = list(ledgers)
+        clauses.append(f'ledger IN ({", ".join("?" for _ in ledgers)})')
+        params += ledgers
+    if start:
+        clauses.append('month >= ?')
+        params.append(str(start)[:7])
+    if end:
+        clauses.append('month <= ?')
+        params.append(str(end)[:7])
+    for name, value in filters.items():
+        if value is not None:
+            clauses.append(f'{name} = ?')
+            params.append(str(value))
+    where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    sums = ', '.join(f'TOTAL({m}) AS {m}' for m in ROLLUP_MEASURES)
+    select = ', '.join(group_by + ['TOTAL(records) AS records', sums])
+    sql = f'SELECT {select} FROM monthly_rollup{where}'
+    if group_by:
+        sql += f' GROUP BY {", ".join(group_by)} ORDER BY {", ".join(group_by)}'
+    rows = store.query(sql, params)
+    for row in rows:
+        row['records'] = int(row['records'])
+    return rows
+
+def monthly_pnl(store, start=None, end=None, **filters):
+    """
+    Sales against purchases per month, oldest first: counts, carats, USD and
+    INR amounts of both sides and the profit in USD and INR.
+    """
+    months = {}
+    for row in rollup(store, ('month', 'ledger'), start=start, end=end, **filters):
+        if not row['month']:
+            # Undated records have no month to show them in
+            continue
+        month = months.setdefault(row['month'], {'month': row['month'], **{
+            f'{ledger}_{m}': 0 for ledger in MonthlyRollup.ledgers for m in ['records'] + ROLLUP_MEASURES}})
+        for measure in ['records'] + ROLLUP_MEASURES:
+            month[f"{row['ledger']}_{measure}"] = row[measure]
+    for month in months.values():
+        month['profit_usd'] = month['sales_amount_usd'] - month['purchases_amount_usd']
+        month['profit_inr'] = month['sales_amount_inr'] - month['purchases_amount_inr']
+    return list(months.values())
@@ -0,0 +1,1375 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+from .cache import LedgerCache, file_token
+from .atomic import atomic_path, write_excel
+from .journal import JournalCompactor
+from .writer import CommitQueue
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['LEDGERS', 'SEQUENCES', 'RECORD_ID', 'SORT_KEY', 'PAYMENT_LINES', 'field_value', 'LedgerView',
+           'register_view', 'LedgerStore', 'SQLiteStore', 'get_store', 'current_store']
+
+# Surrogate key every ledger row carries inside the store
+RECORD_ID = 'record_id'
+
+# Column select() adds with the raw value each row was ordered by
+SORT_KEY = '_sort_key'
+
+# Comparison operators accepted in select(), count() and total() filters
+_OPERATORS = {'=', '!=', '<', '<=', '>', '>=', 'in', 'like'}
+
+# Operators whose filters can also be answered from a field's indexes
+_RANGE_OPERATORS = {'<', '<=', '>', '>='}
+
+# Functions aggregate() can compute per group
+_AGGREGATES = {'count': 'COUNT', 'sum': 'TOTAL', 'min': 'MIN', 'max': 'MAX'}
+
+# Version of the stored data layout, see SQLiteStore._migrate
+SCHEMA_VERSION = 4
+
+# Pinned dtypes and field aliases shared by the purchase and sale ledgers.
+# /buy and /sell store snake_case fields while older rows and the reports use
+# the Title Case names, so a projected read of a field falls back to its aliases.
+_TRADE_DTYPES = {
+    'Date': 'datetime64[ns]', 'Carat': 'float64', 'Pcs': 'float64',
+    'Price Per Carat': 'float64', 'Price Per Carat INR': 'float64', 'Rate': 'float64',
+    'Total Amount USD': 'float64', 'Total Amount INR': 'float64',
+    'Total Amount (USD)': 'float64', 'Total Amount': 'float64',
+    'Payment Status': 'category', 'Platform': 'category',
+    'Payment Due Date': 'datetime64[ns]', 'Payment Days': 'float64'
+}
+_TRADE_ALIASES = {
+    'Date': ['date'], 'Party': ['party'], 'Description': ['description'],
+    'Stone ID': ['stone_id'], 'Rough ID': ['rough_id'], 'Kapan No': ['kapan_no'],
+    'Platform': ['platform'], 'Shape': ['shape'], 'Carat': ['carat'], 'Pcs': ['Quantity', 'quantity'],
+    'Price Per Carat': ['price_per_carat'], 'Price Per Carat INR': ['price_per_carat_inr'],
+    'Rate': ['rate'], 'Total Amount USD': ['total_amount_usd'], 'Total Amount INR': ['total_amount_inr'],
+    'Payment Status': ['payment_status'], 'Reference Party': ['payment_reference'],
+    'Payment Due Date': ['payment_due_date'], 'Payment Done Date': ['payment_date']
+}
+
+# Ledgers managed by the store. 'file' is the workbook the ledger used to live
+# in; it seeds an empty store once and is otherwise only written by exports.
+# 'date_columns', 'party_columns' and 'key_column' (the business ID looked up
+# by find()) are indexed.
+# 'dtypes' and 'aliases' apply to projected reads (see SQLiteStore.read).
+LEDGERS = {
+    'purchases': {
+        'file': 'purchases.xlsx',
+        'date_columns': ['Date', 'date'],
+        'party_columns': ['Party', 'party'],
+        'columns': [
+            'Date', 'Party', 'Description', 'Stone ID', 'Rough ID', 'Kapan No', 'Platform',
+            'Carat', 'Than', 'Pcs', 'Price Per Carat', 'Price Per Carat INR', 'Rate',
+            'Total Amount USD', 'Total Amount INR', 'Payment Status', 'Reference Party',
+            'Payment Due Date', 'Payment Days', 'Payment Done Date', 'Notes'
+        ],
+        'dtypes': _TRADE_DTYPES,
+        'aliases': _TRADE_ALIASES
+    },
+    'sales': {
+        'file': 'sales.xlsx',
+        'date_columns': ['Date', 'date'],
+        'party_columns': ['Party', 'party'],
+        'columns': [
+            'Date', 'Party', 'Description', 'Stone ID', 'Rough ID', 'Kapan No', 'Platform',
+            'Carat', 'Than', 'Pcs', 'Price Per Carat', 'Price Per Carat INR', 'Rate',
+            'Total Amount USD', 'Total Amount INR', 'Payment Status', 'Reference Party',
+            'Payment Due Date', 'Payment Days', 'Payment Done Date', 'Notes'
+        ],
+        'dtypes': _TRADE_DTYPES,
+        'aliases': _TRADE_ALIASES
+    },
+    'payments': {
+        'file': 'payments.xlsx',
+        'date_columns': ['payment_date'],
+        'key_column': 'id',
+        'columns': [
+            'id', 'type', 'name', 'total_amount', 'paid_amount', 'pending_amount', 'status',
+            'payment_date', 'payment_method', 'notes', 'reference_id', 'reference_type'
+        ],
+        'dtypes': {
+            'total_amount': 'float64', 'paid_amount': 'float64', 'pending_amount': 'float64',
+            'payment_date': 'datetime64[ns]', 'type': 'category', 'status': 'category',
+            'payment_method': 'category', 'reference_type': 'category'
+        }
+    },
+    'inventory': {
+        'file': 'inventory.xlsx',
+        'date_columns': ['purchase_date'],
+        'key_column': 'id',
+        'columns': [
+            'id', 'description', 'shape', 'carats', 'color', 'clarity', 'cut',
+            'purchase_price', 'market_value', 'status', 'location', 'purchase_date', 'notes'
+        ],
+        'dtypes': {
+            'carats': 'float64', 'purchase_price': 'float64', 'market_value': 'float64',
+            'purchase_date': 'datetime64[ns]', 'shape': 'category', 'status': 'category'
+        }
+    },
+    'rough_inventory': {
+        'file': 'rough_inventory.xlsx',
+        'date_columns': ['purchase_date'],
+        'key_column': 'id',
+        'columns': [
+            'id', 'rough_id', 'kapan_no', 'lot_id', 'description', 'source', 'origin', 'weight',
+            'pieces', 'purchase_price', 'purchase_date', 'status', 'location', 'notes', 'image_path'
+        ],
+        'dtypes': {
+            'weight': 'float64', 'pieces': 'float64', 'purchase_price': 'float64',
+            'purchase_date': 'datetime64[ns]', 'status': 'category'
+        },
+        'aliases': {'rough_id': ['Rough ID'], 'kapan_no': ['Kapan No']}
+    }
+}
+
+# Business ID sequences handed out by Transaction.next_ids(). A sequence
+# starts after the largest numeric ID already present in its ledger field.
+SEQUENCES = {
+    'payment': {'ledger': 'payments', 'field': 'id', 'prefix': ''},
+    'inventory': {'ledger': 'inventory', 'field': 'id', 'prefix': 'D'}
+}
+
+# Installments received against purchase and sale records, one row per
+# payment, with the running totals per record kept in payment_totals.
+# Records used to carry them as a JSON list in their 'partial_payments' cell.
+PAYMENT_LINES = 'payment_lines'
+_LINE_FIELDS = ['date', 'amount', 'currency', 'exchange_rate', 'reference', 'amount_inr', 'amount_usd']
+
+# INR per USD assumed for records without a Rate, as on the record details view
+_DEFAULT_RATE = 83.50
+
+# reference_type of payments referencing records of a ledger
+_REFERENCE_TYPES = {'purchases': 'purchase', 'sales': 'sale'}
+
+def _quote(name):
+    """Quote an SQL identifier (ledger columns contain spaces)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _to_sql_value(value):
+    """Convert a pandas/numpy cell value into something sqlite3 can bind."""
+    if value is None:
+        return None
+    if isinstance(value, (list, dict, tuple)):
+        return str(value)
+    if pd.isna(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        if value.hour == 0 and value.minute == 0 and value.second == 0 and value.microsecond == 0:
+            return value.strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _indexed_fields(ledger):
+    spec = LEDGERS.get(ledger, {})
+    return (spec.get('date_columns', []) + spec.get('party_columns', []) +
+            ([spec['key_column']] if 'key_column' in spec else []))
+
+def _key_values(key):
+    """IDs read back from Excel may be stored as numbers; match either form."""
+    values = [str(key)]
+    try:
+        values.append(int(str(key)))
+    except ValueError:
+        pass
+    return values
+
+def _given_record_ids(df):
+    """The RECORD_IDs in a frame's RECORD_ID column, or None unless it has one of distinct positive integers."""
+    if RECORD_ID not in df.columns:
+        return None
+    ids = pd.to_numeric(df[RECORD_ID], errors='coerce')
+    if ids.isna().any() or (ids % 1 != 0).any() or (ids <= 0).any() or ids.duplicated().any():
+        return None
+    return [int(i) for i in ids]
+
+def _coalesce(sources):
+    """SQL expression reading the first non-null of several physical columns."""
+    if not sources:
+        return 'NULL'
+    if len(sources) == 1:
+        return _quote(sources[0])
+    return 'COALESCE(' + ', '.join(_quote(p) for p in sources) + ')'
+
+def field_value(record, ledger, name, default=None):
+    """Read a field of a stored record, falling back to its aliases like projected reads do."""
+    for source in [name] + LEDGERS.get(ledger, {}).get('aliases', {}).get(name, []):
+        if record.get(source) is not None:
+            return record[source]
+    return default
+
+def _parse_datetimes(values):
+    """
+    Parse a column of stored dates. Dates are written as 'YYYY-MM-DD' or
+    'YYYY-MM-DD HH:MM:SS' and a column can hold both, so they are parsed as
+    ISO 8601 rather than in the format of the first value; whatever else
+    was imported (e.g. from Excel) is parsed value by value, day first as
+    the ledgers write dates ('06/01/2024' is 6 January).
+    """
+    parsed = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    missed = parsed.isna() & values.notna()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(values[missed], errors='coerce', format='mixed', dayfirst=True)
+    return parsed
+
+def _apply_dtypes(df, dtypes):
+    """Convert columns to their pinned dtypes; values that do not parse become missing."""
+    for name, dtype in dtypes.items():
+        if name not in df.columns:
+            continue
+        if dtype.startswith('datetime64'):
+            df[name] = _parse_datetimes(df[name]).astype(dtype)
+        elif dtype == 'category':
+            df[name] = df[name].astype('category')
+        else:
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype(dtype)
+    return df
+
+class LedgerView:
+    """
+    A table derived from ledgers that the store keeps current.
+
+    Every mutation of a ledger in `ledgers` is remembered as a (before, after)
+    pair of records (None when the record did not exist). Before the mutation
+    commits, apply() is called with the pairs so the view can update the rows
+    they affect, in the same transaction. When a whole ledger is replaced,
+    rebuild() is called for it instead. Bumping `version` makes the store
+    recreate and rebuild the view the next time it starts.
+    """
+    name = None
+    version = 1
+    ledgers = ()
+
+    def create(self, conn):
+        """(Re)create the view's tables, dropping any older layout."""
+        raise NotImplementedError
+
+    def rebuild(self, tx, ledger):
+        """Recompute every row derived from ledger."""
+        raise NotImplementedError
+
+    def apply(self, tx, ledger, changes):
+        """Update the rows affected by a list of (before, after) records of ledger."""
+        raise NotImplementedError
+
+# Views every store maintains, in registration order
+VIEWS = []
+
+def register_view(view):
+    """Class decorator adding a LedgerView to the views stores maintain."""
+    VIEWS.append(view)
+    return view
+
+class LedgerStore:
+    """
+    Interface implemented by every storage engine.
+    Records are plain dicts keyed by column name; each row is addressed
+    by the integer RECORD_ID assigned when it is inserted.
+    """
+    def read(self, ledger, columns=None, dtypes=None):
+        """
+        Return the ledger as a DataFrame indexed by RECORD_ID.
+        With columns, only those fields are loaded (from their aliases where
+        needed) and the ledger's pinned dtypes are applied, updated by dtypes.
+        """
+        raise NotImplementedError
+
+    def select(self, ledger, columns, where=(), order_by=None, descending=False,
+               limit=None, offset=0, after=None, dtypes=None):
+        """
+        Return one page of a ledger, read like read(ledger, columns), plus a
+        SORT_KEY column. where is a list of (field, operator, value) filters,
+        all of which must match. Rows are ordered by order_by (RECORD_ID by
+        default) with RECORD_ID breaking ties; after=(sort key, RECORD_ID)
+        continues from a row of a previous page instead of using offset.
+        """
+        raise NotImplementedError
+
+    def count(self, ledger, where=()):
+        """Return the number of records matching the filters."""
+        raise NotImplementedError
+
+    def total(self, ledger, field, where=()):
+        """Return the sum of a numeric field over the records matching the filters."""
+        raise NotImplementedError
+
+    def aggregate(self, ledger, measures, group_by=(), where=(), month_of=None):
+        """
+        Return one dict per group of the records matching the filters.
+        measures maps result names to (function, fields): function is one of
+        'count', 'sum', 'min' and 'max', fields a field name or a list of
+        them, the first one with a value counting. Groups are formed by the
+        group_by fields and, with month_of, by the 'YYYY-MM' month of that
+        date field, returned as 'month'.
+        """
+        raise NotImplementedError
+
+    def get(self, ledger, record_id):
+        """Return a single record as a dict, or None if it does not exist."""
+        raise NotImplementedError
+
+    def find(self, ledger, key):
+        """Return the record whose key_column equals key, or None."""
+        raise NotImplementedError
+
+    def payment_lines(self, ledger, record_id):
+        """Return the installments received against a record, oldest first."""
+        raise NotImplementedError
+
+    def received(self, ledger, record_ids=None):
+        """
+        Return a DataFrame indexed by RECORD_ID with the number of installments
+        and the amounts received (received_inr, received_usd) per record.
+        Records without installments are left out.
+        """
+        raise NotImplementedError
+
+    def insert(self, ledger, record):
+        """Insert a record and return its RECORD_ID."""
+        raise NotImplementedError
+
+    def update(self, ledger, record_id, changes):
+        """Update some columns of a record. Returns False if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, ledger, record_id):
+        """Delete a record. Returns False if it does not exist."""
+        raise NotImplementedError
+
+    def submit(self, fn):
+        """Run fn(tx) as a single atomic mutation and return its result."""
+        raise NotImplementedError
+
+    def data_version(self, names):
+        """
+        Return (token, last_modified) for ledgers and views (all of them when
+        names is None); the token changes with every commit to them.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, listener):
+        """Call listener(names) after each committed mutation with the ledgers and views it changed."""
+        raise NotImplementedError
+
+    def export_excel(self, ledger, file_path, record_ids=False):
+        """
+        Write the ledger to an .xlsx workbook, with a RECORD_ID column when
+        record_ids is set so that importing it keeps the records' IDs.
+        """
+        raise NotImplementedError
+
+class Transaction:
+    """Reads and writes bound to one open SQLite transaction."""
+    def __init__(self, store, conn):
+        self.store = store
+        self.conn = conn
+        # Ledgers written in this transaction, invalidated in the cache on commit
+        self.touched = set()
+        # (before, after) records per watched ledger not yet applied to the
+        # views; None when the whole ledger has to be rebuilt
+        self.changes = {}
+        # Column maps of the ledgers this transaction read or changed, None
+        # where they have to be read again; published to the store on commit
+        self.columns = {}
+
+    def field_sources(self, ledger, name):
+        """Return the quoted physical columns holding a field, the field's own first."""
+        stored = self.store._column_map(self.conn, ledger)
+        return [_quote(p) for p in self.store._sources(stored, ledger, name)]
+
+    def field_sql(self, ledger, name):
+        """Return an SQL expression reading a field, coalesced with its aliases."""
+        return _coalesce(self.store._sources(self.store._column_map(self.conn, ledger), ledger, name))
+
+    def _watching(self, ledger):
+        return ledger in self.store.watched and self.changes.get(ledger, []) is not None
+
+    def _changed(self, ledger, before, after):
+        self.changes.setdefault(ledger, []).append((before, after))
+
+    def flush(self):
+        """Apply the changes made so far to the store's views."""
+        changes, self.changes = self.changes, {}
+        for view in self.store.views:
+            for ledger in view.ledgers:
+                if ledger not in changes:
+                    continue
+                self.touched.add(view.name)
+                if changes[ledger] is None:
+                    view.rebuild(self, ledger)
+                else:
+                    view.apply(self, ledger, changes[ledger])
+
+    def get(self, ledger, record_id):
+        columns = self.store._column_map(self.conn, ledger)
+        select = ', '.join([RECORD_ID] + [_quote(p) for p in columns.values()])
+        row = self.conn.execute(
+            f'SELECT {select} FROM {_quote(ledger)} WHERE {RECORD_ID} = ?', (int(record_id),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip([RECORD_ID] + list(columns), row))
+
+    def count(self, ledger):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {_quote(ledger)}').fetchone()[0]
+
+    def find_ids(self, ledger, key):
+        """Return the RECORD_IDs whose key_column equals key, using the key index."""
+        field = LEDGERS[ledger]['key_column']
+        columns = self.store._column_map(self.conn, ledger)
+        if field not in columns:
+            return []
+        values = _key_values(key)
+        placeholders = ', '.join('?' for _ in values)
+        rows = self.conn.execute(
+            f'SELECT {RECORD_ID} FROM {_quote(ledger)} WHERE {_quote(columns[field])} IN ({placeholders}) '
+            f'ORDER BY {RECORD_ID}', values).fetchall()
+        return [row[0] for row in rows]
+
+    def find(self, ledger, key):
+        record_ids = self.find_ids(ledger, key)
+        return self.get(ledger, record_ids[0]) if record_ids else None
+
+    def insert(self, ledger, record, record_id=None):
+        """Insert a record and return its RECORD_ID, the next free one unless record_id is given."""
+        record = {k: _to_sql_value(v) for k, v in record.items() if k != RECORD_ID}
+        self.touched.add(ledger)
+        columns = self.store._ensure_columns(self.conn, ledger, record.keys())
+        if record or record_id is not None:
+            names = [_quote(columns[k]) for k in record]
+            values = list(record.values())
+            if record_id is not None:
+                names.append(RECORD_ID)
+                values.append(int(record_id))
+            placeholders = ', '.join('?' for _ in values)
+            cursor = self.conn.execute(
+                f'INSERT INTO {_quote(ledger)} ({", ".join(names)}) VALUES ({placeholders})', values)
+        else:
+            cursor = self.conn.execute(f'INSERT INTO {_quote(ledger)} DEFAULT VALUES')
+        if self._watching(ledger):
+            self._changed(ledger, None, self.get(ledger, cursor.lastrowid))
+        return cursor.lastrowid
+
+    def update(self, ledger, record_id, changes):
+        changes = {k: _to_sql_value(v) for k, v in changes.items() if k != RECORD_ID}
+        if not changes:
+            return self.get(ledger, record_id) is not None
+        self.touched.add(ledger)
+        before = self.get(ledger, record_id) if self._watching(ledger) else None
+        columns = self.store._ensure_columns(self.conn, ledger, changes.keys())
+        assignments = ', '.join(f'{_quote(columns[k])} = ?' for k in changes)
+        cursor = self.conn.execute(
+            f'UPDATE {_quote(ledger)} SET {assignments} WHERE {RECORD_ID} = ?',
+            list(changes.values()) + [int(record_id)])
+        if before is not None:
+            self._changed(ledger, before, self.get(ledger, record_id))
+        return cursor.rowcount > 0
+
+    def delete(self, ledger, record_id):
+        self.touched.add(ledger)
+        if self._watching(ledger):
+            before = self.get(ledger, record_id)
+            if before is not None:
+                self._changed(ledger, before, None)
+        cursor = self.conn.execute(
+            f'DELETE FROM {_quote(ledger)} WHERE {RECORD_ID} = ?', (int(record_id),))
+        self.clear_payment_lines(ledger, record_id)
+        return cursor.rowcount > 0
+
+    def replace(self, ledger, df):
+        """
+        Replace the entire contents of a ledger with a DataFrame. Rows keep
+        the RECORD_IDs of a RECORD_ID column (see export_excel()), so their
+        installments and the payments referencing them stay attached.
+        Without one, RECORD_IDs start over: installments of the old records
+        go, and payments referencing the record in a position are pointed at
+        the record now in that position.
+        """
+        self.touched.add(ledger)
+        # Views are rebuilt from the new contents rather than row by row
+        if ledger in self.store.watched:
+            self.changes[ledger] = None
+        record_ids = _given_record_ids(df)
+        old_ids = None if record_ids is not None else self._record_ids(ledger)
+        self.store._drop_ledger(self.conn, ledger)
+        self.store._create_ledger(self.conn, ledger, [str(c) for c in df.columns if c != RECORD_ID])
+        records = df.to_dict('records')
+        if record_ids is not None:
+            for record_id, record in zip(record_ids, records):
+                self.insert(ledger, record, record_id)
+            # Only the installments of records that are gone go
+            self.touched.add(PAYMENT_LINES)
+            for table in (PAYMENT_LINES, 'payment_totals'):
+                self.conn.execute(
+                    f'DELETE FROM {table} WHERE ledger = ? AND {RECORD_ID} NOT IN '
+                    f'(SELECT {RECORD_ID} FROM {_quote(ledger)})', (ledger,))
+        else:
+            self.clear_payment_lines(ledger)
+            new_ids = [self.insert(ledger, record) for record in records]
+            self._remap_references(ledger, dict(zip(old_ids, new_ids)))
+        self.adopt_partial_payments(ledger)
+        # The new records may already use IDs the sequences have not reached
+        for sequence, spec in SEQUENCES.items():
+            if spec['ledger'] == ledger:
+                self._reserve_through(sequence, self._highest_id(spec))
+
+    def _record_ids(self, ledger):
+        """The ledger's RECORD_IDs in order; empty if it does not exist yet."""
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (ledger,)).fetchone():
+            return []
+        return [row[0] for row in self.conn.execute(
+            f'SELECT {RECORD_ID} FROM {_quote(ledger)} ORDER BY {RECORD_ID}')]
+
+    def _remap_references(self, ledger, new_ids):
+        """Point payments referencing records of the ledger at new_ids[old RECORD_ID]."""
+        ref = _REFERENCE_TYPES.get(ledger)
+        payments = self.store._column_map(self.conn, 'payments')
+        if ref is None or not new_ids or 'reference_id' not in payments or 'reference_type' not in payments:
+            return
+        ref_id, ref_type = _quote(payments['reference_id']), _quote(payments['reference_type'])
+        rows = self.conn.execute(
+            f'SELECT {RECORD_ID}, {ref_id} FROM payments WHERE {ref_type} = ?', (ref,)).fetchall()
+        changed = False
+        for payment_id, reference in rows:
+            try:
+                target = new_ids[int(float(reference))]
+            except (TypeError, ValueError, KeyError):
+                # References to records the ledger did not have point at nothing; leave them alone
+                continue
+            if target != int(float(reference)):
+                self.update('payments', payment_id, {'reference_id': str(target)})
+                changed = True
+        if changed:
+            self.touched.add('payments')
+
+    def add_payment_line(self, ledger, record_id, amount, currency='USD', exchange_rate=None,
+                         date=None, reference=None):
+        """
+        Record an installment received against a record and return the
+        record's updated totals (see payment_totals()). The amount is converted to
+        the other currency at exchange_rate, in INR per USD.
+        """
+        amount = float(amount)
+        rate = float(exchange_rate if exchange_rate is not None else _DEFAULT_RATE)
+        if currency == 'INR':
+            amount_inr, amount_usd = amount, amount / rate
+        else:
+            amount_usd, amount_inr = amount, amount * rate
+        self.touched.add(PAYMENT_LINES)
+        self.conn.execute(
+            f'INSERT INTO {PAYMENT_LINES} (ledger, {RECORD_ID}, {", ".join(_LINE_FIELDS)}) '
+            f'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (ledger, int(record_id), _to_sql_value(date), amount, currency, rate,
+             reference or '', amount_inr, amount_usd))
+        # Keep the per-record totals current instead of summing the lines on every read
+        self.conn.execute(
+            f'INSERT INTO payment_totals (ledger, {RECORD_ID}, lines, received_inr, received_usd) '
+            f'VALUES (?, ?, 1, ?, ?) ON CONFLICT (ledger, {RECORD_ID}) DO UPDATE SET '
+            f'lines = lines + 1, received_inr = received_inr + excluded.received_inr, '
+            f'received_usd = received_usd + excluded.received_usd',
+            (ledger, int(record_id), amount_inr, amount_usd))
+        self._lines_changed(ledger, record_id)
+        return self.payment_totals(ledger, record_id)
+
+    def payment_totals(self, ledger, record_id):
+        """Return {'lines', 'received_inr', 'received_usd'} for one record."""
+        row = self.conn.execute(
+            f'SELECT lines, received_inr, received_usd FROM payment_totals '
+            f'WHERE ledger = ? AND {RECORD_ID} = ?', (ledger, int(record_id))).fetchone()
+        return dict(zip(['lines', 'received_inr', 'received_usd'], row or (0, 0.0, 0.0)))
+
+    def payment_lines(self, ledger, record_id):
+        rows = self.conn.execute(
+            f'SELECT {", ".join(_LINE_FIELDS)} FROM {PAYMENT_LINES} '
+            f'WHERE ledger = ? AND {RECORD_ID} = ? ORDER BY line_id', (ledger, int(record_id))).fetchall()
+        return [dict(zip(_LINE_FIELDS, row)) for row in rows]
+
+    def clear_payment_lines(self, ledger, record_id=None):
+        """Remove the installments of one record, or of every record in the ledger."""
+        where, params = 'ledger = ?', [ledger]
+        if record_id is not None:
+            where += f' AND {RECORD_ID} = ?'
+            params.append(int(record_id))
+        self.touched.add(PAYMENT_LINES)
+        self.conn.execute(f'DELETE FROM {PAYMENT_LINES} WHERE {where}', params)
+        self.conn.execute(f'DELETE FROM payment_totals WHERE {where}', params)
+        if record_id is None:
+            if ledger in self.store.watched:
+                self.changes[ledger] = None
+        else:
+            self._lines_changed(ledger, record_id)
+
+    def _lines_changed(self, ledger, record_id):
+        # What has been received counts as a change of the record itself
+        if self._watching(ledger):
+            record = self.get(ledger, record_id)
+            if record is not None:
+                self._changed(ledger, record, record)
+
+    def adopt_partial_payments(self, ledger):
+        """
+        Move installments stored as JSON in a ledger's 'partial_payments' cells
+        into payment lines, converting them at the record's Rate, and clear the
+        cells. Returns the number of lines added.
+        """
+        columns = self.store._column_map(self.conn, ledger)
+        if 'partial_payments' not in columns:
+            return 0
+        cell = _quote(columns['partial_payments'])
+        rate = _quote(columns['Rate']) if 'Rate' in columns else 'NULL'
+        added = 0
+        rows = self.conn.execute(
+            f'SELECT {RECORD_ID}, {cell}, {rate} FROM {_quote(ledger)} WHERE {cell} IS NOT NULL').fetchall()
+        for record_id, payments, record_rate in rows:
+            try:
+                payments = json.loads(payments)
+            except (TypeError, ValueError):
+                payments = []
+            for payment in payments if isinstance(payments, list) else []:
+                try:
+                    self.add_payment_line(ledger, record_id, payment['amount'], payment.get('currency'),
+                                          record_rate or payment.get('exchange_rate'),
+                                          payment.get('date'), payment.get('reference'))
+                    added += 1
+                except (KeyError, TypeError, ValueError, ZeroDivisionError, AttributeError):
+                    logger.warning(f"Skipping unreadable partial payment of {ledger} record {record_id}")
+        if rows:
+            self.touched.add(ledger)
+            self.conn.execute(f'UPDATE {_quote(ledger)} SET {cell} = NULL WHERE {cell} IS NOT NULL')
+        return added
+
+    def next_ids(self, sequence, count=1):
+        """
+        Reserve count consecutive IDs from a sequence in SEQUENCES and return
+        them formatted with its prefix. Reserved IDs are never handed out
+        again, even if the records using them are deleted.
+        """
+        spec = SEQUENCES[sequence]
+        row = self.conn.execute('SELECT value FROM sequences WHERE name = ?', (sequence,)).fetchone()
+        last = row[0] if row else self._highest_id(spec)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)', (sequence, last + count))
+        return [f"{spec['prefix']}{value}" for value in range(last + 1, last + count + 1)]
+
+    def _reserve_through(self, sequence, value):
+        """Make sure a sequence never hands out value or any ID below it."""
+        row = self.conn.execute('SELECT value FROM sequences WHERE name = ?', (sequence,)).fetchone()
+        last = row[0] if row else self._highest_id(SEQUENCES[sequence])
+        if value > last:
+            self.conn.execute('INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)', (sequence, value))
+
+    def _highest_id(self, spec):
+        """Return the largest numeric ID already used in a sequence's ledger field."""
+        columns = self.store._column_map(self.conn, spec['ledger'])
+        if spec['field'] not in columns:
+            return 0
+        highest = 0
+        prefix = spec['prefix']
+        for (value,) in self.conn.execute(
+                f"SELECT {_quote(columns[spec['field']])} FROM {_quote(spec['ledger'])}"):
+            value = str(value)
+            if prefix and value.startswith(prefix):
+                value = value[len(prefix):]
+            try:
+                highest = max(highest, int(float(value)))
+            except ValueError:
+                continue
+        return highest
+
+class SQLiteStore(LedgerStore):
+    """
+    Ledger storage backed by a single SQLite database.
+    Each ledger is a table with an auto-incremented RECORD_ID primary key and
+    one column per ledger field, added the first time a record uses it.
+    SQLite column names are case-insensitive while the ledgers are not
+    ('Date' and 'date' both exist), so fields are stored in generated
+    columns and mapped back to their names through the ledger_columns table.
+    Whole-ledger reads are served from a LedgerCache validated against the
+    database files, so repeated reads between writes cost no SQL at all.
+    Commits are appended to a write-ahead journal that a JournalCompactor
+    folds back into the database in the background. Mutations are serialized
+    through a CommitQueue, which commits those arriving together as one group.
+    """
+    def __init__(self, data_dir, db_name='ledger.db', cache_max_bytes=256 * 1024 * 1024,
+                 checkpoint_interval=30, journal_max_bytes=4 * 1024 * 1024, commit_window=0.005):
+        self.data_dir = data_dir
+        self.db_path = os.path.join(data_dir, db_name)
+        self.cache = LedgerCache(cache_max_bytes)
+        self.views = [view() for view in VIEWS]
+        self.watched = {ledger for view in self.views for ledger in view.ledgers}
+        # Called with the names of the ledgers and views every commit touched
+        self.listeners = []
+        # Committed column maps per ledger, shared by every connection
+        self._columns = {}
+        # Bumped whenever _columns is republished, so a map read before then
+        # is not cached over a newer one
+        self._generation = 0
+        # Staged column maps (Transaction.columns) per open write connection
+        self._staged = {}
+        self._lock = threading.Lock()
+        os.makedirs(data_dir, exist_ok=True)
+        self._bootstrap()
+        self.compactor = JournalCompactor(self, checkpoint_interval, journal_max_bytes)
+        self.compactor.start()
+        self.writer = CommitQueue(self, commit_window)
+        self.writer.start()
+
+    def _connect(self, **kwargs):
+        # Autocommit mode; transactions are opened explicitly in transaction()
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, **kwargs)
+        # fsync the journal on every commit, and leave checkpoints to the compactor
+        conn.execute('PRAGMA synchronous = FULL')
+        conn.execute('PRAGMA wal_autocheckpoint = 0')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Open a write transaction and yield a Transaction bound to it."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            tx = Transaction(self, conn)
+            self._staged[conn] = tx.columns
+            try:
+                yield tx
+                tx.flush()
+                if tx.touched:
+                    self._bump_versions(conn, tx.touched)
+                conn.execute('COMMIT')
+                self._publish_columns(tx.columns)
+                for ledger in tx.touched:
+                    self.cache.invalidate((self.db_path, ledger))
+                if tx.touched and hasattr(self, 'compactor'):
+                    self.compactor.notify()
+                if tx.touched:
+                    self._notify(tx.touched)
+            except BaseException:
+                # Nothing staged was published, so the store's maps are still right
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            self._staged.pop(conn, None)
+            conn.close()
+
+    def _bump_versions(self, conn, names):
+        # Readers compare these to tell whether anything they derive from changed
+        modified = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        conn.executemany(
+            'INSERT INTO data_versions (name, version, modified) VALUES (?, 1, ?) '
+            'ON CONFLICT (name) DO UPDATE SET version = version + 1, modified = excluded.modified',
+            [(name, modified) for name in names])
+
+    def data_version(self, names):
+        """
+        Return (token, last_modified) for the given ledgers and views, or all
+        of them when names is None. The token changes with every commit
+        touching any of them, from this process or any other; last_modified
+        is the UTC time of the latest such commit, or None if there was none.
+        """
+        if names is None:
+            rows = self.query('SELECT name, version, modified FROM data_versions ORDER BY name')
+        else:
+            names = sorted(set(names))
+            rows = self.query(
+                f'SELECT name, version, modified FROM data_versions '
+                f'WHERE name IN ({", ".join("?" for _ in names)}) ORDER BY name', names)
+        token = hashlib.sha1(repr([(r['name'], r['version'], r['modified']) for r in rows]).encode())
+        modified = max((r['modified'] for r in rows), default=None)
+        return token.hexdigest()[:20], datetime.fromisoformat(modified) if modified else None
+
+    def subscribe(self, listener):
+        """Call listener(names) after every commit with the ledgers and views it changed."""
+        self.listeners.append(listener)
+
+    def _notify(self, touched):
+        for listener in self.listeners:
+            try:
+                listener(frozenset(touched))
+            except Exception as e:
+                logger.error(f"Error notifying ledger listener: {str(e)}")
+
+    def _forget_columns(self):
+        # The database was replaced underneath the cached maps
+        with self._lock:
+            self._columns.clear()
+            self._generation += 1
+
+    def _publish_columns(self, staged):
+        """Make the column maps a transaction changed visible to everyone once it has committed."""
+        if not staged:
+            return
+        with self._lock:
+            for ledger, columns in staged.items():
+                if columns is None:
+                    self._columns.pop(ledger, None)
+                else:
+                    self._columns[ledger] = dict(columns)
+            self._generation += 1
+
+    def submit(self, fn):
+        """
+        Run fn(tx) on the store's writer thread and return its result.
+        Use this for any read-modify-write so it cannot interleave with other writes.
+        """
+        return self.writer.submit(fn)
+
+    def _bootstrap(self):
+        """Create missing ledger tables, seeding them from the legacy workbooks."""
+        conn = self._connect()
+        try:
+            # Persistent setting; switches the database to an append-only journal
+            conn.execute('PRAGMA journal_mode = WAL')
+        finally:
+            conn.close()
+        with self.transaction() as tx:
+            tx.conn.execute(
+                'CREATE TABLE IF NOT EXISTS data_versions ('
+                'name TEXT PRIMARY KEY, version INTEGER NOT NULL, modified TEXT NOT NULL)')
+            tx.conn.execute(
+                'CREATE TABLE IF NOT EXISTS ledger_columns ('
+                'ledger TEXT NOT NULL, name TEXT NOT NULL, physical TEXT NOT NULL, '
+                'PRIMARY KEY (ledger, name))')
+            tx.conn.execute(
+                'CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            tx.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {PAYMENT_LINES} ('
+                f'line_id INTEGER PRIMARY KEY AUTOINCREMENT, ledger TEXT NOT NULL, '
+                f'{RECORD_ID} INTEGER NOT NULL, date TEXT, amount REAL NOT NULL, currency TEXT, '
+                f'exchange_rate REAL, reference TEXT, amount_inr REAL NOT NULL, amount_usd REAL NOT NULL)')
+            tx.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS ix_{PAYMENT_LINES}_record ON {PAYMENT_LINES} (ledger, {RECORD_ID})')
+            tx.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS payment_totals ('
+                f'ledger TEXT NOT NULL, {RECORD_ID} INTEGER NOT NULL, lines INTEGER NOT NULL, '
+                f'received_inr REAL NOT NULL, received_usd REAL NOT NULL, '
+                f'PRIMARY KEY (ledger, {RECORD_ID}))')
+            existing = {row[0] for row in tx.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for ledger, spec in LEDGERS.items():
+                if ledger in existing:
+                    continue
+                seed_file = os.path.join(self.data_dir, spec['file'])
+                if os.path.exists(seed_file):
+                    df = pd.read_excel(seed_file)
+                    tx.replace(ledger, df)
+                    logger.info(f"Imported {len(df)} {ledger} records from {spec['file']}")
+                else:
+                    self._create_ledger(tx.conn, ledger, spec['columns'])
+                    logger.info(f"Created empty {ledger} ledger")
+            self._migrate(tx)
+            self._create_views(tx)
+
+    def _migrate(self, tx):
+        """Bring the stored data up to SCHEMA_VERSION, tracked in PRAGMA user_version."""
+        version = tx.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            # Payments used to reference purchases and sales by their position
+            # in the ledger; point them at the record's RECORD_ID instead
+            payments = self._column_map(tx.conn, 'payments')
+            if 'reference_id' in payments and 'reference_type' in payments:
+                ref_id, ref_type = _quote(payments['reference_id']), _quote(payments['reference_type'])
+                for ledger, ref in _REFERENCE_TYPES.items():
+                    record_ids = [row[0] for row in tx.conn.execute(
+                        f'SELECT {RECORD_ID} FROM {_quote(ledger)} ORDER BY {RECORD_ID}')]
+                    rows = tx.conn.execute(
+                        f'SELECT {RECORD_ID}, {ref_id} FROM payments WHERE {ref_type} = ?', (ref,)).fetchall()
+                    for payment_id, position in rows:
+                        try:
+                            target = str(record_ids[int(float(position))])
+                        except (TypeError, ValueError, IndexError):
+                            # Positions outside the ledger point at nothing; leave them alone
+                            continue
+                        tx.conn.execute(
+                            f'UPDATE payments SET {ref_id} = ? WHERE {RECORD_ID} = ?', (target, payment_id))
+                tx.touched.add('payments')
+        if version < 2:
+            # Key columns were not indexed when these ledgers were created
+            for ledger in LEDGERS:
+                columns = self._column_map(tx.conn, ledger)
+                for name in _indexed_fields(ledger):
+                    if name in columns:
+                        self._create_index(tx.conn, ledger, columns[name])
+        if version < 3:
+            # Installments used to be a JSON list in each record's 'partial_payments' cell
+            for ledger in ('purchases', 'sales'):
+                added = tx.adopt_partial_payments(ledger)
+                if added:
+                    logger.info(f"Moved {added} partial payments of {ledger} into {PAYMENT_LINES}")
+        if version < 4:
+            # Party columns were not indexed before
+            for ledger in LEDGERS:
+                columns = self._column_map(tx.conn, ledger)
+                for name in LEDGERS[ledger].get('party_columns', []):
+                    if name in columns:
+                        self._create_index(tx.conn, ledger, columns[name])
+        if version < SCHEMA_VERSION:
+            tx.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _create_views(self, tx):
+        """Create and fill views that are new or whose version changed."""
+        tx.conn.execute('CREATE TABLE IF NOT EXISTS views (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        versions = dict(tx.conn.execute('SELECT name, version FROM views').fetchall())
+        for view in self.views:
+            if versions.get(view.name) == view.version:
+                continue
+            view.create(tx.conn)
+            for ledger in view.ledgers:
+                view.rebuild(tx, ledger)
+            tx.conn.execute('INSERT OR REPLACE INTO views (name, version) VALUES (?, ?)',
+                            (view.name, view.version))
+            tx.touched.add(view.name)
+            logger.info(f"Built the {view.name} view")
+
+    def rebuild_views(self, names=None):
+        """Recompute views (all of them by default) from the ledgers."""
+        def rebuild(tx):
+            rebuilt = []
+            for view in self.views:
+                if names is not None and view.name not in names:
+                    continue
+                for ledger in view.ledgers:
+                    view.rebuild(tx, ledger)
+                tx.touched.add(view.name)
+                rebuilt.append(view.name)
+            return rebuilt
+        return self.submit(rebuild)
+
+    def query(self, sql, params=()):
+        """Run a read-only query, e.g. against a view, and return the rows as dicts."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def _create_ledger(self, conn, ledger, columns):
+        conn.execute(
+            f'CREATE TABLE {_quote(ledger)} ({RECORD_ID} INTEGER PRIMARY KEY AUTOINCREMENT)')
+        self._ensure_columns(conn, ledger, columns)
+
+    def _drop_ledger(self, conn, ledger):
+        conn.execute(f'DROP TABLE IF EXISTS {_quote(ledger)}')
+        conn.execute('DELETE FROM ledger_columns WHERE ledger = ?', (ledger,))
+        self._stage_columns(conn, ledger, None)
+
+    def _stage_columns(self, conn, ledger, columns):
+        # Changes made inside a write transaction stay with it until it commits
+        staged = self._staged.get(conn)
+        if staged is not None:
+            staged[ledger] = None if columns is None else dict(columns)
+        else:
+            with self._lock:
+                if columns is None:
+                    self._columns.pop(ledger, None)
+                else:
+                    self._columns[ledger] = dict(columns)
+
+    def _column_map(self, conn, ledger, refresh=False):
+        """Return {field name: physical column} for a ledger, in column order."""
+        staged = self._staged.get(conn)
+        if not refresh:
+            if staged is not None and staged.get(ledger) is not None:
+                return dict(staged[ledger])
+            with self._lock:
+                if ledger in self._columns and (staged is None or ledger not in staged):
+                    return dict(self._columns[ledger])
+                generation = self._generation
+        else:
+            generation = None
+        columns = dict(conn.execute(
+            'SELECT name, physical FROM ledger_columns WHERE ledger = ? ORDER BY rowid',
+            (ledger,)).fetchall())
+        if staged is not None:
+            # May include columns this transaction added; not everyone's yet
+            staged[ledger] = dict(columns)
+        else:
+            with self._lock:
+                if generation is None or generation == self._generation:
+                    self._columns[ledger] = dict(columns)
+        return dict(columns)
+
+    def _ensure_columns(self, conn, ledger, names):
+        """Add any fields the ledger table does not have yet and return the column map."""
+        columns = self._column_map(conn, ledger)
+        if all(name in columns for name in names if name != RECORD_ID):
+            return columns
+        # Another process may have added columns since we cached them
+        columns = self._column_map(conn, ledger, refresh=True)
+        indexed = _indexed_fields(ledger)
+        for name in names:
+            if name in columns or name == RECORD_ID:
+                continue
+            physical = f'c{len(columns) + 1}'
+            conn.execute(f'ALTER TABLE {_quote(ledger)} ADD COLUMN {physical}')
+            conn.execute('INSERT INTO ledger_columns (ledger, name, physical) VALUES (?, ?, ?)',
+                         (ledger, name, physical))
+            if name in indexed:
+                self._create_index(conn, ledger, physical)
+            columns[name] = physical
+        self._stage_columns(conn, ledger, columns)
+        return dict(columns)
+
+    def _create_index(self, conn, ledger, physical):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"ix_{ledger}_{physical}")} '
+                     f'ON {_quote(ledger)} ({physical})')
+
+    def columns(self, ledger):
+        """Return the ledger's field names in column order."""
+        conn = self._connect()
+        try:
+            return list(self._column_map(conn, ledger))
+        finally:
+            conn.close()
+
+    def stat_token(self):
+        """Return the (path, mtime, size) token of the files backing the store."""
+        # Commits only touch the journal until the next checkpoint
+        return file_token(self.db_path, self.db_path + '-wal')
+
+    def checkpoint(self, conn=None):
+        """Fold the write-ahead journal into the database file and truncate it."""
+        owned = conn is None
+        if owned:
+            conn = self._connect()
+        try:
+            busy, pages, moved = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if busy:
+                logger.debug("Ledger checkpoint deferred, readers still active")
+            else:
+                logger.debug(f"Checkpointed {moved} journal pages into {os.path.basename(self.db_path)}")
+            return not busy
+        finally:
+            if owned:
+                conn.close()
+
+    def read(self, ledger, columns=None, dtypes=None):
+        """
+        Return a ledger, from the cache when the database is unchanged.
+
+        Without arguments every stored field is returned as stored. Passing
+        columns loads only those fields, coalescing each with its aliases, and
+        pins their dtypes from the ledger schema (overridden by dtypes) instead
+        of inferring them. Requested fields the ledger has never stored are
+        left out, so callers can keep checking `name in df.columns`.
+        """
+        if columns is None and dtypes is None:
+            return self.cache.get((self.db_path, ledger), self.stat_token(), lambda: self._read(ledger))
+        if columns is not None:
+            columns = tuple(columns)
+        schema = dict(LEDGERS.get(ledger, {}).get('dtypes', {}))
+        schema.update(dtypes or {})
+        key = (self.db_path, ledger, columns, tuple(sorted(schema.items())))
+        return self.cache.get(key, self.stat_token(), lambda: self._read(ledger, columns, schema))
+
+    def _read(self, ledger, columns=None, dtypes=None):
+        conn = self._connect()
+        try:
+            stored = self._column_map(conn, ledger)
+            if columns is None:
+                fields = [(n, [p]) for n, p in stored.items()]
+            else:
+                fields = [(n, self._sources(stored, ledger, n)) for n in columns]
+            select = [RECORD_ID] + [f'{_coalesce(sources)} AS {_quote(name)}'
+                                    for name, sources in fields if sources]
+            df = pd.read_sql_query(
+                f'SELECT {", ".join(select)} FROM {_quote(ledger)} ORDER BY {RECORD_ID}',
+                conn, index_col=RECORD_ID)
+        finally:
+            conn.close()
+        return _apply_dtypes(df, dtypes) if dtypes else df
+
+    def _sources(self, stored, ledger, name):
+        """Return the physical columns holding a field, the field's own first, then its aliases."""
+        if name == RECORD_ID:
+            return [RECORD_ID]
+        aliases = LEDGERS.get(ledger, {}).get('aliases', {})
+        return [stored[n] for n in [name] + aliases.get(name, []) if n in stored]
+
+    def _where(self, stored, ledger, where):
+        """Translate (field, operator, value) filters into an SQL WHERE clause and its parameters."""
+        clauses, params = [], []
+        for name, op, value in where:
+            if op not in _OPERATORS:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            # Fields the ledger never stored read as NULL and match nothing
+            expr = _coalesce(self._sources(stored, ledger, name))
+            if op == 'in':
+                values = [_to_sql_value(v) for v in value]
+                if not values:
+                    clauses.append('0')
+                    continue
+                clauses.append(f'{expr} COLLATE NOCASE IN ({", ".join("?" for _ in values)})')
+                params.extend(values)
+            elif op == 'like':
+                clauses.append(f'{expr} LIKE ?')
+                params.append(value)
+            else:
+                # Statuses are stored as both 'Pending' and 'pending'
+                collate = ' COLLATE NOCASE' if op in ('=', '!=') else ''
+                clauses.append(f'{expr}{collate} {op} ?')
+                params.append(_to_sql_value(value))
+        prefilters, prefilter_params = self._range_prefilters(stored, ledger, where)
+        clauses = prefilters + clauses
+        params = prefilter_params + params
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _range_prefilters(self, stored, ledger, where):
+        """
+        Restate the range filters on indexed fields per physical column, e.g.
+        (c1 >= ? AND c1 <= ? OR c2 >= ? AND c2 <= ?) for a date range. The
+        COALESCE of the filter itself hides the indexes from SQLite; this
+        redundant form lets it read just the rows in range through them.
+        """
+        ranges = {}
+        for name, op, value in where:
+            if op in _RANGE_OPERATORS:
+                ranges.setdefault(name, []).append((op, _to_sql_value(value)))
+        aliases = LEDGERS.get(ledger, {}).get('aliases', {})
+        indexed = set(_indexed_fields(ledger))
+        clauses, params = [], []
+        for name, conditions in ranges.items():
+            names = [n for n in [name] + aliases.get(name, []) if n in stored]
+            # Only sound when every column the field may come from is covered
+            if not names or not indexed.issuperset(names):
+                continue
+            clauses.append('(' + ' OR '.join(
+                '(' + ' AND '.join(f'{_quote(stored[n])} {op} ?' for op, _ in conditions) + ')'
+                for n in names) + ')')
+            for _ in names:
+                params += [value for _, value in conditions]
+        return clauses, params
+
+    def select(self, ledger, columns, where=(), order_by=None, descending=False,
+               limit=None, offset=0, after=None, dtypes=None):
+        """
+        Return one page of a ledger as a DataFrame indexed by RECORD_ID.
+
+        Only the page is read from the database, so the cost does not grow
+        with the ledger. Missing sort values sort as '' and are returned that
+        way in SORT_KEY, which together with RECORD_ID is what after expects.
+        """
+        columns = tuple(columns)
+        schema = dict(LEDGERS.get(ledger, {}).get('dtypes', {}))
+        schema.update(dtypes or {})
+        conn = self._connect()
+        try:
+            stored = self._column_map(conn, ledger)
+            fields = [(n, self._sources(stored, ledger, n)) for n in columns]
+            key = f"IFNULL({_coalesce(self._sources(stored, ledger, order_by or RECORD_ID))}, '')"
+            select = [RECORD_ID] + [f'{_coalesce(sources)} AS {_quote(name)}'
+                                    for name, sources in fields if sources]
+            select.append(f'{key} AS {_quote(SORT_KEY)}')
+            clause, params = self._where(stored, ledger, where)
+            if after is not None:
+                clause += (' AND ' if clause else ' WHERE ') + \
+                    f'({key}, {RECORD_ID}) {"<" if descending else ">"} (?, ?)'
+                params += [_to_sql_value(after[0]), int(after[1])]
+            direction = 'DESC' if descending else 'ASC'
+            sql = (f'SELECT {", ".join(select)} FROM {_quote(ledger)}{clause} '
+                   f'ORDER BY {key} {direction}, {RECORD_ID} {direction}')
+            if limit is not None:
+                sql += ' LIMIT ? OFFSET ?'
+                params += [int(limit), int(offset)]
+            df = pd.read_sql_query(sql, conn, params=params, index_col=RECORD_ID)
+        finally:
+            conn.close()
+        return _apply_dtypes(df, schema)
+
+    def count(self, ledger, where=()):
+        conn = self._connect()
+        try:
+            clause, params = self._where(self._column_map(conn, ledger), ledger, where)
+            return conn.execute(f'SELECT COUNT(*) FROM {_quote(ledger)}{clause}', params).fetchone()[0]
+        finally:
+            conn.close()
+
+    def total(self, ledger, field, where=()):
+        conn = self._connect()
+        try:
+            stored = self._column_map(conn, ledger)
+            clause, params = self._where(stored, ledger, where)
+            expr = _coalesce(self._sources(stored, ledger, field))
+            return conn.execute(
+                f'SELECT TOTAL({expr}) FROM {_quote(ledger)}{clause}', params).fetchone()[0]
+        finally:
+            conn.close()
+
+    def aggregate(self, ledger, measures, group_by=(), where=(), month_of=None):
+        """One grouped query; only the matching records are read when the filters hit an index."""
+        conn = self._connect()
+        try:
+            stored = self._column_map(conn, ledger)
+            clause, params = self._where(stored, ledger, where)
+            keys, select = [], []
+            if month_of:
+                date = _coalesce(self._sources(stored, ledger, month_of))
+                select.append(f"CASE WHEN {date} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' "
+                              f"THEN substr({date}, 1, 7) ELSE '' END")
+                keys.append('month')
+            for name in group_by:
+                # Statuses are stored as both 'Pending' and 'pending'
+                select.append(f'{_coalesce(self._sources(stored, ledger, name))} COLLATE NOCASE')
+                keys.append(name)
+            for name, (function, fields) in measures.items():
+                if function not in _AGGREGATES:
+                    raise ValueError(f"Unsupported aggregate: {function}")
+                if isinstance(fields, str):
+                    fields = [fields]
+                sources = [s for field in fields or [] for s in self._sources(stored, ledger, field)]
+                expr = _coalesce(sources) if sources else ('*' if function == 'count' else 'NULL')
+                select.append(f'{_AGGREGATES[function]}({expr})')
+            sql = f'SELECT {", ".join(select)} FROM {_quote(ledger)}{clause}'
+            if keys:
+                groups = ', '.join(str(i) for i in range(1, len(keys) + 1))
+                sql += f' GROUP BY {groups} ORDER BY {groups}'
+            names = keys + list(measures)
+            return [dict(zip(names, row)) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def get(self, ledger, record_id):
+        conn = self._connect()
+        try:
+            return Transaction(self, conn).get(ledger, record_id)
+        finally:
+            conn.close()
+
+    def find(self, ledger, key):
+        conn = self._connect()
+        try:
+            return Transaction(self, conn).find(ledger, key)
+        finally:
+            conn.close()
+
+    def payment_lines(self, ledger, record_id):
+        conn = self._connect()
+        try:
+            return Transaction(self, conn).payment_lines(ledger, record_id)
+        finally:
+            conn.close()
+
+    def received(self, ledger, record_ids=None):
+        """One indexed read of the running totals, however many installments there are."""
+        sql = f'SELECT {RECORD_ID}, lines, received_inr, received_usd FROM payment_totals WHERE ledger = ?'
+        params = [ledger]
+        if record_ids is not None:
+            record_ids = [int(r) for r in record_ids]
+            sql += f' AND {RECORD_ID} IN ({", ".join("?" for _ in record_ids)})'
+            params += record_ids
+        conn = self._connect()
+        try:
+            return pd.read_sql_query(sql, conn, params=params, index_col=RECORD_ID)
+        finally:
+            conn.close()
+
+    def insert(self, ledger, record):
+        return self.submit(lambda tx: tx.insert(ledger, record))
+
+    def update(self, ledger, record_id, changes):
+        return self.submit(lambda tx: tx.update(ledger, record_id, changes))
+
+    def delete(self, ledger, record_id):
+        return self.submit(lambda tx: tx.delete(ledger, record_id))
+
+    def replace(self, ledger, df):
+        self.submit(lambda tx: tx.replace(ledger, df))
+
+    def next_ids(self, sequence, count=1):
+        return self.submit(lambda tx: tx.next_ids(sequence, count))
+
+    def import_excel(self, ledger, file_path):
+        """Replace a ledger with the contents of an .xlsx workbook."""
+        df = pd.read_excel(file_path)
+        self.replace(ledger, df)
+        logger.info(f"Imported {len(df)} {ledger} records from {os.path.basename(file_path)}")
+        return len(df)
+
+    def export_excel(self, ledger, file_path, record_ids=False):
+        df = self.read(ledger)
+        return write_excel(df.reset_index() if record_ids else df, file_path)
+
+    def backup_to(self, file_path):
+        """Write a consistent copy of the whole database to file_path."""
+        with atomic_path(file_path) as temp_path:
+            source = self._connect()
+            target = sqlite3.connect(temp_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        return file_path
+
+    def restore_from(self, file_path):
+        """
+        Replace the whole database with the copy at file_path. Sequences
+        keep the IDs reserved before the restore reserved, so no ID handed
+        out since the copy was taken is handed out again.
+        """
+        reserved = {row['name']: row['value'] for row in self.query('SELECT name, value FROM sequences')}
+        source = sqlite3.connect(file_path)
+        target = self._connect()
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self._forget_columns()
+        self.cache.invalidate()
+        # Older copies may predate some ledgers
+        self._bootstrap()
+        # Everything may have changed; readers holding versions of the
+        # restored copy must not mistake it for what they saw
+        with self.transaction() as tx:
+            for sequence, value in reserved.items():
+                if sequence in SEQUENCES:
+                    tx._reserve_through(sequence, value)
+            tx.touched.update(LEDGERS)
+            tx.touched.update([PAYMENT_LINES] + [view.name for view in self.views])
+
+# Storage engines selectable through the LEDGER_ENGINE setting
+ENGINES = {
+    'sqlite': SQLiteStore
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(data_dir, engine='sqlite', **options):
+    """
+    Return the shared store for a data directory, creating it on first use.
+    Extra options (e.g. cache_max_bytes) are passed to the engine when it is created.
+    """
+    key = (os.path.abspath(data_dir), engine)
+    with _stores_lock:
+        if key not in _stores:
+            if engine not in ENGINES:
+                raise ValueError(f"Unknown ledger storage engine: {engine}")
+            _stores[key] = ENGINES[engine](data_dir, **options)
+        return _stores[key]
+
+def current_store():
+    """Return the store configured for the current Flask application."""
+    config = current_app.config
+    return get_store(config['DATA_DIR'], config.get('LEDGER_ENGINE', 'sqlite'),
+                     cache_max_bytes=config.get('LEDGER_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+                     checkpoint_interval=config.get('LEDGER_CHECKPOINT_INTERVAL', 30),
+                     commit_window=config.get('LEDGER_COMMIT_WINDOW', 0.005))
@@ -0,0 +1,137 @@
+import logging
+from collections import defaultdict
+
+from .storage import LedgerView, field_value, register_view
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['TOTAL_FIELDS', 'SUMMED_FIELDS', 'summed_value', 'summed_sql', 'LedgerTotals', 'ledger_totals',
+           'verify_ledger_totals']
+
+TOTAL_FIELDS = ['ledger', 'status', 'records', 'amount_usd', 'amount_inr', 'carats', 'pcs']
+
+# Fields summed per status; the first field a record has a value in counts.
+# Older rows only carry the USD total as 'Total Amount (USD)' or 'Total Amount'.
+SUMMED_FIELDS = {
+    'amount_usd': ['Total Amount USD', 'Total Amount (USD)', 'Total Amount'],
+    'amount_inr': ['Total Amount INR'],
+    'carats': ['Carat'],
+    'pcs': ['Pcs']
+}
+
+# Totals differing by less than this are considered equal when verifying
+_TOLERANCE = 0.005
+
+def summed_value(record, ledger, names):
+    """Read a summed field of a stored record like summed_sql() does."""
+    for name in names:
+        value = field_value(record, ledger, name)
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+def summed_sql(tx, ledger, names):
+    """SQL expression reading a summed field: the first of names a record has a value in."""
+    return f"COALESCE({', '.join(tx.field_sql(ledger, name) for name in names)}, NULL)"
+
+def _select(tx, ledger):
+    """SQL computing the totals of a ledger from scratch, one row per payment status."""
+    sums = [f'TOTAL({summed_sql(tx, ledger, names)})' for names in SUMMED_FIELDS.values()]
+    status = f"IFNULL({tx.field_sql(ledger, 'Payment Status')}, '')"
+    return f'SELECT {status}, COUNT(*), {", ".join(sums)} FROM {ledger} GROUP BY 1'
+
+@register_view
+class LedgerTotals(LedgerView):
+    """
+    Record counts and summed amounts, carats and pieces per ledger and payment
+    status, as the dashboard shows them.
+
+    Mutations apply their delta to the affected rows: the before record is
+    subtracted and the after record added, so keeping the totals current
+    costs the same however long the ledgers get.
+    """
+    name = 'ledger_totals'
+    version = 1
+    ledgers = ('purchases', 'sales')
+
+    def create(self, conn):
+        conn.execute('DROP TABLE IF EXISTS ledger_totals')
+        conn.execute(
+            'CREATE TABLE ledger_totals ('
+            'ledger TEXT NOT NULL, status TEXT NOT NULL, records INTEGER NOT NULL, '
+            'amount_usd REAL NOT NULL, amount_inr REAL NOT NULL, carats REAL NOT NULL, '
+            'pcs REAL NOT NULL, PRIMARY KEY (ledger, status))')
+
+    def rebuild(self, tx, ledger):
+        tx.conn.execute('DELETE FROM ledger_totals WHERE ledger = ?', (ledger,))
+        tx.conn.execute(
+            f'INSERT INTO ledger_totals ({", ".join(TOTAL_FIELDS)}) '
+            f'SELECT ?, * FROM ({_select(tx, ledger)})', (ledger,))
+
+    def apply(self, tx, ledger, changes):
+        deltas = defaultdict(lambda: [0] * (1 + len(SUMMED_FIELDS)))
+        for before, after in changes:
+            # Installments change a record's payment totals, not these
+            if before == after:
+                continue
+            for record, sign in ((before, -1), (after, 1)):
+                if record is None:
+                    continue
+                delta = deltas[str(field_value(record, ledger, 'Payment Status', ''))]
+                delta[0] += sign
+                for i, names in enumerate(SUMMED_FIELDS.values(), start=1):
+                    delta[i] += sign * summed_value(record, ledger, names)
+        for status, delta in deltas.items():
+            tx.conn.execute(
+                f'INSERT INTO ledger_totals ({", ".join(TOTAL_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                f'ON CONFLICT (ledger, status) DO UPDATE SET records = records + excluded.records, '
+                + ', '.join(f'{f} = {f} + excluded.{f}' for f in SUMMED_FIELDS),
+                [ledger, status] + delta)
+        tx.conn.execute('DELETE FROM ledger_totals WHERE ledger = ? AND records <= 0', (ledger,))
+
+def ledger_totals(store):
+    """
+    Return {ledger: {'records', 'amount_usd', 'amount_inr', 'carats', 'pcs',
+    'statuses': {status: records}}} for the purchase and sale ledgers.
+    """
+    totals = {ledger: {'records': 0, **{f: 0.0 for f in SUMMED_FIELDS}, 'statuses': {}}
+              for ledger in LedgerTotals.ledgers}
+    for row in store.query(f'SELECT {", ".join(TOTAL_FIELDS)} FROM ledger_totals'):
+        ledger = totals[row['ledger']]
+        ledger['records'] += row['records']
+        for field in SUMMED_FIELDS:
+            ledger[field] += row[field]
+        ledger['statuses'][row['status']] = row['records']
+    return totals
+
+def verify_ledger_totals(store, repair=False):
+    """
+    Recompute the totals from the ledgers and compare them with the
+    maintained ones. Returns the (ledger, status, field, stored, computed)
+    differences; with repair, the maintained totals are rebuilt when any
+    are found.
+    """
+    def verify(tx):
+        differences = []
+        for ledger in LedgerTotals.ledgers:
+            stored = {row[0]: row[1:] for row in tx.conn.execute(
+                f'SELECT status, {", ".join(TOTAL_FIELDS[2:])} FROM ledger_totals WHERE ledger = ?',
+                (ledger,))}
+            computed = {row[0]: row[1:] for row in tx.conn.execute(_select(tx, ledger))}
+            for status in sorted(set(stored) | set(computed)):
+                for field, have, want in zip(TOTAL_FIELDS[2:], stored.get(status, [0] * 5),
+                                             computed.get(status, [0] * 5)):
+                    if abs(have - want) > _TOLERANCE:
+                        differences.append((ledger, status, field, have, want))
+        if differences and repair:
+            view = next(v for v in tx.store.views if v.name == LedgerTotals.name)
+            for ledger in view.ledgers:
+                view.rebuild(tx, ledger)
+            tx.touched.add(view.name)
+            logger.warning(f"Rebuilt {view.name} after {len(differences)} differences")
+        return differences
+    return store.submit(verify)
@@ -0,0 +1,98 @@
+import queue
+import threading
+import logging
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger('diamond_app')
+
+__all__ = ['CommitQueue']
+
+class CommitQueue(threading.Thread):
+    """
+    Single writer thread for a ledger store.
+
+    Mutations are submitted as callables taking a Transaction. The thread
+    runs every mutation that arrives within `window` seconds of the first
+    one inside a single transaction, each under its own savepoint, so one
+    failing mutation is rolled back without affecting the others in its
+    group. The group is committed once, and each caller gets back the
+    return value (or exception) of its own callable.
+
+    Because every write goes through this one thread, a read-modify-write
+    done inside a submitted callable can no longer interleave with another
+    request's write to the same ledger.
+    """
+    def __init__(self, store, window=0.005, max_batch=64):
+        super().__init__(name='ledger-writer', daemon=True)
+        self.store = store
+        self.window = window
+        self.max_batch = max_batch
+        self.groups = 0
+        self.mutations = 0
+        self._jobs = queue.Queue()
+
+    def submit(self, fn):
+        """Run fn(tx) on the writer thread and return its result once committed."""
+        if threading.current_thread() is self:
+            raise RuntimeError("Ledger mutations cannot be submitted from inside another mutation")
+        future = Future()
+        self._jobs.put((fn, future))
+        return future.result()
+
+    def _collect(self):
+        """Block for the next mutation, then gather whatever arrives within the window."""
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._collect()
+            results = []
+            try:
+                with self.store.transaction() as tx:
+                    for fn, future in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        tx.conn.execute('SAVEPOINT mutation')
+                        try:
+                            result = fn(tx)
+                            # Views are updated under the mutation's savepoint too
+                            tx.flush()
+                            results.append((future, result, None))
+                            tx.conn.execute('RELEASE mutation')
+                        except Exception as e:
+                            tx.conn.execute('ROLLBACK TO mutation')
+                            tx.conn.execute('RELEASE mutation')
+                            tx.changes = {}
+                            # Column maps staged so far may name rolled back
+                            # columns; have them read again
+                            for ledger in tx.columns:
+                                tx.columns[ledger] = None
+                            results.append((future, None, e))
+            except Exception as e:
+                # The group as a whole failed to commit; nothing it did was kept
+                logger.error(f"Error committing ledger mutations: {str(e)}")
+                for fn, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.groups += 1
+            self.mutations += len(results)
+            if len(batch) > 1:
+                logger.debug(f"Committed {len(batch)} ledger mutations in one transaction")
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app opens its store when imported, so point it at a scratch data
+# directory first
+os.environ.setdefault('DIAMOND_DATA_DIR', tempfile.mkdtemp(prefix='diamond-data-'))
+os.environ.setdefault('PAYLOAD_REFRESH_DELAY', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as diamond_app  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    diamond_app.app.config['TESTING'] = True
+    return diamond_app.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def store():
+    return diamond_app.store
+
+
+@pytest.fixture
+def sell(client, store):
+    """Record a sale through the /sell form and return its record ID."""
+    def sell(party, carat=1.0, price_per_carat=1000.0, price_per_carat_inr=83000.0, **fields):
+        form = {'date': '2024-01-15', 'party': party, 'carat': carat, 'quantity': 1,
+                'price_per_carat': price_per_carat, 'price_per_carat_inr': price_per_carat_inr,
+                'payment_status': 'Pending', **fields}
+        client.post('/sell', data=form)
+        page = store.select('sales', ['Party'], where=[('Party', '=', party)])
+        return int(page.index[-1])
+    return sell
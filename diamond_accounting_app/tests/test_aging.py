@@ -0,0 +1,20 @@
+from services.aging import bucket_labels, parse_buckets
+
+
+def test_bucket_labels_do_not_overlap():
+    assert bucket_labels((30, 60, 90)) == ['0-30', '31-60', '61-90', '91+']
+
+
+def test_bucket_labels_for_custom_bounds():
+    assert bucket_labels(parse_buckets('15,45')) == ['0-15', '16-45', '46+']
+
+
+def test_sale_91_days_past_due_is_in_the_last_bucket(client, sell):
+    sell('Aging Buyer', date='2024-01-01', payment_due_date='2024-01-01')
+
+    data = client.post('/reports/aging', data={'as_of': '2024-04-01', 'buckets': '30,60,90'}).get_json()
+
+    assert data['buckets'] == ['0-30', '31-60', '61-90', '91+']
+    row = next(r for r in data['receivable']['rows'] if r['party'] == 'Aging Buyer')
+    assert row['91+'] == 83000.0
+    assert row['61-90'] == 0.0
@@ -0,0 +1,44 @@
+import os
+import zipfile
+
+from flask import Flask
+
+from services.backup import create_backup, restore_from_backup
+from services.storage import current_store
+
+
+def backup_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(DATA_DIR=str(tmp_path / 'data'), BACKUP_DIR=str(tmp_path / 'backup'))
+    os.makedirs(app.config['BACKUP_DIR'])
+    return app
+
+
+def test_backup_restores_the_ledger_it_was_taken_of(tmp_path):
+    with backup_app(tmp_path).app_context():
+        store = current_store()
+        kept = store.insert('sales', {'Party': 'Before Backup'})
+        backup_file = create_backup()
+        store.insert('sales', {'Party': 'After Backup'})
+
+        assert restore_from_backup(backup_file)
+
+        parties = store.read('sales', ['Party'])['Party'].tolist()
+        assert parties == ['Before Backup']
+        # The restored database keeps taking writes
+        assert store.insert('sales', {'Party': 'After Restore'}) > kept
+        assert store.read('sales', ['Party'])['Party'].tolist() == ['Before Backup', 'After Restore']
+
+
+def test_backup_holds_a_consistent_copy_of_the_database(tmp_path):
+    with backup_app(tmp_path).app_context():
+        store = current_store()
+        store.insert('sales', {'Party': 'Journaled'})
+
+        backup_file = create_backup()
+
+        with zipfile.ZipFile(backup_file) as zipf:
+            assert zipf.namelist() == ['ledger.db']
+            zipf.extract('ledger.db', tmp_path / 'copy')
+        copy = type(store)(str(tmp_path / 'copy'))
+        assert copy.read('sales', ['Party'])['Party'].tolist() == ['Journaled']
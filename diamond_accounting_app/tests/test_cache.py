@@ -0,0 +1,18 @@
+import pandas as pd
+
+from services.cache import LedgerCache
+
+
+def test_callers_cannot_modify_the_cached_frame():
+    cache = LedgerCache()
+    loader = lambda: pd.DataFrame({'Carat': [1.0, 2.0]})
+
+    first = cache.get('sales', 1, loader)
+    first.loc[0, 'Carat'] = 99.0
+    first['Party'] = 'Changed'
+    second = cache.get('sales', 1, loader)
+
+    assert second['Carat'].tolist() == [1.0, 2.0]
+    assert 'Party' not in second.columns
+    assert cache.stats()['hits'] == 1
+
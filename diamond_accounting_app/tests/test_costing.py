@@ -0,0 +1,96 @@
+import math
+
+import pandas as pd
+
+from services.costing import match_lots
+
+
+def ledger(*records):
+    """A purchase or sale ledger with RECORD_IDs 1, 2, ... in the given order."""
+    df = pd.DataFrame([{'Stone ID': None, 'Rough ID': None, 'Kapan No': None, **record} for record in records])
+    df.index = range(1, len(df) + 1)
+    return df
+
+
+def lot(date, carat, usd, **keys):
+    return {'Date': date, 'Carat': carat, 'Total Amount USD': usd, **keys}
+
+
+def test_sale_falls_back_from_stone_to_rough_to_kapan():
+    purchases = ledger(lot('2024-01-01', 1, 100, **{'Stone ID': 'S1'}),
+                       lot('2024-01-01', 1, 200, **{'Rough ID': 'R1'}),
+                       lot('2024-01-01', 1, 300, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2024-02-01', 1, 1000, **{'Stone ID': 'S1', 'Rough ID': 'R1', 'Kapan No': 'K1'}),
+                   lot('2024-02-01', 1, 1000, **{'Stone ID': 'S2', 'Rough ID': 'R1', 'Kapan No': 'K1'}),
+                   lot('2024-02-01', 1, 1000, **{'Stone ID': 'S3', 'Rough ID': 'R2', 'Kapan No': 'K1'}))
+
+    sold, lots = match_lots(purchases, sales)
+
+    assert sold['matched_by'].tolist() == ['stone', 'rough', 'kapan']
+    assert sold['cost_usd'].tolist() == [100, 200, 300]
+    assert lots['remaining'].tolist() == [0, 0, 0]
+
+
+def test_sale_spread_over_several_lots_oldest_first():
+    purchases = ledger(lot('2024-02-01', 2, 400, **{'Kapan No': 'K1'}),
+                       lot('2024-01-01', 1, 100, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2024-03-01', 2, 1000, **{'Kapan No': 'K1'}))
+
+    sold, lots = match_lots(purchases, sales)
+
+    # All of January's lot at 100/ct, then one carat of February's at 200/ct
+    assert sold.loc[1, 'cost_usd'] == 300
+    assert sold.loc[1, 'margin_usd'] == 700
+    assert lots['remaining'].tolist() == [1, 0]
+    assert lots.loc[1, 'remaining_cost_usd'] == 200
+
+
+def test_partly_matched_sale_earns_on_the_matched_carats():
+    purchases = ledger(lot('2024-01-01', 3, 300, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2024-02-01', 5, 1000, **{'Kapan No': 'K1'}))
+
+    sold, _ = match_lots(purchases, sales)
+
+    assert sold.loc[1, 'matched_carats'] == 3
+    assert sold.loc[1, 'cost_usd'] == 300
+    # Revenue of three of the five carats less their cost
+    assert sold.loc[1, 'margin_usd'] == 300
+
+
+def test_exhausted_lots_leave_later_sales_unmatched():
+    purchases = ledger(lot('2024-01-01', 1, 100, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2024-02-01', 1, 500, **{'Kapan No': 'K1'}),
+                   lot('2024-03-01', 1, 500, **{'Kapan No': 'K1'}))
+
+    sold, lots = match_lots(purchases, sales)
+
+    assert sold['matched_carats'].tolist() == [1, 0]
+    assert sold.loc[1, 'cost_usd'] == 100
+    assert math.isnan(sold.loc[2, 'margin_usd'])
+    assert lots.loc[1, 'remaining'] == 0
+
+
+def test_sales_only_use_lots_bought_by_then():
+    purchases = ledger(lot('2024-01-01', 1, 100, **{'Kapan No': 'K1'}),
+                       lot('2024-03-01', 1, 300, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2023-12-01', 1, 500, **{'Kapan No': 'K1'}),
+                   lot('2024-02-01', 2, 1000, **{'Kapan No': 'K1'}),
+                   lot('2024-04-01', 1, 500, **{'Kapan No': 'K1'}))
+
+    sold, lots = match_lots(purchases, sales)
+
+    # Nothing was bought before December's sale, February's can only have
+    # January's lot, which leaves March's lot for April's sale
+    assert sold['matched_carats'].tolist() == [0, 1, 1]
+    assert sold['cost_usd'].tolist() == [0, 100, 300]
+    assert lots['remaining'].tolist() == [0, 0]
+
+
+def test_undated_lots_only_go_to_undated_sales():
+    purchases = ledger(lot(None, 1, 100, **{'Kapan No': 'K1'}))
+    sales = ledger(lot('2024-02-01', 1, 500, **{'Kapan No': 'K1'}),
+                   lot(None, 1, 500, **{'Kapan No': 'K1'}))
+
+    sold, _ = match_lots(purchases, sales)
+
+    assert sold['matched_carats'].tolist() == [0, 1]
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import pandas as pd
+
+import app as diamond_app
+from services.dashboard import DashboardSnapshot, inventory_stats, rough_inventory_stats, window_totals
+
+
+class CountingStore:
+    """Passes reads through to the store and counts them per ledger."""
+    def __init__(self, store):
+        self.store = store
+        self.reads = {}
+
+    def read(self, ledger, columns=None, dtypes=None):
+        self.reads[ledger] = self.reads.get(ledger, 0) + 1
+        return self.store.read(ledger, columns, dtypes)
+
+
+def test_snapshot_reads_each_ledger_once(store):
+    counting = CountingStore(store)
+    snapshot = DashboardSnapshot(counting)
+
+    inventory_stats(snapshot)
+    inventory_stats(snapshot)
+    rough_inventory_stats(snapshot)
+
+    assert counting.reads == {'inventory': 1, 'rough_inventory': 1}
+
+
+def test_window_totals_counts_and_sums_each_window():
+    df = pd.DataFrame({
+        'date': pd.to_datetime(['2024-06-30', '2024-06-25', '2024-06-01', '2024-01-01', None]),
+        'amount': [100.0, 50.0, 25.0, 10.0, 1000.0]
+    })
+
+    totals = window_totals(df, windows=(7, 30, 365), reference='2024-07-01')
+
+    assert totals == {7: {'count': 2, 'value': 150.0},
+                      30: {'count': 3, 'value': 175.0},
+                      365: {'count': 4, 'value': 185.0}}
+
+
+def test_window_totals_compare_exact_ages():
+    df = pd.DataFrame({
+        'date': pd.to_datetime(['2024-06-24 00:00', '2024-06-23 01:00', '2024-07-02 00:00']),
+        'amount': [1.0, 2.0, 4.0]
+    })
+
+    totals = window_totals(df, windows=(7, 8), reference='2024-07-01 00:00')
+
+    # Exactly 7 days old is in the 7-day window, 7 days and 23 hours is not,
+    # and records dated after the reference are in none
+    assert totals == {7: {'count': 1, 'value': 1.0}, 8: {'count': 2, 'value': 3.0}}
+
+
+def test_window_totals_without_dates():
+    totals = window_totals(pd.DataFrame({'amount': [1.0]}), windows=(7,))
+
+    assert totals == {7: {'count': 0, 'value': 0.0}}
+
+
+def test_dashboard_reports_recent_sales(client, sell):
+    today = datetime.now().strftime('%Y-%m-%d')
+    before = diamond_app.dashboard_metrics()['recent_sales']
+    sell('Recent Buyer', date=today)
+
+    after = diamond_app.dashboard_metrics()['recent_sales']
+
+    assert after['recent_count'] == before['recent_count'] + 1
+    assert after['windows'][7]['value'] == before['windows'][7]['value'] + 1000.0
+
+
+def test_dashboard_page_renders(client, sell):
+    sell('Dashboard Buyer')
+
+    response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    assert b'Polished Inventory' in response.data
+    assert b'Recent Activity' in response.data
+
+
+def test_dashboard_shows_stock_on_hand(client, store):
+    client.post('/buy', data={'date': '2020-01-01', 'party': 'Stock Supplier', 'stone_id': 'STOCK-1',
+                              'carat': 2.5, 'quantity': 1, 'price_per_carat': 400, 'price_per_carat_inr': 33200,
+                              'payment_status': 'Pending'})
+    metrics = diamond_app.dashboard_metrics()
+
+    response = client.get('/dashboard')
+
+    assert metrics['stock_on_hand_carats'] >= 2.5
+    assert response.status_code == 200
+    assert b'Stock on Hand' in response.data
+
+
+def test_dashboard_served_uncached_when_its_version_fails(client, monkeypatch):
+    def fail(name):
+        raise RuntimeError('version unavailable')
+    monkeypatch.setattr(diamond_app.refresher, 'refreshed_at', fail)
+
+    response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    assert response.headers.get('ETag') is None
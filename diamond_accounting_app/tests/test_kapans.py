@@ -0,0 +1,69 @@
+import pytest
+
+from services.kapans import kapan_report
+from services.storage import SQLiteStore
+
+
+@pytest.fixture
+def kapan_store(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+
+    def record(tx):
+        tx.insert('purchases', {'Date': '2024-01-01', 'Kapan No': 'K1', 'Carat': 10, 'Total Amount USD': 1000})
+        tx.insert('sales', {'Date': '2024-02-01', 'Kapan No': 'K1', 'Carat': 3, 'Total Amount USD': 900})
+        tx.insert('sales', {'Date': '2024-03-01', 'Kapan No': 'K1', 'Carat': 2, 'Total Amount USD': 500})
+        # K2 was never bought, only sold and held as rough
+        tx.insert('sales', {'Date': '2024-03-01', 'Kapan No': 'K2', 'Carat': 1, 'Total Amount USD': 300})
+        tx.insert('rough_inventory', {'kapan_no': 'K2', 'weight': 4, 'pieces': 2})
+    store.submit(record)
+    return store
+
+
+def test_kapan_yield_cost_and_margin(kapan_store):
+    k1 = kapan_report(kapan_store)['kapans'][0]
+
+    assert k1['kapan'] == 'K1'
+    assert k1['first_purchase'] == '2024-01-01'
+    assert k1['polished_carats'] == 5
+    assert k1['yield_pct'] == 50
+    assert k1['cost_per_polished_carat'] == 200
+    # The five carats sold are matched at the purchase's 100/ct
+    assert k1['cost_of_goods_sold_usd'] == 500
+    assert k1['realized_margin_usd'] == 900
+    assert k1['realized_margin_pct'] == pytest.approx(900 / 1400 * 100)
+    assert k1['net_usd'] == 400
+    assert k1['rough_on_hand_carats'] == 5
+
+
+def test_kapan_without_purchases(kapan_store):
+    k2 = kapan_report(kapan_store)['kapans'][-1]
+
+    assert k2['kapan'] == 'K2'
+    assert k2['first_purchase'] is None
+    assert k2['rough_carats'] == 0
+    assert k2['yield_pct'] == 0
+    assert k2['cost_per_polished_carat'] == 0
+    assert k2['unmatched_sales'] == 1
+    assert k2['rough_inventory_carats'] == 4
+    assert k2['net_usd'] == 300
+
+
+def test_kapan_totals_derive_ratios_from_sums(kapan_store):
+    totals = kapan_report(kapan_store)['totals']
+
+    assert totals['kapans'] == 2
+    assert totals['rough_carats'] == 10
+    assert totals['polished_carats'] == 6
+    assert totals['unmatched_sales'] == 1
+    # Not the average of the kapans' yields
+    assert totals['yield_pct'] == 60
+    assert totals['cost_per_polished_carat'] == pytest.approx(1000 / 6)
+    assert totals['net_usd'] == 700
+
+
+def test_kapan_report_for_some_kapans(kapan_store):
+    report = kapan_report(kapan_store, ['K1'])
+
+    assert [row['kapan'] for row in report['kapans']] == ['K1']
+    assert report['totals']['kapans'] == 1
+    assert report['totals']['yield_pct'] == 50
@@ -0,0 +1,75 @@
+import pytest
+
+from services.payments import _cursor, page_pending_payments, page_transactions
+from services.storage import SQLiteStore
+
+
+@pytest.fixture
+def payments_store(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+
+    def record(tx):
+        for day, party in (('2024-01-02', 'Old'), ('2024-01-03', 'Tied A'), ('2024-01-03', 'Tied B')):
+            tx.insert('purchases', {'Date': day, 'Party': party, 'Total Amount INR': 100,
+                                    'Payment Status': 'Pending'})
+            tx.insert('sales', {'Date': day, 'Party': party, 'Total Amount INR': 200,
+                                'Payment Status': 'Pending'})
+        tx.insert('payments', {'id': 'PAY1', 'payment_date': '2024-01-03', 'name': 'Tied',
+                               'total_amount': 50, 'status': 'Completed'})
+        tx.insert('payments', {'id': 'PAY2', 'payment_date': '2024-01-04', 'name': 'New',
+                               'total_amount': 50, 'status': 'Completed'})
+    store.submit(record)
+    return store
+
+
+def every_page(fetch, limit):
+    """Follow the cursors from the first page to the last."""
+    pages, cursor = [], None
+    while True:
+        rows, cursor = fetch(limit=limit, cursor=cursor)
+        pages.append(rows)
+        if cursor is None:
+            return pages
+        assert len(pages) < 20, 'cursor does not advance'
+
+
+def listed(rows):
+    return [(row['type'], row['id']) for row in rows]
+
+
+def test_transaction_pages_list_every_record_once_newest_first(payments_store):
+    expected = listed(page_transactions(payments_store, limit=100)[0])
+
+    for limit in (1, 2, 3, 4):
+        pages = every_page(lambda **page: page_transactions(payments_store, **page), limit)
+        assert [row for page in pages for row in listed(page)] == expected
+
+    # Newest date first; on a tie purchases, then sales, then payments, each newest record first
+    assert expected == [('payment', 'PAY2'),
+                        ('purchase', '3'), ('purchase', '2'), ('sale', '3'), ('sale', '2'), ('payment', 'PAY1'),
+                        ('purchase', '1'), ('sale', '1')]
+
+
+def test_last_page_has_no_cursor(payments_store):
+    rows, cursor = page_transactions(payments_store, limit=8)
+    # A full page cannot tell it is the last; the page after it is empty
+    assert len(rows) == 8 and cursor is not None
+    assert page_transactions(payments_store, limit=8, cursor=cursor) == ([], None)
+
+    rows, cursor = page_transactions(payments_store, limit=9)
+    assert len(rows) == 8 and cursor is None
+
+
+def test_pending_pages_follow_the_cursor(payments_store):
+    expected = listed(page_pending_payments(payments_store, limit=100)[0])
+
+    pages = every_page(lambda **page: page_pending_payments(payments_store, **page), 2)
+
+    assert [row for page in pages for row in listed(page)] == expected
+    assert len(expected) == 6
+
+
+def test_cursor_keys_may_contain_the_separator():
+    assert _cursor('Acme|Gems|1|42') == ('Acme|Gems', 1, 42)
+    assert _cursor('2024-01-03|x') is None
+    assert _cursor(None) is None
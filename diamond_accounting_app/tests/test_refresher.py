@@ -0,0 +1,87 @@
+import time
+
+from services.refresher import PayloadRefresher
+from services.storage import SQLiteStore
+
+
+def sales_count(store):
+    return lambda: store.count('sales')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_write_makes_only_dependent_payloads_stale(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+    refresher = PayloadRefresher(store)
+    refresher.register('sales', sales_count(store), depends_on=['sales'])
+    refresher.register('payments', lambda: store.count('payments'), depends_on=['payments'])
+    assert refresher.get('sales')[0] == 0
+    refresher.get('payments')
+
+    store.submit(lambda tx: tx.insert('sales', {'Party': 'Buyer'}))
+
+    assert refresher.is_stale('sales')
+    assert not refresher.is_stale('payments')
+    # The last good payload is served until the thread recomputes it
+    assert refresher.get('sales')[0] == 0
+
+
+def test_thread_recomputes_stale_payloads(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+    refresher = PayloadRefresher(store, delay=0)
+    refresher.register('sales', sales_count(store), depends_on=['sales'])
+    refresher.get('sales')
+    refresher.start()
+    try:
+        store.submit(lambda tx: tx.insert('sales', {'Party': 'Buyer'}))
+
+        assert wait_for(lambda: refresher.get('sales')[0] == 1)
+        assert not refresher.is_stale('sales')
+    finally:
+        refresher.stop()
+
+
+def test_write_from_another_process_makes_payload_stale(tmp_path):
+    store, other = SQLiteStore(str(tmp_path)), SQLiteStore(str(tmp_path))
+    refresher = PayloadRefresher(store, poll=None)
+    refresher.register('sales', sales_count(store), depends_on=['sales'])
+    refresher.register('payments', lambda: store.count('payments'), depends_on=['payments'])
+    assert refresher.get('sales')[0] == 0
+    refresher.get('payments')
+
+    # Nothing tells this process's store about the write
+    other.submit(lambda tx: tx.insert('sales', {'Party': 'Elsewhere'}))
+
+    assert refresher.is_stale('sales')
+    assert not refresher.is_stale('payments')
+
+
+def test_poll_recomputes_after_another_process_writes(tmp_path):
+    store, other = SQLiteStore(str(tmp_path)), SQLiteStore(str(tmp_path))
+    refresher = PayloadRefresher(store, delay=0, poll=0.05)
+    refresher.register('sales', sales_count(store), depends_on=['sales'])
+    refresher.get('sales')
+    refresher.start()
+    try:
+        other.submit(lambda tx: tx.insert('sales', {'Party': 'Elsewhere'}))
+
+        assert wait_for(lambda: refresher.get('sales')[0] == 1)
+        assert not refresher.is_stale('sales')
+    finally:
+        refresher.stop()
+
+
+def test_refreshed_at_never_computes(tmp_path):
+    calls = []
+    refresher = PayloadRefresher(SQLiteStore(str(tmp_path)), poll=None)
+    refresher.register('payload', lambda: calls.append(1))
+
+    assert refresher.refreshed_at('payload') is None
+    assert calls == []
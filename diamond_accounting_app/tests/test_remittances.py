@@ -0,0 +1,119 @@
+import pytest
+
+import app as diamond_app
+from services.remittances import apply_remittance
+from services.storage import SQLiteStore
+
+
+def batch(client, *updates):
+    return client.post('/api/payment_status/batch', json=list(updates))
+
+
+def test_partial_payment_on_form_sale_stays_partial(client, sell):
+    record_id = sell('Batch Partial')
+
+    response = batch(client, {'record_type': 'sale', 'record_id': record_id, 'status': 'Partial',
+                              'amount': 1, 'date': '2024-02-01', 'currency': 'INR'})
+
+    assert response.status_code == 200
+    result = response.get_json()['results'][0]
+    assert result['payment_status'] == 'Partial'
+    assert result['received_inr'] == 1
+
+
+def test_partial_payments_complete_form_sale_when_paid(client, sell):
+    record_id = sell('Batch Complete')
+    update = {'record_type': 'sale', 'record_id': record_id, 'status': 'Partial',
+              'date': '2024-02-01', 'currency': 'INR'}
+
+    first = batch(client, dict(update, amount=40000)).get_json()['results'][0]
+    # Paying more than is still open completes the sale too
+    second = batch(client, dict(update, amount=50000)).get_json()['results'][0]
+
+    assert first['payment_status'] == 'Partial'
+    assert second['payment_status'] == 'Completed'
+    # Installments are converted at the rate the sale's totals imply
+    assert round(second['received_usd'], 2) == round(90000 / 83, 2)
+
+
+def test_completed_on_form_sale(client, sell):
+    record_id = sell('Batch Completed')
+
+    response = batch(client, {'record_type': 'sale', 'record_id': record_id, 'status': 'Completed',
+                              'date': '2024-02-01',
+                              'security_hash': diamond_app.generate_security_hash(83000.0)})
+
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['payment_status'] == 'Completed'
+
+
+def test_tampered_hash_is_rejected(client, sell, store):
+    record_id = sell('Batch Tampered')
+
+    response = batch(client, {'record_type': 'sale', 'record_id': record_id, 'status': 'Completed',
+                              'security_hash': diamond_app.generate_security_hash(1.0)})
+
+    assert response.status_code == 400
+    assert response.get_json()['results'][0]['error'] == 'Data integrity check failed.'
+    assert store.get('sales', record_id)['payment_status'] == 'Pending'
+
+
+@pytest.fixture
+def invoices(tmp_path):
+    """A store with open and completed sales of one party, and their IDs."""
+    store = SQLiteStore(str(tmp_path))
+    ids = {
+        'newer': store.insert('sales', {'Party': 'Remit', 'Date': '2024-03-01', 'Total Amount INR': 300,
+                                        'Total Amount USD': 3, 'Payment Status': 'Pending'}),
+        'undated': store.insert('sales', {'Party': 'Remit', 'Total Amount INR': 500,
+                                          'Payment Status': 'Pending'}),
+        'oldest': store.insert('sales', {'Party': 'Remit', 'Date': '2024-01-01', 'Total Amount INR': 100,
+                                         'Total Amount USD': 1, 'Payment Status': 'Partial'}),
+        'paid': store.insert('sales', {'Party': 'Remit', 'Date': '2023-12-01', 'Total Amount INR': 900,
+                                       'Payment Status': 'Completed'})
+    }
+    return store, ids
+
+
+def test_remittance_settles_oldest_invoices_first(invoices):
+    store, ids = invoices
+
+    result = apply_remittance(store, 'sales', 250, party='Remit', date='2024-04-01')
+
+    # Dated invoices oldest first, undated ones last; completed ones are left alone
+    assert [(a['record_id'], a['applied'], a['payment_status']) for a in result['allocations']] == [
+        (ids['oldest'], 100, 'Completed'), (ids['newer'], 150, 'Partial')]
+    assert result['unallocated'] == 0
+    assert store.received('sales', [ids['newer']])['received_inr'].tolist() == [150]
+
+
+def test_partial_remittance_leaves_later_invoices_open(invoices):
+    store, ids = invoices
+
+    result = apply_remittance(store, 'sales', 40, party='Remit')
+
+    assert [(a['record_id'], a['applied'], a['remaining_inr']) for a in result['allocations']] == [
+        (ids['oldest'], 40, 60)]
+    assert store.received('sales', [ids['newer'], ids['undated']]).empty
+
+
+def test_overpayment_completes_every_invoice_and_reports_the_rest(invoices):
+    store, ids = invoices
+
+    result = apply_remittance(store, 'sales', 1000, party='Remit')
+
+    assert [a['record_id'] for a in result['allocations']] == [ids['oldest'], ids['newer'], ids['undated']]
+    assert {a['payment_status'] for a in result['allocations']} == {'Completed'}
+    assert (result['allocated'], result['unallocated']) == (900, 100)
+
+
+def test_remittance_to_listed_invoices_keeps_their_order(invoices):
+    store, ids = invoices
+
+    result = apply_remittance(store, 'sales', 2, record_ids=[ids['newer'], ids['paid'], ids['oldest']],
+                              currency='USD')
+
+    # USD goes at each invoice's own rate; the completed one is reported back
+    assert [(a['record_id'], a['applied']) for a in result['allocations']] == [(ids['newer'], 2)]
+    assert result['skipped'] == [ids['paid']]
+    assert store.received('sales', [ids['newer']])['received_inr'].tolist() == [200]
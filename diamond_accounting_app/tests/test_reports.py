@@ -0,0 +1,57 @@
+def test_sales_report_filters_by_party(client, sell):
+    sell('Report Party A', carat=2.0)
+    sell('Report Party A', carat=1.0, date='2024-03-10')
+    sell('Report Party B')
+
+    data = client.get('/api/reports/sales', query_string={'party': 'report party a'}).get_json()
+
+    assert data['filters'] == {'party': 'report party a'}
+    assert data['summary']['records'] == 2
+    assert data['summary']['carats'] == 3.0
+    assert data['summary']['amount_usd'] == 3000.0
+    assert [row['month'] for row in data['by_month']] == ['2024-01', '2024-03']
+    # Newest first
+    assert [row['date'] for row in data['records']] == ['2024-03-10', '2024-01-15']
+
+
+def test_report_date_range_posted_as_form(client, sell):
+    sell('Report Range', date='2023-05-01')
+    sell('Report Range', date='2023-06-01')
+
+    data = client.post('/api/reports/sales', data={'party': 'Report Range', 'start_date': '2023-05-15',
+                                                   'end_date': '2023-06-30'}).get_json()
+
+    assert data['summary']['records'] == 1
+    assert data['records'][0]['date'] == '2023-06-01'
+
+
+def test_profit_loss_report(client, sell):
+    sell('Report PnL', date='2022-02-01')
+
+    data = client.get('/api/reports/profit_loss', query_string={'party': 'Report PnL'}).get_json()
+
+    assert [row['month'] for row in data['months']] == ['2022-02']
+    assert data['totals']['profit_usd'] == 1000.0
+
+
+def test_unknown_report(client):
+    response = client.get('/api/reports/nothing')
+
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'Unknown report: nothing'}
+
+
+def test_reports_page_renders(client, sell):
+    sell('Reports Page Buyer')
+
+    response = client.get('/reports')
+
+    assert response.status_code == 200
+    assert b'Profit Margin' in response.data
+
+
+def test_reports_page_for_a_period(client):
+    response = client.get('/reports', query_string={'start': '2024-01', 'end': '2024-03'})
+
+    assert response.status_code == 200
+    assert b'Error generating reports' not in response.data
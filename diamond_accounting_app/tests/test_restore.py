@@ -0,0 +1,72 @@
+import io
+import zipfile
+
+import app as diamond_app
+
+
+def pay_for(store, record_id):
+    """Record a payment referencing a sale and return its record ID."""
+    return store.insert('payments', {'name': 'Restore', 'reference_id': str(record_id),
+                                     'reference_type': 'sale', 'total_amount': 1.0})
+
+
+def test_workbook_restore_keeps_record_ids(client, sell, store):
+    # A deleted sale leaves a gap, so positions and record IDs differ
+    store.delete('sales', sell('Restore Gap'))
+    record_id = sell('Restore Kept')
+    payment_id = pay_for(store, record_id)
+    client.post('/api/payment_status/batch', json=[{
+        'record_type': 'sale', 'record_id': record_id, 'status': 'Partial',
+        'amount': 1000, 'date': '2024-02-01', 'currency': 'INR'}])
+
+    with zipfile.ZipFile(io.BytesIO(client.get('/backup').data)) as backup:
+        workbook = backup.read('sales.xlsx')
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, 'w') as only_sales:
+        only_sales.writestr('sales.xlsx', workbook)
+    upload.seek(0)
+    client.post('/restore', data={'backup_file': (upload, 'backup.zip')})
+
+    assert store.get('sales', record_id)['party'] == 'Restore Kept'
+    assert store.get('payments', payment_id)['reference_id'] == str(record_id)
+    assert [line['amount'] for line in store.payment_lines('sales', record_id)] == [1000]
+
+
+def test_positional_workbook_restore_remaps_references(sell, store):
+    store.delete('sales', sell('Remap Gap'))
+    record_id = sell('Remap Moved')
+    payment_id = pay_for(store, record_id)
+
+    # Without a record_id column the records are numbered afresh
+    store.replace('sales', store.read('sales'))
+
+    moved = store.select('sales', ['Party'], where=[('Party', '=', 'Remap Moved')]).index[-1]
+    assert moved != record_id
+    assert store.get('payments', payment_id)['reference_id'] == str(moved)
+
+
+def test_record_details_of_form_sale(client, sell):
+    record_id = sell('Details Form')
+
+    details = client.get(f'/get_record_details?record_type=sale&record_id={record_id}').get_json()
+
+    assert details['Total Amount USD'] == 1000
+    assert details['Total Amount INR'] == 83000
+    # The rate the sale's totals imply
+    assert details['Rate'] == 83
+    assert details['remaining_amount_inr'] == 83000
+    assert details['security_hash'] == diamond_app.generate_security_hash(83000.0)
+
+
+def test_update_payment_status_of_form_sale(client, sell, store):
+    record_id = sell('Status Form')
+
+    client.post('/update_payment_status', data={
+        'record_type': 'sale', 'record_id': record_id, 'payment_status': 'Partial',
+        'total_amount_inr': 83000, 'original_exchange_rate': 83,
+        'security_hash': diamond_app.generate_security_hash(83000.0),
+        'partial_amount': 8300, 'partial_payment_date': '2024-02-01', 'payment_currency': 'INR'})
+
+    status = diamond_app.field_value(store.get('sales', record_id), 'sales', 'Payment Status')
+    assert status == 'Partial'
+    assert store.payment_lines('sales', record_id)[0]['amount_usd'] == 100
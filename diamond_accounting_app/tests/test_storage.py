@@ -0,0 +1,95 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from services.storage import SQLiteStore
+
+
+def test_projected_read_parses_dates_with_and_without_time(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+
+    def insert(tx):
+        tx.insert('sales', {'Date': datetime(2024, 1, 5, 10, 30)})
+        tx.insert('sales', {'Date': '2024-01-06'})
+        # Day first, like the ledgers' dd/mm/yyyy dates
+        tx.insert('sales', {'Date': '06/01/2024'})
+        tx.insert('sales', {'Date': 'not a date'})
+    store.submit(insert)
+
+    dates = store.read('sales', ['Date'])['Date']
+
+    assert str(dates.dtype) == 'datetime64[ns]'
+    assert dates.tolist()[:3] == [pd.Timestamp('2024-01-05 10:30'), pd.Timestamp('2024-01-06'),
+                                  pd.Timestamp('2024-01-06')]
+    assert pd.isna(dates.tolist()[3])
+
+
+def test_columns_of_open_transactions_stay_private(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        with store.transaction() as tx:
+            tx.insert('sales', {'Uncommitted': 1})
+            assert 'Uncommitted' in store._column_map(tx.conn, 'sales')
+            # Other connections only see committed columns
+            assert 'Uncommitted' not in store.columns('sales')
+            raise RuntimeError('roll back')
+
+    assert 'Uncommitted' not in store.columns('sales')
+    store.insert('sales', {'Committed': 1})
+    assert 'Committed' in store.columns('sales')
+
+
+def test_rolled_back_mutation_leaves_column_maps_alone(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+
+    def replace_then_fail(tx):
+        tx.replace('sales', pd.DataFrame({'Replaced': [1]}))
+        raise ValueError('roll back')
+    with pytest.raises(ValueError):
+        store.submit(replace_then_fail)
+
+    assert 'Replaced' not in store.columns('sales')
+    assert 'Party' in store.columns('sales')
+    store.insert('sales', {'Party': 'After'})
+    assert store.read('sales', ['Party'])['Party'].tolist()[-1] == 'After'
+
+
+def test_sequence_ids_stay_unique_across_concurrent_writers(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+    issued = {}
+
+    def take(worker):
+        issued[worker] = [int(store.next_ids('payment')[0]) for _ in range(25)]
+    workers = [threading.Thread(target=take, args=(w,)) for w in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    ids = [i for taken in issued.values() for i in taken]
+    assert sorted(ids) == list(range(1, 201))
+    # Each writer sees its IDs rise
+    assert all(taken == sorted(taken) for taken in issued.values())
+
+
+def test_sequences_never_go_back_after_a_restore(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'data'))
+    assert store.next_ids('inventory', 2) == ['D1', 'D2']
+    copy = store.backup_to(str(tmp_path / 'copy.db'))
+    assert store.next_ids('inventory') == ['D3']
+
+    store.restore_from(copy)
+
+    assert store.next_ids('inventory') == ['D4']
+
+
+def test_sequences_skip_ids_of_imported_records(tmp_path):
+    store = SQLiteStore(str(tmp_path))
+    assert store.next_ids('payment') == ['1']
+
+    store.replace('payments', pd.DataFrame({'id': ['7', '12'], 'name': ['Imported', 'Imported']}))
+
+    assert store.next_ids('payment') == ['13']
@@ -0,0 +1,16 @@
+from services.storage import Transaction
+
+
+def test_sale_reports_a_failed_payment_record(client, sell, store, monkeypatch):
+    def fail(self, sequence, count=1):
+        raise RuntimeError('sequence unavailable')
+    monkeypatch.setattr(Transaction, 'next_ids', fail)
+
+    record_id = sell('Payment Record Fails')
+
+    with client.session_transaction() as session:
+        flashes = session.pop('_flashes', [])
+    assert ('warning', 'Sale recorded, but its payment record could not be created.') in flashes
+    assert store.get('sales', record_id)['party'] == 'Payment Record Fails'
+    payments = store.select('payments', ['name'], where=[('name', '=', 'Payment Record Fails')])
+    assert payments.empty
@@ -0,0 +1,44 @@
+import time
+
+import app as diamond_app
+
+
+def flash_message(client, message):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', message)]
+
+
+def test_json_view_leaves_flash_messages_pending(client):
+    flash_message(client, 'Sale recorded.')
+
+    response = client.get('/api/reports/rollup')
+
+    assert response.status_code == 200
+    assert response.headers.get('ETag') is None
+    with client.session_transaction() as session:
+        assert session['_flashes'] == [('success', 'Sale recorded.')]
+
+
+def test_page_showing_flash_messages_is_not_cached(client):
+    flash_message(client, 'Sale recorded.')
+
+    response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    assert b'Sale recorded.' in response.data
+    assert response.headers.get('ETag') is None
+    with client.session_transaction() as session:
+        assert '_flashes' not in session
+
+
+def test_unchanged_page_is_not_modified(client):
+    client.get('/dashboard')
+    # Let a refresh after earlier writes finish first
+    deadline = time.monotonic() + 5
+    while diamond_app.refresher.is_stale('dashboard') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    etag = client.get('/dashboard').headers['ETag']
+
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304